@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@File: benchmark_backend.py
+@Desc: 对比 torch / onnx / onnx-int8 三种推理后端：以 torch 分数为基准检查精度，并测量吞吐
+用法: python benchmark_backend.py --model bge-reranker-base/bge-reranker-base --threads 4
+      可用 --data 指定 JSON 文件（[{"query": ..., "documents": [...]}, ...]）替换内置样本
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+BACKENDS = {
+    "torch": {"backend": "torch", "quantize": "none"},
+    "onnx": {"backend": "onnx", "quantize": "none"},
+    "onnx-int8": {"backend": "onnx", "quantize": "int8"},
+}
+
+# 内置样本：中英文片段拼接成长短不一的文档，模拟 RAG 召回结果
+QUERIES = [
+    "如何在香港注册有限公司", "山东企业赴港上市需要哪些材料", "How do I open a corporate bank account in Hong Kong",
+    "青岛港到香港的海运时间", "港澳居民在济南购房政策", "What are the tax benefits of the Greater Bay Area",
+]
+SENTENCES = [
+    "香港公司注册一般需要提供董事及股东身份证明、注册地址和公司章程。",
+    "在香港开立公司银行账户通常需要董事亲自到场，银行会审核业务背景与资金来源。",
+    "山东企业赴港上市需聘请保荐人、审计师与律师，并按联交所要求编制招股书。",
+    "青岛港至香港的集装箱航线每周多班，海运时间约为三至五天。",
+    "济南对港澳居民购房的政策与本地居民基本一致，需提供工作或学习证明。",
+    "The Greater Bay Area offers preferential individual income tax for eligible overseas talent.",
+    "Opening a corporate account in Hong Kong requires know-your-customer documents for all directors.",
+    "Hong Kong applies a two-tier profits tax regime with a lower rate on the first two million dollars.",
+    "泰山位于山东省泰安市，是国家首批重点风景名胜区。",
+    "孔子故里曲阜的三孔景区包括孔庙、孔府和孔林。",
+]
+
+
+def load_app(path: str):
+    spec = importlib.util.spec_from_file_location("rerank_app", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def sample_requests(count: int, documents: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    requests = []
+    for index in range(count):
+        docs = []
+        for _ in range(documents):
+            # 多数为短片段，少数为长段落
+            length = rng.randint(1, 3) if rng.random() < 0.8 else rng.randint(8, 20)
+            docs.append("".join(rng.choice(SENTENCES) for _ in range(length)))
+        requests.append({"query": QUERIES[index % len(QUERIES)], "documents": docs})
+    return requests
+
+
+def build_reranker(app, model_path: str, backend: str, quantize: str, threads: int):
+    return app.ReRanker(model_path, backend=backend, quantize=quantize, threads=threads)
+
+
+def spearman(a: np.ndarray, b: np.ndarray) -> float:
+    rank_a = np.argsort(np.argsort(a))
+    rank_b = np.argsort(np.argsort(b))
+    if len(a) < 2:
+        return 1.0
+    return float(np.corrcoef(rank_a, rank_b)[0, 1])
+
+
+def compare(baseline: list, scores: list, top_k: int = 5) -> dict:
+    """逐请求对比排序：分数差、Spearman 秩相关、top-1 一致率与 top-k 重合率"""
+    diffs, correlations, top1, overlap = [], [], [], []
+    for expected, actual in zip(baseline, scores):
+        expected, actual = np.asarray(expected), np.asarray(actual)
+        diffs.append(np.abs(expected - actual))
+        correlations.append(spearman(expected, actual))
+        top1.append(int(np.argmax(expected) == np.argmax(actual)))
+        k = min(top_k, len(expected))
+        overlap.append(len(set(np.argsort(-expected)[:k]) & set(np.argsort(-actual)[:k])) / k)
+    diffs = np.concatenate(diffs)
+    return {
+        "max_abs_diff": round(float(diffs.max()), 6),
+        "mean_abs_diff": round(float(diffs.mean()), 6),
+        "spearman": round(float(np.mean(correlations)), 4),
+        "top1_agreement": round(float(np.mean(top1)), 4),
+        f"top{top_k}_overlap": round(float(np.mean(overlap)), 4),
+    }
+
+
+def run_backend(reranker, requests: list, repeat: int) -> tuple:
+    pairs = [[[request["query"], doc] for doc in request["documents"]] for request in requests]
+    scores = [reranker.compute_score(pair) for pair in pairs[:2]]  # 预热
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        scores = [reranker.compute_score(pair) for pair in pairs]
+        elapsed.append(time.perf_counter() - start)
+    total_pairs = sum(len(pair) for pair in pairs)
+    best = min(elapsed)
+    return scores, {"pairs": total_pairs, "seconds": round(best, 3), "pairs_per_second": round(total_pairs / best, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="rerank 推理后端精度与吞吐对比")
+    parser.add_argument("--app", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "rerank_server.py"))
+    parser.add_argument("--model", required=True, help="模型目录")
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--threads", type=int, default=0, help="torch 与 ONNX Runtime 的算子内线程数，0 为默认")
+    parser.add_argument("--requests", type=int, default=24)
+    parser.add_argument("--documents", type=int, default=20, help="每个请求的文档数")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--data", help="JSON 文件，格式同 /v1/rerank 请求体列表")
+    parser.add_argument("--json", dest="json_path", help="结果另存为 JSON")
+    args = parser.parse_args()
+
+    app = load_app(args.app)
+    if args.threads > 0:
+        app.torch.set_num_threads(args.threads)
+    if args.data:
+        with open(args.data, "r", encoding="utf-8") as f:
+            requests = json.load(f)
+    else:
+        requests = sample_requests(args.requests, args.documents)
+
+    names = [name.strip() for name in args.backends.split(",") if name.strip()]
+    if names[0] != "torch":
+        names.insert(0, "torch")  # 精度以 torch 分数为基准
+    results, baseline = {}, None
+    for name in names:
+        start = time.perf_counter()
+        reranker = build_reranker(app, args.model, threads=args.threads, **BACKENDS[name])
+        load_seconds = round(time.perf_counter() - start, 2)
+        scores, throughput = run_backend(reranker, requests, args.repeat)
+        result = {"load_seconds": load_seconds, **throughput}
+        if baseline is None:
+            baseline = scores
+        else:
+            result.update(compare(baseline, scores))
+        results[name] = result
+        del reranker
+
+    base_rate = results["torch"]["pairs_per_second"]
+    print(f"{'后端':<12}{'对/秒':>10}{'加速':>8}{'最大误差':>12}{'Spearman':>10}{'top1一致':>10}{'top5重合':>10}")
+    for name, result in results.items():
+        print(f"{name:<12}{result['pairs_per_second']:>10}{result['pairs_per_second'] / base_rate:>8.2f}"
+              f"{result.get('max_abs_diff', 0):>12.6f}{result.get('spearman', 1):>10.4f}"
+              f"{result.get('top1_agreement', 1):>10.4f}{result.get('top5_overlap', 1):>10.4f}")
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time: 2023/11/7 22:45
+@Author: zhidong
+@File: app.py
+@Desc: 多模型服务入口，服务实现见 rerank_server.py（镜像内与本文件同目录，源码中在上级目录）
+"""
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(HERE))
+# 未设置 MODEL_DIR 时模型放在本目录下，每个子目录是一个模型
+os.environ.setdefault("MODEL_DIR", HERE)
+
+from rerank_server import main
+
+if __name__ == "__main__":
+    main()
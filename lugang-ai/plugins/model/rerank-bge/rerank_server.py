@@ -0,0 +1,674 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time: 2023/11/7 22:45
+@Author: zhidong
+@File: rerank_server.py
+@Desc: bge-reranker 重排服务，各模型目录下的 app.py 只是入口：单进程托管 RERANK_MODELS 中的模型，
+       按请求中的 model 字段路由，按需加载，超出内存预算时卸载最久未用的模型
+"""
+import os
+import inspect
+import gc
+import asyncio
+import hashlib
+import queue
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import numpy as np
+import torch
+import uvicorn
+from fastapi import FastAPI, Security, HTTPException
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from FlagEmbedding import FlagReranker
+from pydantic import BaseModel
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional, List
+
+app = FastAPI()
+security = HTTPBearer()
+env_bearer_token = 'ACCESS_TOKEN'
+
+class QADocs(BaseModel):
+    query: Optional[str]
+    documents: Optional[List[str]]
+    model: Optional[str] = None
+
+
+# 模型目录 MODEL_DIR 下每个子目录是一个模型，RERANK_MODELS 为可用模型（逗号分隔），第一个为默认模型；
+# MODEL_MEMORY_MB 为已加载模型权重的内存预算（0 为不限），超出时卸载最久未用且空闲的模型；
+# PRELOAD_MODELS 为启动时预先加载的模型，默认只加载默认模型
+MODEL_DIR = os.getenv("MODEL_DIR", os.path.dirname(os.path.abspath(__file__)))
+RERANK_MODELS = [name.strip() for name in os.getenv(
+    "RERANK_MODELS", "bge-reranker-base,bge-reranker-large,bge-reranker-v2-m3").split(",") if name.strip()]
+DEFAULT_MODEL = RERANK_MODELS[0]
+MODEL_MEMORY_MB = float(os.getenv("MODEL_MEMORY_MB", "0"))
+PRELOAD_MODELS = [name.strip() for name in os.getenv("PRELOAD_MODELS", DEFAULT_MODEL).split(",") if name.strip()]
+# 权重文件大小作为加载前的内存估算，加载后以实际参数占用为准
+WEIGHT_FILES = ("model.safetensors", "pytorch_model.bin")
+# 微批处理：第一个请求到达后最多等待 BATCH_WAIT_MS 毫秒收集并发请求，一批最多 BATCH_MAX_PAIRS 个 (query, document) 对
+BATCH_MAX_PAIRS = int(os.getenv("BATCH_MAX_PAIRS", "64"))
+BATCH_WAIT_MS = float(os.getenv("BATCH_WAIT_MS", "2"))
+# 长度分桶：预先分词后按 token 数排序切批，每批 条数 × 批内最长长度（补齐后的 token 数）不超过 BATCH_MAX_TOKENS
+BATCH_MAX_TOKENS = int(os.getenv("BATCH_MAX_TOKENS", "16384"))
+MAX_LENGTH = int(os.getenv("MAX_LENGTH", "512"))
+# 分数缓存：内存 LRU 上限 SCORE_CACHE_MAX_MB（0 为关闭）；设置 SCORE_CACHE_PATH 时内存未命中再查 sqlite 磁盘缓存，
+# 磁盘最多保留 SCORE_CACHE_DISK_MAX_ENTRIES 条
+SCORE_CACHE_MAX_MB = float(os.getenv("SCORE_CACHE_MAX_MB", "64"))
+SCORE_CACHE_PATH = os.getenv("SCORE_CACHE_PATH")
+SCORE_CACHE_DISK_MAX_ENTRIES = int(os.getenv("SCORE_CACHE_DISK_MAX_ENTRIES", "1000000"))
+# 推理后端：RERANK_BACKEND=torch（默认）或 onnx；onnx 后端首次加载时把模型导出到 <模型目录>/onnx/，
+# ONNX_QUANTIZE=int8 时使用动态 int8 量化模型，ONNX_THREADS 为算子内线程数（0 为 ONNX Runtime 默认）
+RERANK_BACKEND = os.getenv("RERANK_BACKEND", "torch").lower()
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "none").lower()
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))
+
+
+def _move_exported(tmp_dir: str, onnx_dir: str, model_file: str):
+    """导出在临时目录中完成，外部权重文件先移入，模型文件最后移入，中断时不会留下不完整的模型"""
+    for name in os.listdir(tmp_dir):
+        if name != model_file:
+            os.replace(os.path.join(tmp_dir, name), os.path.join(onnx_dir, name))
+    os.replace(os.path.join(tmp_dir, model_file), os.path.join(onnx_dir, model_file))
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def export_onnx(model_path: str, quantize: str = "none") -> str:
+    """导出 ONNX 模型（已存在时直接返回路径）：batch 与序列长度为动态维度，输出 logits；
+    quantize=int8 时在 fp32 模型基础上做动态 int8 量化（权重 int8，激活运行时量化）"""
+    onnx_dir = os.path.join(model_path, "onnx")
+    fp32_path = os.path.join(onnx_dir, "model.onnx")
+    target = os.path.join(onnx_dir, "model.int8.onnx") if quantize == "int8" else fp32_path
+    if os.path.exists(target):
+        return target
+    os.makedirs(onnx_dir, exist_ok=True)
+    if not os.path.exists(fp32_path):
+        import onnx
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        model = AutoModelForSequenceClassification.from_pretrained(model_path).eval()
+        encoded = tokenizer([["query", "document"]], return_tensors="pt")
+        # 导出时输入按 forward 的参数顺序排列，input_names 需与之一致
+        sample = {name: encoded[name] for name in inspect.signature(model.forward).parameters if name in encoded}
+        axes = {name: {0: "batch", 1: "sequence"} for name in sample}
+        axes["logits"] = {0: "batch"}
+        tmp_dir = os.path.join(onnx_dir, f".tmp-{os.getpid()}")
+        os.makedirs(tmp_dir, exist_ok=True)
+        export_dir = os.path.join(tmp_dir, "export")
+        os.makedirs(export_dir, exist_ok=True)
+        with torch.no_grad():
+            # 超过 2GB 的模型（如 v2-m3）torch 会把每个权重写成单独的外部数据文件
+            torch.onnx.export(model, (sample,), os.path.join(export_dir, "model.onnx"), input_names=list(sample),
+                              output_names=["logits"], dynamic_axes=axes, opset_version=14)
+        # 统一重存为 model.onnx + 单个外部数据文件 model.onnx.data
+        onnx.save_model(onnx.load(os.path.join(export_dir, "model.onnx")), os.path.join(tmp_dir, "model.onnx"),
+                        save_as_external_data=True, all_tensors_to_one_file=True, location="model.onnx.data")
+        shutil.rmtree(export_dir, ignore_errors=True)
+        _move_exported(tmp_dir, onnx_dir, "model.onnx")
+        print(f"ONNX 模型已导出：{fp32_path}")
+    if quantize == "int8":
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        tmp_dir = os.path.join(onnx_dir, f".tmp-{os.getpid()}")
+        os.makedirs(tmp_dir, exist_ok=True)
+        quantize_dynamic(fp32_path, os.path.join(tmp_dir, "model.int8.onnx"), weight_type=QuantType.QInt8)
+        _move_exported(tmp_dir, onnx_dir, "model.int8.onnx")
+        print(f"int8 量化模型已生成：{target}")
+    return target
+
+
+class OnnxCrossEncoder(object):
+    """ONNX Runtime CPU 推理，提供与 FlagReranker 相同的 tokenizer，前向计算返回 logits"""
+    def __init__(self, model_path: str, quantize: str = ONNX_QUANTIZE, threads: int = ONNX_THREADS):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.path = export_onnx(model_path, quantize)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+
+    def forward(self, features: List[dict]) -> np.ndarray:
+        inputs = self.tokenizer.pad(features, padding=True, return_tensors='np')
+        logits = self.session.run(None, {name: inputs[name].astype(np.int64) for name in self.input_names})[0]
+        return logits.reshape(-1).astype(np.float32)
+
+    def memory_bytes(self) -> int:
+        # 权重文件大小即为主要内存占用：int8 模型为单个文件；fp32 模型连同外部数据文件，
+        # 按 onnx/ 下除 int8 模型与临时目录外的所有文件计算（兼容旧版导出的逐权重外部文件）
+        onnx_dir = os.path.dirname(self.path)
+        if os.path.basename(self.path) == "model.int8.onnx":
+            return os.path.getsize(self.path)
+        return sum(os.path.getsize(os.path.join(onnx_dir, name)) for name in os.listdir(onnx_dir)
+                   if not name.startswith(("model.int8.onnx", ".tmp-"))
+                   and os.path.isfile(os.path.join(onnx_dir, name)))
+
+class ReRanker(object):
+    def __init__(self, model_path, max_tokens: int = BATCH_MAX_TOKENS, max_length: int = MAX_LENGTH,
+                 backend: str = RERANK_BACKEND, quantize: str = ONNX_QUANTIZE, threads: int = ONNX_THREADS):
+        if backend == "onnx":
+            self.reranker = OnnxCrossEncoder(model_path, quantize, threads)
+        else:
+            self.reranker = FlagReranker(model_path, use_fp16=False)
+        self.backend = backend
+        self.max_tokens = max_tokens
+        self.max_length = max_length
+
+    def memory_bytes(self) -> int:
+        if isinstance(self.reranker, OnnxCrossEncoder):
+            return self.reranker.memory_bytes()
+        return sum(param.numel() * param.element_size() for param in self.reranker.model.parameters())
+
+    def length_batches(self, lengths: List[int]) -> List[List[int]]:
+        """按长度升序切批，长短文档不混在一批里补齐；单条超过预算时独占一批"""
+        order = sorted(range(len(lengths)), key=lengths.__getitem__)
+        batches, batch = [], []
+        for index in order:
+            if batch and (len(batch) + 1) * lengths[index] > self.max_tokens:
+                batches.append(batch)
+                batch = []
+            batch.append(index)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @torch.no_grad()
+    def forward(self, features: List[dict]) -> np.ndarray:
+        if isinstance(self.reranker, OnnxCrossEncoder):
+            return self.reranker.forward(features)
+        inputs = self.reranker.tokenizer.pad(features, padding=True, return_tensors='pt').to(self.reranker.device)
+        logits = self.reranker.model(**inputs, return_dict=True).logits
+        return logits.view(-1, ).float().cpu().numpy()
+
+    def compute_score(self, pairs: List[List[str]]):
+        if len(pairs) > 0:
+            # 只分词一次，按批补齐后直接送入模型；分词与截断方式同 FlagReranker.compute_score
+            encoded = self.reranker.tokenizer(pairs, truncation=True, max_length=self.max_length)
+            lengths = [len(ids) for ids in encoded["input_ids"]]
+            scores = np.empty(len(pairs), dtype=np.float64)
+            for batch in self.length_batches(lengths):
+                scores[batch] = self.forward([{key: encoded[key][i] for key in encoded.keys()} for i in batch])
+            # 按原顺序返回，与 normalize=True 一致做 sigmoid
+            return (1 / (1 + np.exp(-scores))).tolist()
+        else:
+            return None
+
+class BatchJob(object):
+    """一个请求的 (query, document) 对，推理线程算完后通过事件循环回填结果"""
+    def __init__(self, pairs: List[List[str]], loop: asyncio.AbstractEventLoop):
+        self.pairs = pairs
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def resolve(self, scores=None, error: Optional[Exception] = None):
+        self.loop.call_soon_threadsafe(self._set, scores, error)
+
+    def _set(self, scores, error):
+        if self.future.done():  # 调用方已断开
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(scores)
+
+
+class MicroBatcher(object):
+    """把并发请求合并成一次 compute_score：请求进入队列，专用推理线程按时间窗口或对数上限取出一批，
+    推理结果按请求切分后回填；事件循环不再被推理阻塞"""
+    def __init__(self, rerank_model_path: str, max_pairs: int = BATCH_MAX_PAIRS, wait_ms: float = BATCH_WAIT_MS):
+        self.rerank_model_path = rerank_model_path
+        self.max_pairs = max_pairs
+        self.wait = wait_ms / 1000
+        self.jobs = queue.Queue()
+        self.carry = None  # 上一批放不下、留到下一批的请求
+        self.thread = None
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.batched_requests = 0
+        self.batched_pairs = 0
+        self.batch_errors = 0
+        self.memory_bytes = None  # 模型加载后的实际参数占用
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True,
+                                               name=f"rerank-{os.path.basename(self.rerank_model_path)}")
+                self.thread.start()
+
+    def stop(self):
+        self.jobs.put(None)
+
+    async def submit(self, pairs: List[List[str]]) -> List[float]:
+        # 入队前校验，避免一个请求的非法输入让同批其他请求一起失败
+        for pair in pairs:
+            if len(pair) != 2 or not all(isinstance(text, str) for text in pair):
+                raise ValueError("query 与 documents 必须为字符串")
+        self.start()
+        job = BatchJob(pairs, asyncio.get_running_loop())
+        self.jobs.put(job)
+        return await job.future
+
+    def _collect(self) -> Optional[List[BatchJob]]:
+        first, self.carry = self.carry, None
+        if first is None:
+            first = self.jobs.get()
+            if first is None:
+                return None
+        batch, size = [first], len(first.pairs)
+        deadline = time.monotonic() + self.wait
+        while size < self.max_pairs:
+            # 时间窗口结束后仍取走已在排队的请求
+            timeout = deadline - time.monotonic()
+            try:
+                job = self.jobs.get(timeout=timeout) if timeout > 0 else self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                self.jobs.put(None)
+                break
+            if size + len(job.pairs) > self.max_pairs:
+                self.carry = job
+                break
+            batch.append(job)
+            size += len(job.pairs)
+        return batch
+
+    def _load(self) -> ReRanker:
+        reranker = ReRanker(self.rerank_model_path)
+        self.memory_bytes = reranker.memory_bytes()
+        print(f"模型已加载：{self.rerank_model_path}（{self.memory_bytes / 1024 / 1024:.0f} MB）")
+        return reranker
+
+    def _run(self):
+        reranker = None
+        try:
+            reranker = self._load()
+        except Exception as e:  # 首批请求时重试，错误返回给调用方
+            print(f"模型加载失败：\n{e}")
+        while True:
+            batch = self._collect()
+            if batch is None:
+                # 卸载：释放本线程持有的模型
+                del reranker
+                gc.collect()
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                return
+            pairs = [pair for job in batch for pair in job.pairs]
+            self.batches += 1
+            self.batched_requests += len(batch)
+            self.batched_pairs += len(pairs)
+            try:
+                if reranker is None:
+                    reranker = self._load()
+            except Exception as e:
+                for job in batch:
+                    job.resolve(error=e)
+                continue
+            try:
+                scores = reranker.compute_score(pairs)
+            except Exception as e:
+                self.batch_errors += 1
+                if len(batch) == 1:
+                    batch[0].resolve(error=e)
+                    continue
+                # 合并推理失败时逐个请求重算，只让出错的请求失败
+                for job in batch:
+                    try:
+                        job.resolve(reranker.compute_score(job.pairs))
+                    except Exception as job_error:
+                        job.resolve(error=job_error)
+                continue
+            offset = 0
+            for job in batch:
+                job.resolve(scores[offset:offset + len(job.pairs)])
+                offset += len(job.pairs)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "requests": self.batched_requests,
+            "pairs": self.batched_pairs,
+            "batch_errors": self.batch_errors,
+            "avg_pairs_per_batch": round(self.batched_pairs / self.batches, 2) if self.batches else None,
+            "queued": self.jobs.qsize(),
+        }
+
+
+class ScoreCache(object):
+    """(query, document) 对的分数缓存，各模型共用，键为 模型名 + query 哈希 + document 哈希；
+    内存按 LRU 淘汰并限制估算占用，可选 sqlite 磁盘层（内存未命中时查询，命中后提升回内存）"""
+    # 每条内存占用估算：OrderedDict 节点与哈希表槽位
+    ENTRY_OVERHEAD = 120
+
+    def __init__(self, max_bytes: int, path: Optional[str] = None,
+                 disk_max_entries: int = SCORE_CACHE_DISK_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.path = path
+        self.db = None
+        self.db_lock = threading.Lock()
+        self.disk_max_entries = disk_max_entries
+        self.disk_writes = 0
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS scores (key BLOB PRIMARY KEY, score REAL NOT NULL)")
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or self.db is not None
+
+    def keys(self, model_name: str, query: str, documents: List[str]) -> List[bytes]:
+        # 截断长度、推理后端与量化方式不同分数也不同，一并计入缓存键
+        namespace = f"{model_name}:{MAX_LENGTH}:{RERANK_BACKEND}:{ONNX_QUANTIZE}"
+        namespace = hashlib.sha1(namespace.encode("utf-8")).digest()[:8]
+        query_hash = hashlib.sha1(query.encode("utf-8")).digest()
+        return [namespace + query_hash + hashlib.sha1(doc.encode("utf-8")).digest() for doc in documents]
+
+    def _remember(self, key: bytes, score: float):
+        """写入内存层并按占用上限淘汰最久未用的条目，调用方持有 self.lock"""
+        if self.max_bytes <= 0:
+            return
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.entries[key] = score
+            return
+        self.entries[key] = score
+        self.bytes += sys.getsizeof(key) + sys.getsizeof(score) + self.ENTRY_OVERHEAD
+        while self.bytes > self.max_bytes and self.entries:
+            old_key, old_score = self.entries.popitem(last=False)
+            self.bytes -= sys.getsizeof(old_key) + sys.getsizeof(old_score) + self.ENTRY_OVERHEAD
+            self.evictions += 1
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[float]]:
+        scores = [None] * len(keys)
+        missing = []
+        with self.lock:
+            for index, key in enumerate(keys):
+                score = self.entries.get(key)
+                if score is None:
+                    missing.append(index)
+                else:
+                    self.entries.move_to_end(key)
+                    scores[index] = score
+            self.hits += len(keys) - len(missing)
+        if missing and self.db is not None:
+            found = self._disk_get([keys[index] for index in missing])
+            with self.lock:
+                for index in missing:
+                    score = found.get(keys[index])
+                    if score is not None:
+                        scores[index] = score
+                        self._remember(keys[index], score)
+                self.disk_hits += len(found)
+            missing = [index for index in missing if scores[index] is None]
+        with self.lock:
+            self.misses += len(missing)
+        return scores
+
+    def put_many(self, keys: List[bytes], scores: List[float]):
+        with self.lock:
+            for key, score in zip(keys, scores):
+                self._remember(key, score)
+        if self.db is not None:
+            self._disk_put(keys, scores)
+
+    def _disk_get(self, keys: List[bytes]) -> dict:
+        found = {}
+        with self.db_lock:
+            # sqlite 单条语句的参数个数有上限，分段查询
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self.db.execute(
+                    f"SELECT key, score FROM scores WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                found.update((bytes(key), score) for key, score in rows)
+        return found
+
+    def _disk_put(self, keys: List[bytes], scores: List[float]):
+        with self.db_lock:
+            self.db.execute("BEGIN")
+            self.db.executemany("INSERT OR REPLACE INTO scores (key, score) VALUES (?, ?)", zip(keys, scores))
+            self.db.execute("COMMIT")
+            self.disk_writes += len(keys)
+            # 每写入约 1% 上限条数清理一次，按 rowid 删除最早写入的条目
+            if self.disk_writes >= max(self.disk_max_entries // 100, 1):
+                self.disk_writes = 0
+                self.db.execute("DELETE FROM scores WHERE rowid <= (SELECT MAX(rowid) FROM scores) - ?",
+                                (self.disk_max_entries,))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "disk_path": self.path,
+        }
+
+
+def estimate_model_bytes(model_path: str) -> int:
+    sizes = [os.path.getsize(os.path.join(model_path, name)) for name in WEIGHT_FILES
+             if os.path.exists(os.path.join(model_path, name))]
+    return max(sizes) if sizes else 0
+
+
+class ModelSlot(object):
+    """一个已加载（或正在加载）的模型：独立的推理线程与微批队列"""
+    def __init__(self, name: str, model_path: str):
+        self.name = name
+        self.batcher = MicroBatcher(model_path)
+        self.estimated_bytes = estimate_model_bytes(model_path)
+        self.in_flight = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.batcher.memory_bytes if self.batcher.memory_bytes is not None else self.estimated_bytes
+
+    async def submit(self, pairs: List[List[str]]) -> List[float]:
+        return await self.batcher.submit(pairs)
+
+
+class ModelPool(object):
+    """按模型名管理 ModelSlot：首次请求时加载；加载前若超出内存预算，卸载最久未用且没有进行中请求的模型，
+    其余模型都在处理请求时仍然加载（暂时超出预算）"""
+    def __init__(self, model_dir: str, names: List[str], max_bytes: int):
+        self.model_dir = model_dir
+        self.names = names
+        self.max_bytes = max_bytes
+        self.slots = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+
+    def model_path(self, name: str) -> str:
+        return os.path.join(self.model_dir, name)
+
+    def get(self, name: Optional[str]) -> ModelSlot:
+        name = name or DEFAULT_MODEL
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = ModelSlot(name, self.model_path(name))
+            if not self._make_room(slot.estimated_bytes):
+                print(f"模型内存预算不足（已用 {self.used_bytes() / 1024 / 1024:.0f} MB），其余模型正在处理请求，继续加载")
+            self.slots[name] = slot
+            self.loads += 1
+            slot.batcher.start()
+        self.slots.move_to_end(name)
+        return slot
+
+    @contextmanager
+    def use(self, name: Optional[str]):
+        """请求处理期间占用模型，占用中的模型不会被卸载"""
+        slot = self.get(name)
+        slot.in_flight += 1
+        try:
+            yield slot
+        finally:
+            slot.in_flight -= 1
+            slot.last_used = time.monotonic()
+            # 曾因其他模型占用而超出预算时，请求结束后卸载空闲模型回到预算内
+            self._make_room(0)
+
+    def _make_room(self, needed: int) -> bool:
+        """按最久未用顺序卸载空闲模型，直到能容纳 needed 字节；返回是否在预算内"""
+        if self.max_bytes <= 0:
+            return True
+        for name in list(self.slots):
+            if self.used_bytes() + needed <= self.max_bytes:
+                return True
+            if self.slots[name].in_flight == 0:
+                self.unload(name)
+        return self.used_bytes() + needed <= self.max_bytes
+
+    def unload(self, name: str):
+        slot = self.slots.pop(name, None)
+        if slot is not None:
+            slot.batcher.stop()
+            self.evictions += 1
+            print(f"模型已卸载：{name}")
+
+    def used_bytes(self) -> int:
+        return sum(slot.memory_bytes for slot in self.slots.values())
+
+    def stop(self):
+        for name in list(self.slots):
+            self.slots.pop(name).batcher.stop()
+
+    def models(self) -> List[dict]:
+        return [{
+            "id": name,
+            "default": name == DEFAULT_MODEL,
+            "available": os.path.isdir(self.model_path(name)),
+            "loaded": name in self.slots,
+        } for name in self.names]
+
+    def stats(self) -> dict:
+        return {
+            "max_bytes": self.max_bytes,
+            "used_bytes": self.used_bytes(),
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "models": {name: {
+                "memory_bytes": slot.memory_bytes,
+                "in_flight": slot.in_flight,
+                "idle_seconds": round(time.monotonic() - slot.last_used, 1),
+                "batcher": slot.batcher.stats(),
+            } for name, slot in self.slots.items()},
+        }
+
+
+model_pool = ModelPool(MODEL_DIR, RERANK_MODELS, int(MODEL_MEMORY_MB * 1024 * 1024))
+score_cache = ScoreCache(int(SCORE_CACHE_MAX_MB * 1024 * 1024), SCORE_CACHE_PATH)
+
+
+@app.on_event("startup")
+async def preload_models():
+    for name in PRELOAD_MODELS:
+        if name in RERANK_MODELS:
+            model_pool.get(name)
+
+
+@app.on_event("shutdown")
+async def stop_models():
+    model_pool.stop()
+
+
+class Chat(object):
+    def __init__(self, slot: ModelSlot, cache: ScoreCache = score_cache):
+        self.slot = slot
+        self.cache = cache
+
+    async def _cache_call(self, method, *args):
+        # 有磁盘层时放到线程池执行，避免阻塞事件循环
+        if self.cache.db is None:
+            return method(*args)
+        return await asyncio.to_thread(method, *args)
+
+    async def fit_query_answer_rerank(self, query_docs: QADocs) -> List:
+        if query_docs is None or len(query_docs.documents) == 0:
+            return []
+
+        if not self.cache.enabled:
+            pair = [[query_docs.query, doc] for doc in query_docs.documents]
+            scores = await self.slot.submit(pair)
+        else:
+            # 只把未命中缓存的对送去推理
+            keys = self.cache.keys(self.slot.name, query_docs.query, query_docs.documents)
+            scores = await self._cache_call(self.cache.get_many, keys)
+            missing = [index for index, score in enumerate(scores) if score is None]
+            if missing:
+                pair = [[query_docs.query, query_docs.documents[index]] for index in missing]
+                computed = await self.slot.submit(pair)
+                for index, score in zip(missing, computed):
+                    scores[index] = score
+                await self._cache_call(self.cache.put_many, [keys[index] for index in missing], computed)
+
+        new_docs = []
+        for index, score in enumerate(scores):
+            new_docs.append({"index": index, "text": query_docs.documents[index], "score": score})
+        results = [{"index": documents["index"], "relevance_score": documents["score"]} for documents in list(sorted(new_docs, key=lambda x: x["score"], reverse=True))]
+        return results
+
+def verify_token(credentials: HTTPAuthorizationCredentials):
+    token = credentials.credentials
+    if env_bearer_token is not None and token != env_bearer_token:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+@app.post('/v1/rerank')
+async def handle_post_request(docs: QADocs, credentials: HTTPAuthorizationCredentials = Security(security)):
+    verify_token(credentials)
+    # 只托管一个模型时（单模型镜像）忽略 model 字段，与原单模型服务一致
+    model = docs.model if len(RERANK_MODELS) > 1 else DEFAULT_MODEL
+    if (model or DEFAULT_MODEL) not in RERANK_MODELS:
+        raise HTTPException(status_code=400, detail=f"Unknown model: {model}, available: {', '.join(RERANK_MODELS)}")
+    try:
+        with model_pool.use(model) as slot:
+            results = await Chat(slot).fit_query_answer_rerank(docs)
+        return {"results": results}
+    except Exception as e:
+        print(f"报错：\n{e}")
+        return {"error": "重排出错"}
+
+@app.get('/v1/metrics')
+async def handle_metrics_request(credentials: HTTPAuthorizationCredentials = Security(security)):
+    verify_token(credentials)
+    return {"score_cache": score_cache.stats(), "model_pool": model_pool.stats()}
+
+@app.get('/v1/models')
+async def handle_models_request(credentials: HTTPAuthorizationCredentials = Security(security)):
+    verify_token(credentials)
+    return {"data": model_pool.models()}
+
+def main():
+    global env_bearer_token
+    token = os.getenv("ACCESS_TOKEN")
+    if token is not None:
+        env_bearer_token = token
+    try:
+        uvicorn.run(app, host='0.0.0.0', port=6006)
+    except Exception as e:
+        print(f"API启动失败！\n报错：\n{e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 上游并发控制与准入
+Lu-Gang Connect - Upstream Concurrency Limits & Admission Control
+每个服务商一个并发上限与有界等待队列，队列按用户类型优先级出队，
+排队超过截止时间或队列已满时快速拒绝并给出 Retry-After
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, Optional
+
+# 数值越小越优先：商务与投资用户优先准入
+DEFAULT_PRIORITIES = {"business": 0, "investor": 0, "student": 1, "visitor": 2}
+
+
+class AdmissionRejected(Exception):
+    """准入被拒绝：queue_full 返回 429，queue_timeout 返回 503"""
+
+    def __init__(self, provider: str, reason: str, retry_after: int):
+        self.provider = provider
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status_code = 429 if reason == "queue_full" else 503
+        message = "请求排队已满" if reason == "queue_full" else "请求排队超时"
+        super().__init__(f"{message}（{provider}），请 {retry_after} 秒后重试")
+
+
+class ProviderLimiter:
+    """单个服务商的并发信号量 + 优先级等待队列"""
+
+    def __init__(self, name: str, max_concurrency: int = 32, max_queue: int = 128,
+                 queue_timeout: float = 5.0, alpha: float = 0.2):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.alpha = alpha
+        self.active = 0
+        self.queued = 0
+        self.ewma_service_time: Optional[float] = None
+        self._waiters: List[list] = []  # [优先级, 序号, future]
+        self._sequence = itertools.count()
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+
+    def retry_after(self) -> int:
+        """按排队深度与平均服务时间估算重试等待秒数"""
+        service_time = self.ewma_service_time or 1.0
+        return max(1, math.ceil((self.queued + 1) / self.max_concurrency * service_time))
+
+    def saturated(self) -> bool:
+        return self.active >= self.max_concurrency and self.queued >= self.max_queue
+
+    async def acquire(self, priority: int) -> float:
+        """获取并发名额，返回排队等待秒数；队列满或超时抛出 AdmissionRejected"""
+        if self.active < self.max_concurrency and not self.queued:
+            self.active += 1
+            self.admitted += 1
+            return 0.0
+        if self.queued >= self.max_queue:
+            self.rejected_full += 1
+            raise AdmissionRejected(self.name, "queue_full", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._sequence), future])
+        self.queued += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self.queued -= 1
+                self.rejected_timeout += 1
+                raise AdmissionRejected(self.name, "queue_timeout", self.retry_after())
+            # 超时与分配名额同时发生，按已准入处理
+        except asyncio.CancelledError:
+            if future.done():
+                self.release()  # 名额已分配但请求被取消，交还名额
+            else:
+                future.cancel()
+                self.queued -= 1
+            raise
+        self.admitted += 1
+        return time.monotonic() - started
+
+    def release(self, service_time: Optional[float] = None):
+        """释放名额：有等待者时直接转交给优先级最高的等待者"""
+        if service_time is not None:
+            self.ewma_service_time = service_time if self.ewma_service_time is None else \
+                self.alpha * service_time + (1 - self.alpha) * self.ewma_service_time
+        while self._waiters:
+            future = heapq.heappop(self._waiters)[2]
+            if not future.done():
+                self.queued -= 1
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_full,
+            "rejected_queue_timeout": self.rejected_timeout,
+            "ewma_service_ms": round(self.ewma_service_time * 1000, 1) if self.ewma_service_time else None,
+        }
+
+
+class AdmissionController:
+    """按服务商限流，按用户类型排优先级；metrics 为可选的指标记录对象"""
+
+    def __init__(self, limiters: Dict[str, ProviderLimiter], priorities: Optional[Dict[str, int]] = None,
+                 metrics=None):
+        self.limiters = limiters
+        self.priorities = dict(DEFAULT_PRIORITIES if priorities is None else priorities)
+        self.default_priority = max(self.priorities.values(), default=0)
+        self.metrics = metrics
+
+    @classmethod
+    def from_env(cls, providers: Iterable[str], metrics=None) -> "AdmissionController":
+        """读取 LUGANG_<PROVIDER>_MAX_CONCURRENCY / _MAX_QUEUE，LUGANG_ADMISSION_QUEUE_TIMEOUT，
+        LUGANG_ADMISSION_PRIORITIES（如 "business=0,investor=0,student=1,visitor=2"）；
+        多 worker 部署时（LUGANG_WORKERS）上限为全部 worker 合计，按 worker 数均分"""
+        queue_timeout = float(os.getenv("LUGANG_ADMISSION_QUEUE_TIMEOUT", "5"))
+        workers = max(1, int(os.getenv("LUGANG_WORKERS", "1")))
+        limiters = {}
+        for name in providers:
+            prefix = f"LUGANG_{name.upper()}_"
+            limiters[name] = ProviderLimiter(
+                name,
+                max_concurrency=max(1, math.ceil(int(os.getenv(prefix + "MAX_CONCURRENCY", "32")) / workers)),
+                max_queue=math.ceil(int(os.getenv(prefix + "MAX_QUEUE", "128")) / workers),
+                queue_timeout=queue_timeout,
+            )
+        priorities = None
+        if os.getenv("LUGANG_ADMISSION_PRIORITIES"):
+            priorities = {}
+            for item in os.environ["LUGANG_ADMISSION_PRIORITIES"].split(","):
+                user_type, _, value = item.partition("=")
+                if user_type.strip():
+                    priorities[user_type.strip()] = int(value)
+        return cls(limiters, priorities, metrics)
+
+    def priority(self, user_type: str) -> int:
+        return self.priorities.get(user_type, self.default_priority)
+
+    def _report(self, provider: str):
+        if self.metrics is not None:
+            limiter = self.limiters[provider]
+            self.metrics.set_admission_state(provider, limiter.active, limiter.queued)
+
+    @asynccontextmanager
+    async def slot(self, provider: str, user_type: str = "visitor"):
+        """在服务商名额内执行上游调用"""
+        limiter = self.limiters[provider]
+        priority = self.priority(user_type)
+        try:
+            wait = await limiter.acquire(priority)
+        except AdmissionRejected as e:
+            if self.metrics is not None:
+                self.metrics.record_admission_rejection(provider, e.reason)
+            raise
+        finally:
+            self._report(provider)
+        if self.metrics is not None:
+            self.metrics.observe_admission_wait(provider, priority, wait)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            limiter.release(time.monotonic() - started)
+            self._report(provider)
+
+    def saturated(self, providers: Iterable[str]) -> Optional[AdmissionRejected]:
+        """候选服务商均已满载（并发与队列都已占满）时返回拒绝信息，用于在检索前快速拒绝"""
+        limiters = [self.limiters[name] for name in providers if name in self.limiters]
+        if not limiters or not all(limiter.saturated() for limiter in limiters):
+            return None
+        best = min(limiters, key=lambda limiter: limiter.retry_after())
+        for limiter in limiters:
+            limiter.rejected_full += 1
+            if self.metrics is not None:
+                self.metrics.record_admission_rejection(limiter.name, "queue_full")
+        return AdmissionRejected(best.name, "queue_full", best.retry_after())
+
+    def stats(self) -> Dict:
+        return {
+            "priorities": self.priorities,
+            "providers": {name: limiter.stats() for name, limiter in self.limiters.items()},
+        }
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 网关压测与延迟基准
+Lu-Gang Connect - Gateway Load Test & Latency Benchmark
+启动本地模拟上游与网关，按固定并发档位压测 /api/v1/query，
+输出 RPS 与 p50/p95/p99，并按路由、缓存、检索、上游各阶段拆分；
+记录每个响应的传输字节数与解压后字节数，用于比较不同压缩协商下的负载大小；
+可保存结果并与基线比较，发版前发现延迟回退
+
+用法: python lugang_bench.py --concurrency 1,8,32 --duration 10 --latency 0.3
+      python lugang_bench.py --json result.json --baseline baseline.json --max-regression 0.15
+      python lugang_bench.py --gateway-url http://127.0.0.1:8000   # 压测已运行的网关
+      python lugang_bench.py --endpoint knowledge --accept-encoding identity   # 压测知识库接口、不压缩
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from lugang_timing import parse_server_timing
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_QUESTIONS = [
+    "香港公司注册需要什么条件？",
+    "跨境电商税务如何处理？",
+    "我想了解香港的教育资源",
+    "How do I open a bank account in Hong Kong?",
+    "鲁港合作有哪些重点领域？",
+    "山东企业到香港上市的流程是什么？",
+    "香港的知识产权保护如何？",
+    "内地居民如何申请香港人才签证？",
+]
+
+PHASES = ["routing", "cache", "retrieval", "upstream_ttfb", "upstream"]
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    return {"p50": percentile(values, 0.50), "p95": percentile(values, 0.95), "p99": percentile(values, 0.99)}
+
+
+class LevelResult:
+    """单个并发档位的采样结果（毫秒）"""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.latencies: List[float] = []
+        self.phases: Dict[str, List[float]] = {phase: [] for phase in PHASES}
+        self.errors = 0
+        self.upstream_errors = 0
+        self.wire_bytes = 0
+        self.body_bytes = 0
+        self.elapsed = 0.0
+
+    def add(self, latency_ms: float, phases: Dict[str, float]):
+        self.latencies.append(latency_ms)
+        self.wire_bytes += int(phases.pop("__wire_bytes", 0))
+        self.body_bytes += int(phases.pop("__body_bytes", 0))
+        for name, value in phases.items():
+            self.phases.setdefault(name, []).append(value)
+
+    def to_dict(self) -> Dict:
+        count = len(self.latencies)
+        return {
+            "concurrency": self.concurrency,
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "upstream_errors": self.upstream_errors,
+            "rps": round(len(self.latencies) / self.elapsed, 2) if self.elapsed else 0.0,
+            "latency_ms": summarize(self.latencies),
+            "phases_ms": {name: summarize(values) for name, values in self.phases.items() if values},
+            "bytes_per_response": {
+                "wire": round(self.wire_bytes / count) if count else None,
+                "decoded": round(self.body_bytes / count) if count else None,
+            },
+        }
+
+
+def _record_bytes(phases: Dict[str, float], response: httpx.Response) -> Dict[str, float]:
+    """传输字节数（压缩后）与解压后字节数，以 __ 前缀混在阶段耗时里带回"""
+    phases["__wire_bytes"] = float(response.num_bytes_downloaded)
+    phases["__body_bytes"] = float(len(response.content))
+    return phases
+
+
+async def _query_once(client: httpx.AsyncClient, url: str, payload: Dict) -> Dict[str, float]:
+    """发送一次非流式查询，返回服务端各阶段耗时"""
+    response = await client.post(url, json=payload)
+    response.raise_for_status()
+    phases = parse_server_timing(response.headers.get("server-timing", ""))
+    if response.headers.get("x-lugang-upstream") == "error":
+        phases["__upstream_error"] = 1.0
+    return _record_bytes(phases, response)
+
+
+async def _knowledge_once(client: httpx.AsyncClient, url: str, payload: Dict) -> Dict[str, float]:
+    """拉取一次完整知识库（只读大响应，用于比较压缩效果）"""
+    response = await client.get(url)
+    response.raise_for_status()
+    return _record_bytes({}, response)
+
+
+async def _stream_once(client: httpx.AsyncClient, url: str, payload: Dict) -> Dict[str, float]:
+    """发送一次流式查询，读取到 done 事件为止，阶段耗时取自 done 事件"""
+    phases: Dict[str, float] = {}
+    started = time.perf_counter()
+    async with client.stream("POST", url, json=payload) as response:
+        response.raise_for_status()
+        event = ""
+        async for line in response.aiter_lines():
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                if event == "delta" and "client_ttfb" not in phases:
+                    phases["client_ttfb"] = (time.perf_counter() - started) * 1000
+                elif event == "error":
+                    phases["__upstream_error"] = 1.0
+                elif event == "done":
+                    data = json.loads(line[5:].strip())
+                    phases.update(parse_server_timing(data.get("server_timing", "")))
+    return phases
+
+
+async def run_level(base_url: str, concurrency: int, duration: float, warmup: float,
+                    questions: List[str], stream: bool, unique: bool, endpoint: str = "query",
+                    accept_encoding: str = "br, gzip") -> LevelResult:
+    """在固定并发下持续压测 duration 秒，预热阶段的样本不计入"""
+    result = LevelResult(concurrency)
+    if endpoint == "knowledge":
+        url = f"{base_url.rstrip('/')}/api/v1/knowledge/both"
+        once = _knowledge_once
+    else:
+        url = f"{base_url.rstrip('/')}/api/v1/query"
+        once = _stream_once if stream else _query_once
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {"Accept-Encoding": accept_encoding}
+    counter = 0
+
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(60.0), headers=headers) as client:
+        started = time.perf_counter()
+        measure_from = started + warmup
+        deadline = measure_from + duration
+
+        async def worker(worker_id: int):
+            nonlocal counter
+            while True:
+                now = time.perf_counter()
+                if now >= deadline:
+                    return
+                counter += 1
+                question = questions[counter % len(questions)]
+                if unique:
+                    question = f"{question} #{worker_id}-{counter}"
+                payload = {"question": question, "stream": stream}
+                try:
+                    phases = await once(client, url, payload)
+                except (httpx.HTTPError, ValueError):
+                    if now >= measure_from:
+                        result.errors += 1
+                    continue
+                if now < measure_from:
+                    continue
+                if phases.pop("__upstream_error", None):
+                    result.upstream_errors += 1
+                result.add((time.perf_counter() - now) * 1000, phases)
+
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        result.elapsed = time.perf_counter() - measure_from
+    return result
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"进程提前退出: {' '.join(process.args)}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"等待服务就绪超时: {url}")
+
+
+def start_stack(args) -> List[subprocess.Popen]:
+    """启动模拟上游与网关子进程，返回进程列表"""
+    stub_cmd = [
+        sys.executable, os.path.join(HERE, "lugang_stub_upstream.py"),
+        "--port", str(args.stub_port), "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--error-rate", str(args.error_rate), "--chunks", str(args.chunks), "--chunk-delay", str(args.chunk_delay),
+    ]
+    stub = subprocess.Popen(stub_cmd, cwd=HERE)
+    processes = [stub]
+    try:
+        _wait_ready(f"http://127.0.0.1:{args.stub_port}/stats", stub)
+        stub_url = f"http://127.0.0.1:{args.stub_port}"
+        env = dict(os.environ)
+        env.update({
+            "DEEPSEEK_API_KEY": env.get("DEEPSEEK_API_KEY") or "bench",
+            "QWEN_API_KEY": env.get("QWEN_API_KEY") or "bench",
+            "DEEPSEEK_API_URL": f"{stub_url}/deepseek/v1/chat/completions",
+            "QWEN_API_URL": f"{stub_url}/qwen/v1/chat/completions",
+        })
+        if not args.cache:
+            env["LUGANG_CACHE_BACKEND"] = "off"
+        gateway = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "lugang_connect:app",
+            "--host", "127.0.0.1", "--port", str(args.port), "--log-level", "warning",
+            "--workers", str(args.workers),
+        ], cwd=HERE, env=env)
+        processes.append(gateway)
+        # /health 在预热完成前即返回 200，压测需等到 /ready
+        _wait_ready(f"http://127.0.0.1:{args.port}/ready", gateway)
+    except Exception:
+        stop_stack(processes)
+        raise
+    return processes
+
+
+def stop_stack(processes: List[subprocess.Popen]):
+    for process in reversed(processes):
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def print_report(results: List[Dict]):
+    print(f"{'并发':>6} {'请求数':>8} {'错误':>6} {'RPS':>9}  {'p50':>8} {'p95':>8} {'p99':>8}  (ms)")
+    for level in results:
+        latency = level["latency_ms"]
+        print(f"{level['concurrency']:>6} {level['requests']:>8} {level['errors'] + level['upstream_errors']:>6} "
+              f"{level['rps']:>9.1f}  {_fmt(latency['p50']):>8} {_fmt(latency['p95']):>8} {_fmt(latency['p99']):>8}")
+        for name, summary in level["phases_ms"].items():
+            print(f"{'':>6} {'└ ' + name:<33}{_fmt(summary['p50']):>8} {_fmt(summary['p95']):>8} {_fmt(summary['p99']):>8}")
+        size = level.get("bytes_per_response", {})
+        if size.get("wire"):
+            print(f"{'':>6} {'└ 平均响应字节（传输/解压后）':<27}{size['wire']:>8} {size['decoded']:>8}")
+
+
+def compare_baseline(results: List[Dict], baseline: List[Dict], max_regression: float) -> List[str]:
+    """与基线逐档比较 p99 与 RPS，超出允许回退幅度时返回问题列表"""
+    problems = []
+    previous = {level["concurrency"]: level for level in baseline}
+    for level in results:
+        base = previous.get(level["concurrency"])
+        if base is None:
+            continue
+        p99, base_p99 = level["latency_ms"]["p99"], base["latency_ms"]["p99"]
+        if p99 is not None and base_p99 and p99 > base_p99 * (1 + max_regression):
+            problems.append(f"并发 {level['concurrency']}: p99 {base_p99:.1f}ms -> {p99:.1f}ms")
+        if base["rps"] and level["rps"] < base["rps"] * (1 - max_regression):
+            problems.append(f"并发 {level['concurrency']}: RPS {base['rps']:.1f} -> {level['rps']:.1f}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="鲁港通网关压测与延迟基准")
+    parser.add_argument("--gateway-url", help="压测已运行的网关，不启动本地模拟上游与网关")
+    parser.add_argument("--port", type=int, default=8765, help="本地网关端口")
+    parser.add_argument("--workers", type=int, default=1, help="本地网关 uvicorn worker 数")
+    parser.add_argument("--stub-port", type=int, default=9100, help="模拟上游端口")
+    parser.add_argument("--latency", type=float, default=0.3, help="模拟上游延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.05, help="模拟上游延迟抖动（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟上游错误率")
+    parser.add_argument("--chunks", type=int, default=20, help="模拟上游流式分片数")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="模拟上游流式分片间隔（秒）")
+    parser.add_argument("--concurrency", default="1,8,32", help="并发档位，逗号分隔")
+    parser.add_argument("--duration", type=float, default=10.0, help="每档压测时长（秒）")
+    parser.add_argument("--warmup", type=float, default=2.0, help="每档预热时长（秒）")
+    parser.add_argument("--stream", action="store_true", help="使用流式接口")
+    parser.add_argument("--endpoint", choices=["query", "knowledge"], default="query",
+                        help="压测接口：query 为问答，knowledge 为完整知识库")
+    parser.add_argument("--accept-encoding", default="br, gzip", help="请求的 Accept-Encoding，identity 表示不压缩")
+    parser.add_argument("--cache", action="store_true", help="启用网关问答缓存（默认关闭以测量完整链路）")
+    parser.add_argument("--repeat-questions", action="store_true",
+                        help="重复使用固定问题（默认追加序号避免缓存与请求合并）")
+    parser.add_argument("--questions", help="问题列表文件，每行一个")
+    parser.add_argument("--json", dest="json_path", help="结果保存路径")
+    parser.add_argument("--baseline", help="基线结果文件，用于回退检查")
+    parser.add_argument("--max-regression", type=float, default=0.15, help="允许的 p99/RPS 回退比例")
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    levels = [int(item) for item in args.concurrency.split(",") if item.strip()]
+
+    processes = []
+    base_url = args.gateway_url
+    if base_url is None:
+        processes = start_stack(args)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    results = []
+    try:
+        for concurrency in levels:
+            print(f"⏱  并发 {concurrency}，压测 {args.duration}s ...")
+            level = asyncio.run(run_level(base_url, concurrency, args.duration, args.warmup,
+                                          questions, args.stream, not args.repeat_questions,
+                                          args.endpoint, args.accept_encoding))
+            results.append(level.to_dict())
+    finally:
+        stop_stack(processes)
+
+    print_report(results)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("json_path", "baseline")},
+        "results": results,
+    }
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ 结果已保存: {args.json_path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            problems = compare_baseline(results, json.load(f)["results"], args.max_regression)
+        if problems:
+            print("❌ 相对基线出现性能回退:")
+            for problem in problems:
+                print(f"   {problem}")
+            sys.exit(1)
+        print("✅ 未超出基线允许的回退范围")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 问答结果缓存
+Lu-Gang Connect - Answer Cache
+按规范化问题 + 语言 + 知识库 + 用户类型 + 模型缓存回答，支持 LRU/TTL 淘汰、
+内存上限、命中统计，基于 MinHash 的近似问题命中，以及按检索词项精确失效
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def normalize_question(question: str) -> str:
+    """规范化问题：全半角统一、转小写、去除空白与标点"""
+    text = unicodedata.normalize("NFKC", question).lower()
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] not in ("P", "Z", "S", "C"))
+
+
+def make_cache_key(question: str, language: str, knowledge_base: str, user_type: str, model: str) -> str:
+    """生成缓存键"""
+    raw = "\x1f".join((normalize_question(question), language, knowledge_base, user_type, model))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """进程内缓存：OrderedDict 实现 LRU，按条目数与字节数双重上限淘汰"""
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, Tuple[float, int, str]]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, _, value = item
+        if expires_at < time.time():
+            self.delete(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, ttl: float):
+        size = len(key) + len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        self.delete(key)
+        self._data[key] = (time.time() + ttl, size, value)
+        self._bytes += size
+        while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._data.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def delete(self, key: str):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._bytes -= item[1]
+
+    def clear(self):
+        self._data.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict:
+        return {"backend": "memory", "entries": len(self._data), "bytes": self._bytes,
+                "max_entries": self.max_entries, "max_bytes": self.max_bytes, "evictions": self.evictions}
+
+
+class SQLiteCacheBackend:
+    """磁盘缓存：SQLite 存储，按最近访问时间做 LRU 淘汰，进程重启后仍可命中"""
+
+    persistent = True
+
+    def __init__(self, path: str, max_entries: int = 100000):
+        self.path = path
+        self.max_entries = max_entries
+        self.evictions = 0
+        # 每写入约 1% 上限条数才统计条数并淘汰一次，避免每次写入都全表 COUNT；条数可短暂超出上限约 1%
+        self.trim_interval = max(max_entries // 100, 1)
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answer_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_accessed ON answer_cache(accessed_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM answer_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM answer_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE answer_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answer_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now),
+            )
+            self._writes += 1
+            if self._writes < self.trim_interval:
+                return
+            self._writes = 0
+            count = self._conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0]
+            if count > self.max_entries:
+                overflow = count - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM answer_cache WHERE key IN "
+                    "(SELECT key FROM answer_cache ORDER BY accessed_at LIMIT ?)",
+                    (overflow,),
+                )
+                self.evictions += overflow
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM answer_cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answer_cache")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "entries": count,
+                "max_entries": self.max_entries, "evictions": self.evictions}
+
+
+class MinHashIndex:
+    """近似问题索引：问题字符二元组的 MinHash 签名 + LSH 分桶"""
+
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, threshold: float = 0.7, num_perm: int = 64, bands: int = 16, max_entries: int = 10000):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+        # 固定种子的哈希参数，保证多进程间签名一致
+        self._params = [
+            (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") | 1,
+             int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big"))
+            for i in range(num_perm)
+        ]
+        self._signatures: "OrderedDict[str, Tuple[str, List[int]]]" = OrderedDict()
+        self._buckets: Dict[Tuple, set] = {}
+
+    def signature(self, normalized: str) -> List[int]:
+        shingles = {normalized[i:i + 2] for i in range(max(len(normalized) - 1, 1))}
+        hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles]
+        prime = self._PRIME
+        return [min((a * h + b) % prime for h in hashes) for a, b in self._params]
+
+    def _band_keys(self, scope: str, signature: List[int]):
+        rows = self.rows
+        for band in range(self.bands):
+            yield (scope, band, tuple(signature[band * rows:(band + 1) * rows]))
+
+    def add(self, key: str, scope: str, normalized: str):
+        if key in self._signatures:
+            self._signatures.move_to_end(key)
+            return
+        signature = self.signature(normalized)
+        self._signatures[key] = (scope, signature)
+        for band_key in self._band_keys(scope, signature):
+            self._buckets.setdefault(band_key, set()).add(key)
+        while len(self._signatures) > self.max_entries:
+            old_key, _ = next(iter(self._signatures.items()))
+            self.remove(old_key)
+
+    def remove(self, key: str):
+        item = self._signatures.pop(key, None)
+        if item is None:
+            return
+        for band_key in self._band_keys(*item):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def query(self, scope: str, normalized: str) -> Optional[str]:
+        """返回相似度超过阈值且最相近的已缓存键"""
+        signature = self.signature(normalized)
+        candidates = set()
+        for band_key in self._band_keys(scope, signature):
+            candidates.update(self._buckets.get(band_key, ()))
+        best_key, best_similarity = None, self.threshold
+        for key in candidates:
+            other = self._signatures[key][1]
+            similarity = sum(1 for x, y in zip(signature, other) if x == y) / self.num_perm
+            if similarity >= best_similarity:
+                best_key, best_similarity = key, similarity
+        return best_key
+
+    def clear(self):
+        self._signatures.clear()
+        self._buckets.clear()
+
+
+class TermDependencyIndex:
+    """缓存键与其问题检索词项的双向索引：知识库条目变更时，只有检索词项与条目词项有交集的回答可能受影响"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._key_terms: "OrderedDict[str, Tuple[str, ...]]" = OrderedDict()
+        self._term_keys: Dict[str, set] = {}
+
+    def add(self, key: str, terms: Iterable[str]):
+        self.remove(key)
+        terms = tuple(terms)
+        self._key_terms[key] = terms
+        for term in terms:
+            self._term_keys.setdefault(term, set()).add(key)
+        while len(self._key_terms) > self.max_entries:
+            self.remove(next(iter(self._key_terms)))
+
+    def remove(self, key: str):
+        for term in self._key_terms.pop(key, ()):
+            keys = self._term_keys.get(term)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._term_keys[term]
+
+    def pop_dependents(self, terms: Iterable[str]) -> set:
+        """取出并移除依赖任一词项的缓存键"""
+        keys = set()
+        for term in terms:
+            keys.update(self._term_keys.get(term, ()))
+        for key in keys:
+            self.remove(key)
+        return keys
+
+    def clear(self):
+        self._key_terms.clear()
+        self._term_keys.clear()
+
+    def __len__(self) -> int:
+        return len(self._key_terms)
+
+
+class AnswerCache:
+    """问答缓存：精确键命中优先，未命中时可走近似问题索引；
+    异步接口（aget/aput/ainvalidate/aclear/astats）在持久化后端下转到线程池执行，避免磁盘读写阻塞事件循环"""
+
+    def __init__(self, backend, ttl: float = 3600.0, near_duplicate: Optional[MinHashIndex] = None,
+                 max_dependencies: int = 10000):
+        self.backend = backend
+        self.ttl = ttl
+        self.near_duplicate = near_duplicate
+        self.dependencies = TermDependencyIndex(max_dependencies)
+        # 持久化后端里可能有上次运行写入、未登记检索词项的回答，首次失效时整体清空
+        self._untracked = getattr(backend, "persistent", False)
+        self.blocking = getattr(backend, "persistent", False)
+        # 线程池中的调用与事件循环中的调用共享近似索引和词项索引
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["AnswerCache"]:
+        """根据环境变量创建缓存；LUGANG_CACHE_BACKEND=off 时禁用"""
+        backend_name = os.getenv("LUGANG_CACHE_BACKEND", "memory").lower()
+        if backend_name in ("off", "none", "0"):
+            return None
+        max_entries = int(os.getenv("LUGANG_CACHE_MAX_ENTRIES", "10000"))
+        if backend_name == "sqlite":
+            backend = SQLiteCacheBackend(os.getenv("LUGANG_CACHE_SQLITE_PATH", "lugang_answer_cache.db"), max_entries)
+        else:
+            backend = MemoryCacheBackend(max_entries, int(os.getenv("LUGANG_CACHE_MAX_BYTES", str(64 * 1024 * 1024))))
+        threshold = float(os.getenv("LUGANG_CACHE_NEAR_DUP_THRESHOLD", "0"))
+        near_duplicate = MinHashIndex(threshold=threshold, max_entries=max_entries) if threshold > 0 else None
+        return cls(backend, ttl=float(os.getenv("LUGANG_CACHE_TTL", "3600")), near_duplicate=near_duplicate,
+                   max_dependencies=max_entries)
+
+    def get(self, question: str, language: str, knowledge_base: str, user_type: str, model: str) -> Optional[Dict]:
+        """查询缓存，命中返回缓存的回答字典"""
+        with self._lock:
+            return self._get(question, language, knowledge_base, user_type, model)
+
+    def _get(self, question: str, language: str, knowledge_base: str, user_type: str, model: str) -> Optional[Dict]:
+        value = self.backend.get(make_cache_key(question, language, knowledge_base, user_type, model))
+        if value is not None:
+            self.hits += 1
+            return json.loads(value)
+        if self.near_duplicate is not None:
+            scope = "\x1f".join((language, knowledge_base, user_type, model))
+            similar_key = self.near_duplicate.query(scope, normalize_question(question))
+            value = self.backend.get(similar_key) if similar_key else None
+            if value is not None:
+                self.near_hits += 1
+                return json.loads(value)
+            if similar_key:
+                self.near_duplicate.remove(similar_key)
+        self.misses += 1
+        return None
+
+    def put(self, question: str, language: str, knowledge_base: str, user_type: str, model: str, value: Dict,
+            terms: Optional[Iterable[str]] = None):
+        """写入缓存；terms 为问题的检索词项，用于知识库条目变更时精确失效"""
+        key = make_cache_key(question, language, knowledge_base, user_type, model)
+        with self._lock:
+            self.backend.set(key, json.dumps(value, ensure_ascii=False), self.ttl)
+            if self.near_duplicate is not None:
+                scope = "\x1f".join((language, knowledge_base, user_type, model))
+                self.near_duplicate.add(key, scope, normalize_question(question))
+            if terms is not None:
+                self.dependencies.add(key, terms)
+
+    def invalidate(self, terms: Iterable[str]) -> int:
+        """删除检索词项与给定词项有交集的回答（知识库条目增删改时调用），返回删除条数"""
+        with self._lock:
+            if self._untracked:
+                self.clear()
+                self._untracked = False
+                return 0
+            keys = self.dependencies.pop_dependents(terms)
+            for key in keys:
+                self.backend.delete(key)
+                if self.near_duplicate is not None:
+                    self.near_duplicate.remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        """清空缓存（知识库整体切换时调用）"""
+        with self._lock:
+            self.backend.clear()
+            if self.near_duplicate is not None:
+                self.near_duplicate.clear()
+            self.dependencies.clear()
+
+    async def _run(self, method, *args):
+        return await asyncio.to_thread(method, *args) if self.blocking else method(*args)
+
+    async def aget(self, question: str, language: str, knowledge_base: str, user_type: str,
+                   model: str) -> Optional[Dict]:
+        return await self._run(self.get, question, language, knowledge_base, user_type, model)
+
+    async def aput(self, question: str, language: str, knowledge_base: str, user_type: str, model: str, value: Dict,
+                   terms: Optional[Iterable[str]] = None):
+        await self._run(self.put, question, language, knowledge_base, user_type, model, value, terms)
+
+    async def ainvalidate(self, terms: Iterable[str]) -> int:
+        return await self._run(self.invalidate, terms)
+
+    async def aclear(self):
+        await self._run(self.clear)
+
+    async def astats(self) -> Dict:
+        return await self._run(self.stats)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "hits": self.hits,
+            "near_duplicate_hits": self.near_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round((self.hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+            "ttl_seconds": self.ttl,
+            "near_duplicate_threshold": self.near_duplicate.threshold if self.near_duplicate else None,
+            **self.backend.stats(),
+        }
@@ -4,18 +4,73 @@
 鲁港通 - 直接集成AI模型版本
 Lu-Gang Connect - Direct AI Integration Version
 智能双语知识库系统，直接调用AI模型API
+
+知识库索引、问答缓存、上下文装配与上游连接池在 lifespan 中并发预热，导入时只读取配置；
+/health 表示进程存活，/ready 在预热完成后才返回 200。
+启动剖析: LUGANG_STARTUP_PROFILE=1 或 python lugang_connect.py --startup-profile
 """
 
-from fastapi import FastAPI, HTTPException
+import time
+
+# 启动剖析：在导入框架之前开始计时
+_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
-import httpx
+import hmac
+import json
 import os
+import re
+import sys
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable
 import asyncio
+from contextlib import asynccontextmanager
+from functools import partial
+_FRAMEWORK_IMPORTED = time.perf_counter()
+
+from lugang_admission import AdmissionController, AdmissionRejected
+from lugang_cache import AnswerCache
+from lugang_context import ContextPacker
+from lugang_encoding import CompressionMiddleware, FastJSONResponse, ResponseCompressor, dumps
+from lugang_kbjournal import KnowledgeJournal, OverlayKnowledgeIndex
+from lugang_kbstore import KnowledgeStore
+from lugang_lexicon import Lexicon
+from lugang_matcher import DEFAULT_RULES_PATH, ReloadingKeywordRules
+from lugang_metrics import GatewayMetrics, MetricsMiddleware
+from lugang_router import HedgedRouter
+from lugang_search import KnowledgeIndex
+from lugang_singleflight import SingleFlight, request_key
+from lugang_startup import ReadinessMiddleware, StartupProfile
+from lugang_state import AsyncStateClient, SharedAnswerCache, StateClient, StateError, StateSync
+from lugang_static import PrecomputedResponse, precompute_all
+from lugang_timing import PhaseTimer
+from lugang_upstream import PoolConfig, UpstreamClientRegistry
+from lugang_vectors import EmbeddingError, QueryEmbedder, VectorIndex
+
+# 启动剖析 - 导入与预热各阶段耗时，/ready 返回完整时间线
+STARTUP = StartupProfile.from_env(_IMPORT_STARTED)
+STARTUP.record("framework", _IMPORT_STARTED, _FRAMEWORK_IMPORTED, group="import")
+STARTUP.record("gateway_modules", _FRAMEWORK_IMPORTED, time.perf_counter(), group="import")
+_MODULES_IMPORTED = time.perf_counter()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动后立即开始接受连接，后台并发预热，就绪后启动各后台任务；关闭时释放"""
+    background: List[asyncio.Task] = []
+    warmup = asyncio.create_task(warm_up(background))
+    try:
+        yield
+    finally:
+        for task in [warmup, *background]:
+            task.cancel()
+        await UPSTREAM_CLIENTS.close()
+        if STATE_CLIENT is not None:
+            STATE_CLIENT.close()
+            await STATE_ASYNC_CLIENT.close()
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -25,9 +80,15 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc",
     # 优化文档加载速度
-    swagger_ui_parameters={"defaultModelsExpandDepth": -1}
+    swagger_ui_parameters={"defaultModelsExpandDepth": -1},
+    # 默认响应类：UTF-8 直接输出中文，安装 orjson 时用 orjson 序列化
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan
 )
 
+# 就绪闸门 - 预热完成前业务请求最多等待 LUGANG_READY_WAIT 秒，仍未就绪返回 503
+app.add_middleware(ReadinessMiddleware, startup=STARTUP, wait=float(os.getenv("LUGANG_READY_WAIT", "5")))
+
 # 添加CORS中间件
 app.add_middleware(
     CORSMiddleware,
@@ -37,13 +98,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 指标与链路追踪 - /metrics 暴露 Prometheus 指标，LUGANG_OTEL_ENDPOINT 配置后导出 span
+METRICS = GatewayMetrics.from_env()
+app.add_middleware(MetricsMiddleware, metrics=METRICS)
+
+# 响应压缩 - 按 Accept-Encoding 协商 br/gzip；小于 LUGANG_COMPRESSION_MIN_SIZE 的响应、预生成的压缩响应与流式响应不处理
+COMPRESSOR = ResponseCompressor.from_env()
+app.add_middleware(CompressionMiddleware, compressor=COMPRESSOR)
+
 # AI模型配置 - 直接调用
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "")
 QWEN_API_KEY = os.getenv("QWEN_API_KEY", "")
 
-# API端点配置
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
-QWEN_API_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
+# API端点配置（可通过环境变量指向本地桩服务进行压测）
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
+QWEN_API_URL = os.getenv("QWEN_API_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions")
+
+# 上游连接池 - 每个服务商一个长连接客户端，连接数与超时可通过 LUGANG_<PROVIDER>_* 环境变量配置
+UPSTREAM_CLIENTS = UpstreamClientRegistry({
+    "deepseek": PoolConfig.from_env("deepseek"),
+    "qwen": PoolConfig.from_env("qwen"),
+    **({"embedding": PoolConfig.from_env("embedding")} if os.getenv("LUGANG_EMBEDDING_URL") else {}),
+})
+
+# 上游请求合并 - 并发的相同请求只调用一次上游
+UPSTREAM_FLIGHTS = SingleFlight()
 
 # 数据模型
 class QueryRequest(BaseModel):
@@ -51,6 +130,7 @@ class QueryRequest(BaseModel):
     language: str = "zh"  # zh, en, zh-hk
     user_type: str = "visitor"  # visitor, business, investor, student
     knowledge_base: str = "both"  # northbound, southbound, both
+    stream: bool = False  # 是否以SSE流式返回
 
 class QueryResponse(BaseModel):
     answer: str
@@ -118,107 +198,354 @@ KNOWLEDGE_BASE = {
     }
 }
 
-async def call_deepseek_api(messages: List[Dict]) -> str:
-    """直接调用Deepseek API"""
+# 以下对象在 lifespan 预热阶段构建（见 warm_up），导入时只声明
+# 跨语言词典 - 繁简映射、港式用词与中英别名预先写入索引和关键词规则，zh / zh-hk / en 问题无需翻译即可检索
+LEXICON: Optional[Lexicon] = None
+
+# 关键词规则 - Aho-Corasick自动机，规则文件修改后自动重新加载
+KEYWORD_RULES: Optional[ReloadingKeywordRules] = None
+
+# 知识库快照存储 - 设置 LUGANG_KB_PATH / LUGANG_KB_SNAPSHOT 后各worker共享只读mmap快照，文件变更时热切换
+KB_STORE: Optional[KnowledgeStore] = None
+KB_POLL_INTERVAL = float(os.getenv("LUGANG_KB_POLL_INTERVAL", "0.5"))
+
+# 知识库增量写入 - 设置 LUGANG_KB_LOG 后启用条目写接口（需 LUGANG_ADMIN_TOKEN），变更追加写入日志，
+# 启动时重放日志，检索走基础索引 + 增量段，无需整体重建
+KB_JOURNAL: Optional[KnowledgeJournal] = None
+
+# 知识库倒排索引
+KNOWLEDGE_INDEX = None
+
+def vector_index_for(index) -> Optional[VectorIndex]:
+    """离线向量按源知识库构建；有未合并的增量写入时向量文档ID与索引不一致，停用向量检索"""
+    if isinstance(index, OverlayKnowledgeIndex):
+        if index.modified:
+            return None
+        index = index.base
+    return VectorIndex.from_env(index)
+
+# 稠密向量检索 - LUGANG_VECTOR_PATH 指定离线条目向量，LUGANG_EMBEDDING_URL 指定查询向量化服务，
+# 两者均配置时向量候选与关键词候选做RRF融合
+VECTOR_INDEX: Optional[VectorIndex] = None
+QUERY_EMBEDDER = QueryEmbedder.from_env(partial(UPSTREAM_CLIENTS.post, "embedding"))
+
+# 多worker共享状态 - 设置 LUGANG_STATE_SOCKET 后问答缓存、熔断状态与集群计数由共享状态进程统一维护
+STATE_CLIENT = StateClient.from_env()
+# 事件循环内的缓存读写走异步连接池，同步客户端只在线程中使用
+STATE_ASYNC_CLIENT = AsyncStateClient.from_env()
+
+# 问答缓存 - 后端、TTL、容量与近似命中阈值通过 LUGANG_CACHE_* 环境变量配置（多worker模式下由共享状态进程持有）
+ANSWER_CACHE = None
+
+# 上下文装配 - 提示词按模型的 token 预算装入检索段落，回答长度上限同样按模型配置（tiktoken 编码表可能需要下载）
+CONTEXT_PACKER: Optional[ContextPacker] = None
+SYSTEM_PROMPT_PREFIX = "你是鲁港通智能助手，专门回答香港与山东之间的商务、文化、教育、投资等问题。基于以下知识库信息回答："
+
+class AIServiceError(Exception):
+    """AI服务调用失败（未配置、非200状态码或网络异常），消息可直接作为回答展示"""
+
+# AI服务配置 - 按服务名查找端点与密钥
+AI_SERVICES = {
+    "deepseek": {"name": "Deepseek", "model": "deepseek-chat", "api_url": DEEPSEEK_API_URL, "api_key": DEEPSEEK_API_KEY},
+    "qwen": {"name": "Qwen", "model": "qwen-turbo", "api_url": QWEN_API_URL, "api_key": QWEN_API_KEY},
+}
+
+# 延迟感知路由 - 首选服务超过p95截止时间时对冲到备选服务，持续失败时熔断
+AI_ROUTER = HedgedRouter.from_env(list(AI_SERVICES), ignored_errors=(AdmissionRejected,),
+                                  configured=lambda name: bool(AI_SERVICES[name]["api_key"]))
+
+# 准入控制 - 每个服务商并发上限与有界优先级队列，队列满/排队超时返回 429/503 与 Retry-After
+ADMISSION = AdmissionController.from_env(AI_SERVICES, metrics=METRICS)
+
+# 多worker模式下定期同步熔断状态与计数
+STATE_SYNC = StateSync(STATE_CLIENT, AI_ROUTER, ADMISSION, float(os.getenv("LUGANG_STATE_SYNC_INTERVAL", "1.0"))) \
+    if STATE_CLIENT is not None else None
+
+def build_ai_request(ai_service: str, model_name: str, messages: List[Dict], stream: bool = False) -> Dict:
+    """构建上游请求参数"""
+    service = AI_SERVICES[ai_service]
+    if not service["api_key"]:
+        raise AIServiceError(f"基于鲁港通知识库的回答（{service['name']} API未配置）")
+    payload = {
+        "model": model_name,
+        "messages": messages,
+        "max_tokens": CONTEXT_PACKER.max_tokens(model_name),
+        "temperature": 0.7
+    }
+    if stream:
+        payload["stream"] = True
+        # 要求在最后一个分片中返回 token 用量
+        payload["stream_options"] = {"include_usage": True}
+    return {
+        "headers": {
+            "Authorization": f"Bearer {service['api_key']}",
+            "Content-Type": "application/json"
+        },
+        "json": payload
+    }
+
+async def call_ai_api(ai_service: str, model_name: str, messages: List[Dict], user_type: str = "visitor") -> str:
+    """调用AI模型API，失败时抛出AIServiceError；排队已满或超时抛出AdmissionRejected"""
+    service = AI_SERVICES[ai_service]
+    request_kwargs = build_ai_request(ai_service, model_name, messages)
+    # 在服务商并发名额内调用，耗时统计不含排队时间
+    async with ADMISSION.slot(ai_service, user_type):
+        started = time.perf_counter()
+        ttfb, outcome = None, "error"
+        try:
+            # 以流方式读取响应以便区分首字节耗时与总耗时
+            async with UPSTREAM_CLIENTS.stream(ai_service, service["api_url"], **request_kwargs) as response:
+                ttfb = time.perf_counter() - started
+                if response.status_code != 200:
+                    raise AIServiceError(f"{service['name']} API调用失败 (状态码: {response.status_code})")
+                await response.aread()
+            result = response.json()
+            METRICS.record_usage(ai_service, result.get("usage"))
+            answer = result["choices"][0]["message"]["content"]
+            outcome = "success"
+            return answer
+        except AIServiceError:
+            raise
+        except asyncio.CancelledError:
+            # 对冲落败被取消
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            raise AIServiceError(f"{service['name']} API调用异常: {str(e)}") from e
+        finally:
+            METRICS.observe_upstream(ai_service, ttfb, time.perf_counter() - started, outcome)
+
+async def stream_ai_api(ai_service: str, model_name: str, messages: List[Dict], user_type: str = "visitor"):
+    """流式调用AI模型API，逐段产出回答内容，失败时抛出AIServiceError；名额在整个流期间占用"""
+    service = AI_SERVICES[ai_service]
+    request_kwargs = build_ai_request(ai_service, model_name, messages, stream=True)
+    async with ADMISSION.slot(ai_service, user_type):
+        started = time.perf_counter()
+        ttfb, outcome = None, "error"
+        try:
+            async with UPSTREAM_CLIENTS.stream(ai_service, service["api_url"], **request_kwargs) as response:
+                if response.status_code != 200:
+                    raise AIServiceError(f"{service['name']} API调用失败 (状态码: {response.status_code})")
+            
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    METRICS.record_usage(ai_service, chunk.get("usage"))
+                    choices = chunk.get("choices") or []
+                    content = choices[0].get("delta", {}).get("content") if choices else None
+                    if content:
+                        if ttfb is None:
+                            ttfb = time.perf_counter() - started
+                        yield content
+            outcome = "success"
+        except AIServiceError:
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            raise AIServiceError(f"{service['name']} API调用异常: {str(e)}") from e
+        finally:
+            METRICS.observe_upstream(ai_service, ttfb, time.perf_counter() - started, outcome)
+
+def configured_ai_services() -> List[str]:
+    """已配置API密钥的AI服务，作为对冲与故障转移的备选"""
+    return [name for name, service in AI_SERVICES.items() if service["api_key"]]
+
+async def route_ai_call(ai_service: str, messages_for: Callable[[str], List[Dict]],
+                        user_type: str = "visitor") -> tuple:
+    """经路由器调用AI服务（对冲/故障转移），返回 (实际服务, 回答)；messages_for 按模型给出对话消息"""
+    return await AI_ROUTER.call(
+        ai_service,
+        configured_ai_services(),
+        lambda provider: call_ai_api(provider, AI_SERVICES[provider]["model"],
+                                     messages_for(AI_SERVICES[provider]["model"]), user_type)
+    )
+
+def route_ai_stream(ai_service: str, messages_for: Callable[[str], List[Dict]], user_type: str = "visitor"):
+    """经路由器流式调用AI服务（首个分片前故障转移），产出 (实际服务, 分片)；messages_for 按模型给出对话消息"""
+    return AI_ROUTER.stream(
+        ai_service,
+        configured_ai_services(),
+        lambda provider: stream_ai_api(provider, AI_SERVICES[provider]["model"],
+                                       messages_for(AI_SERVICES[provider]["model"]), user_type)
+    )
+
+def match_keywords(question: str) -> list:
+    """单次扫描问题，返回全部命中的关键词规则"""
+    return KEYWORD_RULES.current().match(question)
+
+def classify_query_type(question: str, matches: Optional[list] = None) -> tuple:
+    """分类查询类型，按路由规则加权得分决定使用哪个AI模型"""
+    rules = KEYWORD_RULES.current()
+    if matches is None:
+        matches = rules.match(question)
+    ai_service, model_name = rules.route(matches)
+    return ai_service, model_name or AI_SERVICES[ai_service]["model"]
+
+def build_knowledge_index() -> tuple:
+    """构建倒排索引（启用快照存储时取最新快照）及对应的向量索引，不修改全局状态，在线程池中调用"""
+    index = KB_STORE.index if KB_STORE is not None else KnowledgeIndex(KNOWLEDGE_BASE, lexicon=LEXICON)
+    if KB_JOURNAL is not None:
+        index = KB_JOURNAL.rebase(index)
+    # 离线向量与新知识库不一致时停用向量检索，重新构建向量文件后生效
+    return index, vector_index_for(index)
+
+async def rebuild_knowledge_index() -> KnowledgeIndex:
+    """知识库切换后重建索引：构建在线程池执行，完成后一次性切换全局引用，再清空缓存并重新生成知识库接口响应"""
+    global KNOWLEDGE_INDEX, VECTOR_INDEX
+    KNOWLEDGE_INDEX, VECTOR_INDEX = await asyncio.to_thread(build_knowledge_index)
+    if ANSWER_CACHE is not None:
+        await ANSWER_CACHE.aclear()
+    await refresh_knowledge_responses()
+    return KNOWLEDGE_INDEX
+
+def build_knowledge_stores():
+    """知识库快照存储与增量写入日志（启动时重放），随后构建倒排索引"""
+    global KB_STORE, KB_JOURNAL, KNOWLEDGE_INDEX
+    KB_STORE = KnowledgeStore.from_env(fallback=KNOWLEDGE_BASE, lexicon=LEXICON)
+    KB_JOURNAL = KnowledgeJournal.from_env(lexicon=LEXICON)
+    KNOWLEDGE_INDEX = KB_STORE.index if KB_STORE is not None else KnowledgeIndex(KNOWLEDGE_BASE, lexicon=LEXICON)
+    if KB_JOURNAL is not None:
+        KNOWLEDGE_INDEX = KB_JOURNAL.rebase(KNOWLEDGE_INDEX)
+
+def build_keyword_rules():
+    global KEYWORD_RULES
+    KEYWORD_RULES = ReloadingKeywordRules(os.getenv("LUGANG_RULES_PATH", DEFAULT_RULES_PATH), lexicon=LEXICON)
+
+def build_answer_cache():
+    """问答缓存；多worker模式下同时建立到共享状态进程的连接"""
+    global ANSWER_CACHE
+    if STATE_CLIENT is None:
+        ANSWER_CACHE = AnswerCache.from_env()
+        return
+    ANSWER_CACHE = SharedAnswerCache.from_env(STATE_CLIENT, STATE_ASYNC_CLIENT)
     try:
-        if not DEEPSEEK_API_KEY:
-            return "基于鲁港通知识库的回答（Deepseek API未配置）"
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                DEEPSEEK_API_URL,
-                headers={
-                    "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "deepseek-chat",
-                    "messages": messages,
-                    "max_tokens": 500,
-                    "temperature": 0.7
-                },
-                timeout=30.0
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result["choices"][0]["message"]["content"]
-            else:
-                return f"Deepseek API调用失败 (状态码: {response.status_code})"
-                
-    except Exception as e:
-        return f"Deepseek API调用异常: {str(e)}"
+        STATE_CLIENT.call("ping")
+    except StateError as e:
+        print(f"共享状态进程暂不可用，首次使用时重连: {e}")
+
+def build_context_packer():
+    global CONTEXT_PACKER
+    CONTEXT_PACKER = ContextPacker.from_env()
+
+async def warm_knowledge():
+    """知识库链路：词典 -> 关键词规则与倒排索引（并发）-> 向量索引 -> 知识库接口响应"""
+    global LEXICON, VECTOR_INDEX
+    LEXICON = await STARTUP.run("lexicon", asyncio.to_thread(Lexicon.from_env))
+    await asyncio.gather(
+        STARTUP.run("keyword_rules", asyncio.to_thread(build_keyword_rules)),
+        STARTUP.run("knowledge_index", asyncio.to_thread(build_knowledge_stores)),
+    )
+    VECTOR_INDEX = await STARTUP.run("vector_index", asyncio.to_thread(vector_index_for, KNOWLEDGE_INDEX))
+    await STARTUP.run("knowledge_responses", asyncio.to_thread(rebuild_knowledge_responses))
 
-async def call_qwen_api(messages: List[Dict]) -> str:
-    """直接调用Qwen API"""
+async def warm_upstreams():
+    """创建上游连接池；设置 LUGANG_PREWARM_UPSTREAMS=1 时预先建立到各服务商的连接"""
+    await UPSTREAM_CLIENTS.start()
+    if os.getenv("LUGANG_PREWARM_UPSTREAMS", "").lower() in ("1", "true", "on", "yes"):
+        await UPSTREAM_CLIENTS.prewarm({name: config["api_url"] for name, config in AI_SERVICES.items()})
+
+async def warm_up(background: List[asyncio.Task]):
+    """并发预热互不依赖的部分：知识库链路、问答缓存、上下文装配、上游连接池、演示页面预生成；
+    完成后启动知识库监视与状态同步任务并标记就绪。CPU 密集的纯 Python 构建受 GIL 限制，
+    并发主要重叠文件读取、压缩与网络等待"""
     try:
-        if not QWEN_API_KEY:
-            return "基于鲁港通知识库的回答（Qwen API未配置）"
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                QWEN_API_URL,
-                headers={
-                    "Authorization": f"Bearer {QWEN_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "qwen-turbo",
-                    "messages": messages,
-                    "max_tokens": 500,
-                    "temperature": 0.7
-                },
-                timeout=30.0
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result["choices"][0]["message"]["content"]
-            else:
-                return f"Qwen API调用失败 (状态码: {response.status_code})"
-                
+        await asyncio.gather(
+            warm_knowledge(),
+            STARTUP.run("answer_cache", asyncio.to_thread(build_answer_cache)),
+            STARTUP.run("context_packer", asyncio.to_thread(build_context_packer)),
+            STARTUP.run("upstream_pools", warm_upstreams()),
+            STARTUP.run("demo_responses", asyncio.to_thread(rebuild_demo_responses)),
+        )
     except Exception as e:
-        return f"Qwen API调用异常: {str(e)}"
+        STARTUP.mark_failed(e)
+        print(f"❌ 预热失败，/ready 保持 503: {e}")
+        raise
+    if KB_STORE is not None:
+        background.append(asyncio.create_task(watch_knowledge_store()))
+    if KB_JOURNAL is not None:
+        background.append(asyncio.create_task(watch_knowledge_journal()))
+    if STATE_SYNC is not None:
+        background.append(asyncio.create_task(STATE_SYNC.run()))
+    STARTUP.mark_ready()
 
-def classify_query_type(question: str) -> tuple:
-    """分类查询类型，决定使用哪个AI模型"""
-    question_lower = question.lower()
-    
-    # 商务、金融、投资类问题 -> Deepseek
-    business_keywords = ["投资", "股票", "公司", "银行", "贸易", "商务", "金融", "税收", "注册", "开户", "物流", "港口"]
-    if any(keyword in question_lower for keyword in business_keywords):
-        return "deepseek", "deepseek-chat"
-    
-    # 文化、教育、旅游类问题 -> Qwen  
-    culture_keywords = ["文化", "教育", "旅游", "历史", "传统", "学校", "大学", "景点", "美食", "艺术", "泰山", "孔子"]
-    if any(keyword in question_lower for keyword in culture_keywords):
-        return "qwen", "qwen-turbo"
-    
-    # 默认使用Deepseek
-    return "deepseek", "deepseek-chat"
+def current_knowledge_base() -> Dict[str, Dict[str, List[str]]]:
+    """当前生效的知识库内容"""
+    if KB_JOURNAL is not None or KB_STORE is not None:
+        return KNOWLEDGE_INDEX.knowledge_base()
+    return KNOWLEDGE_BASE
 
-def search_knowledge_base(question: str, kb_type: str, user_type: str) -> str:
-    """搜索鲁港通知识库"""
-    relevant_info = []
-    
-    if kb_type in ["northbound", "both"]:
-        for category, items in KNOWLEDGE_BASE["northbound"].items():
-            relevant_info.extend(items)
-    
-    if kb_type in ["southbound", "both"]:
-        for category, items in KNOWLEDGE_BASE["southbound"].items():
-            relevant_info.extend(items)
-    
-    # 关键词匹配
-    question_lower = question.lower()
-    matched_info = []
-    
-    keywords = ["股票", "投资", "公司", "银行", "贸易", "文化", "山东", "香港", "教育", "旅游", "港口", "税收", "泰山", "孔子"]
-    for info in relevant_info:
-        if any(keyword in question_lower or keyword in info for keyword in keywords):
-            matched_info.append(info)
-    
-    return " ".join(matched_info[:5]) if matched_info else "鲁港通系统为您提供香港与山东之间的商务、文化、教育等信息服务。"
+async def apply_knowledge_changes(terms: set) -> int:
+    """条目增删改后切换到新的叠加索引，只失效检索词项与变更条目有交集的缓存回答，
+    知识库接口响应在下次请求时重新生成；返回失效的缓存条数"""
+    global KNOWLEDGE_INDEX, VECTOR_INDEX, KNOWLEDGE_RESPONSES_STALE
+    KNOWLEDGE_INDEX = KB_JOURNAL.index
+    if VECTOR_INDEX is not None and KNOWLEDGE_INDEX.modified:
+        VECTOR_INDEX = None
+        print("⚠️ 知识库已增量更新，向量检索暂停，合并到源知识库并重新构建向量文件后恢复")
+    KNOWLEDGE_RESPONSES_STALE = True
+    if ANSWER_CACHE is None or not terms:
+        return 0
+    return await ANSWER_CACHE.ainvalidate(terms)
+
+async def watch_knowledge_journal():
+    """轮询增量写入日志：追上其他 worker 的写入，增量段过大时合并，日志过长时压缩"""
+    while True:
+        await asyncio.sleep(KB_POLL_INTERVAL)
+        try:
+            terms = await asyncio.to_thread(KB_JOURNAL.refresh)
+            if KB_JOURNAL.index is not KNOWLEDGE_INDEX:
+                await apply_knowledge_changes(terms)
+        except Exception as e:
+            print(f"知识库增量日志同步失败: {e}")
+
+async def watch_knowledge_store():
+    """轮询知识库源文件与快照，有变化时原子切换索引"""
+    while True:
+        await asyncio.sleep(KB_POLL_INTERVAL)
+        try:
+            if await asyncio.to_thread(KB_STORE.refresh):
+                await rebuild_knowledge_index()
+                print(f"📚 知识库快照已切换: {len(KNOWLEDGE_INDEX)} 条")
+        except Exception as e:
+            print(f"知识库快照刷新失败: {e}")
+
+def search_knowledge_base(question: str, kb_type: str, user_type: str, matches: Optional[list] = None,
+                          model_name: str = "", reserved_tokens: int = 0, hits: Optional[list] = None) -> str:
+    """搜索鲁港通知识库，检索规则命中的分类加权排序，并按模型的提示词预算装入上下文；
+    hits 为批量检索已得到的结果"""
+    if hits is None:
+        if matches is None:
+            matches = match_keywords(question)
+        boosts = KEYWORD_RULES.current().retrieval_boosts(matches)
+        hits = KNOWLEDGE_INDEX.search(question, kb_type, top_k=CONTEXT_PACKER.candidates, boosts=boosts)
+    packed = CONTEXT_PACKER.pack(hits, model_name, reserved_tokens) if hits else None
+    return packed.text if packed and packed.text else "鲁港通系统为您提供香港与山东之间的商务、文化、教育等信息服务。"
+
+async def retrieve_knowledge_many(requests: List[QueryRequest], matches_list: List[list],
+                                  timer: Optional[PhaseTimer] = None) -> List[list]:
+    """批量检索：所有问题一次完成倒排表读取与打分；启用向量检索时查询向量批量计算，
+    与关键词候选做RRF融合，向量化失败时只用关键词候选"""
+    rules = KEYWORD_RULES.current()
+    queries = [(request.question, request.knowledge_base, rules.retrieval_boosts(matches))
+               for request, matches in zip(requests, matches_list)]
+    keyword_hits = KNOWLEDGE_INDEX.search_many(queries, top_k=CONTEXT_PACKER.candidates)
+    vector_index = VECTOR_INDEX
+    if vector_index is None or QUERY_EMBEDDER is None or not queries:
+        return keyword_hits
+    try:
+        with (timer or PhaseTimer()).phase("embedding"):
+            vectors = await QUERY_EMBEDDER.embed_many([question for question, _, _ in queries])
+        return [vector_index.fuse(hits, vector, kb_type, boosts, CONTEXT_PACKER.candidates)
+                for hits, vector, (_, kb_type, boosts) in zip(keyword_hits, vectors, queries)]
+    except EmbeddingError as e:
+        print(f"向量检索失败，使用关键词检索结果: {e}")
+        return keyword_hits
 
 @app.get("/")
 async def root():
@@ -246,15 +573,20 @@ async def root():
             "演示接口": "/api/v1/demo",
             "演示网页": "/demo",
             "AI服务状态": "/api/v1/ai/status",
+            "批量问答": "/api/v1/query/batch",
+            "知识库条目": "/api/v1/knowledge/{kb_type}/{category}",
+            "缓存统计": "/api/v1/cache/stats",
+            "监控指标": "/metrics",
             "健康检查": "/health",
+            "就绪检查": "/ready",
             "API文档": "/docs"
         }
     }
 
 @app.get("/health")
 async def health_check():
-    """健康检查接口"""
-    return {
+    """健康检查接口：预热失败时返回 503，便于编排系统重启实例"""
+    payload = {
         "status": "healthy",
         "service": "lu-gang-connect",
         "version": "3.0.0-integrated",
@@ -263,9 +595,20 @@ async def health_check():
             "deepseek": "configured" if DEEPSEEK_API_KEY else "not_configured",
             "qwen": "configured" if QWEN_API_KEY else "not_configured"
         },
-        "knowledge_base_status": "active",
-        "total_knowledge_items": sum(len(items) for kb in KNOWLEDGE_BASE.values() for items in kb.values())
+        "knowledge_base_status": "active" if STARTUP.ready else "warming",
+        "total_knowledge_items": len(KNOWLEDGE_INDEX) if KNOWLEDGE_INDEX is not None else 0,
+        "knowledge_store": KB_STORE.stats() if KB_STORE is not None else None,
+        "knowledge_journal": KB_JOURNAL.stats() if KB_JOURNAL is not None else None
     }
+    if STARTUP.error:
+        payload.update(status="unhealthy", knowledge_base_status="failed", error=STARTUP.error)
+        return FastJSONResponse(status_code=503, content=payload)
+    return payload
+
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查：预热完成前返回 503（/health 只在预热失败时返回 503），响应附带启动各阶段耗时"""
+    return FastJSONResponse(status_code=200 if STARTUP.ready else 503, content=STARTUP.stats())
 
 @app.get("/api/v1/info")
 async def get_system_info():
@@ -291,43 +634,285 @@ async def get_system_info():
         "startup_time": datetime.now().isoformat()
     }
 
+def build_query_messages(request: QueryRequest, matches: Optional[list] = None, model_name: str = "",
+                         hits: Optional[list] = None) -> tuple:
+    """检索知识库并构建对话消息"""
+    # 系统提示词模板与用户问题占用的 token 从预算中预留
+    reserved_tokens = CONTEXT_PACKER.counter.count(SYSTEM_PROMPT_PREFIX) + CONTEXT_PACKER.counter.count(request.question)
+    
+    # 搜索知识库
+    context = search_knowledge_base(request.question, request.knowledge_base, request.user_type, matches,
+                                    model_name, reserved_tokens, hits)
+    
+    # 构建消息
+    system_prompt = f"{SYSTEM_PROMPT_PREFIX}{context}"
+    
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": request.question}
+    ]
+    return context, messages
+
+def messages_for_models(request: QueryRequest, matches: Optional[list], hits: Optional[list],
+                        model_name: str, messages: List[Dict]) -> Callable[[str], List[Dict]]:
+    """按模型取对话消息：对冲或故障转移到提示词预算不同的模型时，按该模型的预算重新装入上下文"""
+    packed = {model_name: messages}
+
+    def messages_for(model: str) -> List[Dict]:
+        if model not in packed:
+            same_budget = CONTEXT_PACKER.budget(model) == CONTEXT_PACKER.budget(model_name)
+            packed[model] = messages if same_budget else build_query_messages(request, matches, model, hits)[1]
+        return packed[model]
+
+    return messages_for
+
+def sse_event(event: str, data: Dict) -> str:
+    """格式化一条server-sent event"""
+    return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
+
+def query_metadata(request: QueryRequest, ai_service: str, model_name: str) -> Dict:
+    """问答响应中除回答外的公共字段"""
+    return {
+        "source": f"鲁港通{request.knowledge_base}知识库",
+        "confidence": 0.85,
+        "language": request.language,
+        "timestamp": datetime.now().isoformat(),
+        "ai_service": f"{ai_service.title()} (Direct API)",
+        "model_used": model_name
+    }
+
+async def cache_answer(request: QueryRequest, model_name: str, context: str, answer: str, served_by: str):
+    """缓存成功的回答，同时记录实际作答的AI服务"""
+    if ANSWER_CACHE is not None:
+        # 启用增量写入时登记问题的检索词项，条目变更只失效相关回答
+        terms = KNOWLEDGE_INDEX.query_terms(request.question) if KB_JOURNAL is not None else None
+        await ANSWER_CACHE.aput(request.question, request.language, request.knowledge_base, request.user_type,
+                                model_name, {"answer": answer, "context": context, "ai_service": served_by}, terms)
+
+async def stream_query_events(request: QueryRequest, ai_service: str, model_name: str,
+                              cached: Optional[Dict] = None, matches: Optional[list] = None,
+                              timer: Optional[PhaseTimer] = None):
+    """SSE事件流：先发送检索上下文与模型信息，再转发上游增量内容；done事件附带各阶段耗时"""
+    timer = timer or PhaseTimer()
+    if cached is not None:
+        served_by = cached.get("ai_service", ai_service)
+        metadata = query_metadata(request, served_by, AI_SERVICES[served_by]["model"])
+        yield sse_event("meta", {"context": cached["context"], "cached": True, **metadata})
+        yield sse_event("delta", {"content": cached["answer"]})
+        METRICS.observe_phases(timer.phases)
+        yield sse_event("done", {"ai_service": metadata["ai_service"], "model_used": metadata["model_used"],
+                                 "server_timing": timer.server_timing()})
+        return
+    
+    with timer.phase("retrieval"):
+        hits = (await retrieve_knowledge_many([request], [matches], timer))[0]
+        context, messages = build_query_messages(request, matches, model_name, hits)
+        messages_for = messages_for_models(request, matches, hits, model_name, messages)
+    yield sse_event("meta", {"context": context, "cached": False, **query_metadata(request, ai_service, model_name)})
+    served_by = ai_service
+    chunks = []
+    upstream_started = timer.elapsed()
+    try:
+        flight_key = request_key("stream", ai_service, model_name, messages)
+        async for served_by, content in UPSTREAM_FLIGHTS.stream(
+                flight_key, lambda: route_ai_stream(ai_service, messages_for, request.user_type)):
+            if not chunks:
+                timer.record("upstream_ttfb", timer.elapsed() - upstream_started)
+            chunks.append(content)
+            yield sse_event("delta", {"content": content})
+    except AIServiceError as e:
+        yield sse_event("error", {"detail": str(e)})
+    except AdmissionRejected as e:
+        yield sse_event("error", {"detail": str(e), "status": e.status_code, "retry_after": e.retry_after})
+    else:
+        await cache_answer(request, model_name, context, "".join(chunks), served_by)
+    timer.record("upstream", timer.elapsed() - upstream_started)
+    METRICS.observe_phases(timer.phases)
+    # 故障转移后实际作答的服务可能与meta中的首选服务不同
+    yield sse_event("done", {"ai_service": f"{served_by.title()} (Direct API)", "model_used": AI_SERVICES[served_by]["model"],
+                             "server_timing": timer.server_timing()})
+
+def render_query_response(result: QueryResponse, headers: Dict[str, str], timer: PhaseTimer) -> Response:
+    """序列化问答结果，序列化耗时计入阶段统计后写入 Server-Timing"""
+    with timer.phase("serialization"):
+        body = dumps(result)
+    METRICS.observe_phases(timer.phases)
+    headers["Server-Timing"] = timer.server_timing()
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def admission_rejected_response(error: AdmissionRejected) -> FastJSONResponse:
+    """准入拒绝：429（队列已满）/ 503（排队超时），附带 Retry-After"""
+    return FastJSONResponse(status_code=error.status_code, content={"detail": str(error)},
+                        headers={"Retry-After": str(error.retry_after)})
+
 @app.post("/api/v1/query", response_model=QueryResponse)
 async def query_system(request: QueryRequest):
-    """智能问答接口 - 鲁港通核心功能 (One API集成)"""
+    """智能问答接口 - 鲁港通核心功能 (One API集成)，stream=true 时以SSE流式返回"""
+    timer = PhaseTimer(METRICS.tracer)
     try:
-        # 搜索知识库
-        context = search_knowledge_base(request.question, request.knowledge_base, request.user_type)
+        # 分类查询并选择AI模型（关键词只扫描一次，路由与检索共用）
+        with timer.phase("routing"):
+            matches = match_keywords(request.question)
+            ai_service, model_name = classify_query_type(request.question, matches)
         
-        # 分类查询并选择AI模型
-        ai_service, model_name = classify_query_type(request.question)
+        # 查询问答缓存
+        cached = None
+        with timer.phase("cache"):
+            if ANSWER_CACHE is not None:
+                cached = await ANSWER_CACHE.aget(request.question, request.language, request.knowledge_base,
+                                                 request.user_type, model_name)
+                METRICS.record_cache_lookup(cached is not None)
+        cache_status = "hit" if cached is not None else "miss"
         
-        # 构建消息
-        system_prompt = f"你是鲁港通智能助手，专门回答香港与山东之间的商务、文化、教育、投资等问题。基于以下知识库信息回答：{context}"
+        # 候选服务商均已满载时在检索前快速拒绝
+        if cached is None:
+            rejection = ADMISSION.saturated(configured_ai_services() or [ai_service])
+            if rejection is not None:
+                return admission_rejected_response(rejection)
         
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": request.question}
-        ]
+        if request.stream:
+            # 流式响应头先于正文发出，只包含路由与缓存阶段
+            return StreamingResponse(
+                stream_query_events(request, ai_service, model_name, cached, matches, timer),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Lugang-Cache": cache_status,
+                         "Server-Timing": timer.server_timing()}
+            )
         
-        # 通过直接API调用AI模型
-        if ai_service == "deepseek":
-            ai_response = await call_deepseek_api(messages)
-        else:
-            ai_response = await call_qwen_api(messages)
+        headers = {"X-Lugang-Cache": cache_status}
+        if cached is not None:
+            served_by = cached.get("ai_service", ai_service)
+            result = QueryResponse(answer=cached["answer"],
+                                   **query_metadata(request, served_by, AI_SERVICES[served_by]["model"]))
+            return render_query_response(result, headers, timer)
         
-        return QueryResponse(
-            answer=ai_response,
-            source=f"鲁港通{request.knowledge_base}知识库",
-            confidence=0.85,
-            language=request.language,
-            timestamp=datetime.now().isoformat(),
-            ai_service=f"{ai_service.title()} (Direct API)",
-            model_used=model_name
-        )
+        with timer.phase("retrieval"):
+            hits = (await retrieve_knowledge_many([request], [matches], timer))[0]
+            context, messages = build_query_messages(request, matches, model_name, hits)
+            messages_for = messages_for_models(request, matches, hits, model_name, messages)
+        
+        # 通过路由器调用AI模型（慢时对冲、失败时转移），失败信息直接作为回答返回且不缓存
+        served_by = ai_service
+        try:
+            with timer.phase("upstream"):
+                flight_key = request_key(ai_service, model_name, messages)
+                served_by, ai_response = await UPSTREAM_FLIGHTS.do(
+                    flight_key, lambda: route_ai_call(ai_service, messages_for, request.user_type))
+            await cache_answer(request, model_name, context, ai_response, served_by)
+        except AIServiceError as e:
+            ai_response = str(e)
+            headers["X-Lugang-Upstream"] = "error"
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
+        
+        result = QueryResponse(answer=ai_response,
+                               **query_metadata(request, served_by, AI_SERVICES[served_by]["model"]))
+        return render_query_response(result, headers, timer)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"查询处理失败: {str(e)}")
 
+# 批量问答 - 单次请求的问题数上限
+BATCH_MAX_SIZE = int(os.getenv("LUGANG_BATCH_MAX_SIZE", "100"))
+
+def ndjson_line(data: Dict) -> str:
+    """NDJSON单行"""
+    return dumps(data).decode("utf-8") + "\n"
+
+async def answer_batch_item(index: int, request: QueryRequest, ai_service: str, model_name: str,
+                            context: str, messages_for: Callable[[str], List[Dict]]) -> Dict:
+    """调用上游回答批量请求中的一个问题，异常转换为该条结果的状态"""
+    served_by = ai_service
+    line: Dict[str, Any] = {"index": index, "status": 200, "cached": False}
+    try:
+        flight_key = request_key(ai_service, model_name, messages_for(model_name))
+        served_by, answer = await UPSTREAM_FLIGHTS.do(
+            flight_key, lambda: route_ai_call(ai_service, messages_for, request.user_type))
+        await cache_answer(request, model_name, context, answer, served_by)
+    except AIServiceError as e:
+        answer = str(e)
+        line["upstream_error"] = True
+    except AdmissionRejected as e:
+        return {"index": index, "status": e.status_code, "detail": str(e), "retry_after": e.retry_after}
+    except Exception as e:
+        return {"index": index, "status": 500, "detail": f"查询处理失败: {str(e)}"}
+    result = QueryResponse(answer=answer, **query_metadata(request, served_by, AI_SERVICES[served_by]["model"]))
+    line["response"] = result
+    return line
+
+async def stream_batch_results(ready: List[Dict], pending: List[tuple]):
+    """先输出缓存命中的结果，其余按上游完成顺序输出；客户端断开时取消未完成的调用"""
+    for line in ready:
+        yield ndjson_line(line)
+    tasks = [asyncio.ensure_future(answer_batch_item(*args)) for args in pending]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield ndjson_line(await next_done)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+@app.post("/api/v1/query/batch")
+async def query_batch(batch: List[QueryRequest]):
+    """批量问答接口：全部问题一次检索，上游调用在准入限制内并发执行，按完成顺序以NDJSON流式返回；
+    每行带 index 对应请求中的位置"""
+    if not batch:
+        raise HTTPException(status_code=400, detail="请求列表为空")
+    if len(batch) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"单次批量请求最多 {BATCH_MAX_SIZE} 个问题")
+    
+    timer = PhaseTimer(METRICS.tracer)
+    with timer.phase("routing"):
+        matches_list = [match_keywords(request.question) for request in batch]
+        routes = [classify_query_type(request.question, matches) for request, matches in zip(batch, matches_list)]
+    
+    ready, misses = [], []
+    with timer.phase("cache"):
+        for index, (request, (ai_service, model_name)) in enumerate(zip(batch, routes)):
+            cached = None
+            if ANSWER_CACHE is not None:
+                cached = await ANSWER_CACHE.aget(request.question, request.language, request.knowledge_base,
+                                                 request.user_type, model_name)
+                METRICS.record_cache_lookup(cached is not None)
+            if cached is None:
+                misses.append(index)
+                continue
+            served_by = cached.get("ai_service", ai_service)
+            result = QueryResponse(answer=cached["answer"],
+                                   **query_metadata(request, served_by, AI_SERVICES[served_by]["model"]))
+            ready.append({"index": index, "status": 200, "cached": True, "response": result})
+    
+    pending = []
+    with timer.phase("retrieval"):
+        all_hits = await retrieve_knowledge_many([batch[i] for i in misses], [matches_list[i] for i in misses],
+                                                 timer)
+        for index, hits in zip(misses, all_hits):
+            ai_service, model_name = routes[index]
+            context, messages = build_query_messages(batch[index], matches_list[index], model_name, hits)
+            messages_for = messages_for_models(batch[index], matches_list[index], hits, model_name, messages)
+            pending.append((index, batch[index], ai_service, model_name, context, messages_for))
+    
+    return StreamingResponse(
+        stream_batch_results(ready, pending),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Server-Timing": timer.server_timing()}
+    )
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指标"""
+    if not METRICS.enabled:
+        raise HTTPException(status_code=404, detail="指标未启用（需安装 prometheus_client）")
+    content, content_type = METRICS.render()
+    return Response(content=content, media_type=content_type)
+
+@app.get("/api/v1/cache/stats")
+async def get_cache_stats():
+    """问答缓存统计"""
+    if ANSWER_CACHE is None:
+        return {"enabled": False, "timestamp": datetime.now().isoformat()}
+    return {"enabled": True, **(await ANSWER_CACHE.astats()), "timestamp": datetime.now().isoformat()}
+
 @app.get("/api/v1/ai/status")
 async def get_ai_status():
     """检查AI服务连接状态"""
@@ -345,23 +930,33 @@ async def get_ai_status():
             "model": "qwen-turbo", 
             "endpoint": QWEN_API_URL
         },
+        "connection_pools": UPSTREAM_CLIENTS.stats(),
+        "single_flight": UPSTREAM_FLIGHTS.stats(),
+        "routing": AI_ROUTER.stats(),
+        "keyword_rules": KEYWORD_RULES.stats(),
+        "lexicon": LEXICON.stats() if LEXICON is not None else None,
+        "compression": COMPRESSOR.stats(),
+        "context_packer": CONTEXT_PACKER.stats(),
+        "admission": ADMISSION.stats(),
+        "vector_retrieval": {
+            "index": VECTOR_INDEX.stats() if VECTOR_INDEX is not None else None,
+            "embedder": QUERY_EMBEDDER.stats() if QUERY_EMBEDDER is not None else None,
+        },
+        "cluster": STATE_SYNC.stats() if STATE_SYNC is not None else None,
+        "startup": STARTUP.stats(),
         "timestamp": datetime.now().isoformat()
     }
 
-@app.get("/api/v1/knowledge/{kb_type}")
-async def get_knowledge_base(kb_type: str):
-    """获取知识库信息"""
-    if kb_type not in ["northbound", "southbound", "both"]:
-        raise HTTPException(status_code=400, detail="无效的知识库类型。支持: northbound, southbound, both")
-    
+def build_knowledge_payload(kb_type: str, knowledge_base: Dict[str, Dict[str, List[str]]]) -> Dict:
+    """知识库接口响应内容"""
     if kb_type == "both":
         return {
             "knowledge_base": "complete",
             "description": "鲁港通完整知识库",
-            "data": KNOWLEDGE_BASE,
+            "data": knowledge_base,
             "statistics": {
-                "northbound_items": sum(len(items) for items in KNOWLEDGE_BASE["northbound"].values()),
-                "southbound_items": sum(len(items) for items in KNOWLEDGE_BASE["southbound"].values())
+                "northbound_items": sum(len(items) for items in knowledge_base.get("northbound", {}).values()),
+                "southbound_items": sum(len(items) for items in knowledge_base.get("southbound", {}).values())
             },
             "timestamp": datetime.now().isoformat()
         }
@@ -370,16 +965,118 @@ async def get_knowledge_base(kb_type: str):
         return {
             "knowledge_base": kb_type,
             "description": f"鲁港通{kb_name}知识库",
-            "data": KNOWLEDGE_BASE.get(kb_type, {}),
+            "data": knowledge_base.get(kb_type, {}),
             "statistics": {
-                "total_items": sum(len(items) for items in KNOWLEDGE_BASE[kb_type].values()),
-                "categories": list(KNOWLEDGE_BASE[kb_type].keys())
+                "total_items": sum(len(items) for items in knowledge_base.get(kb_type, {}).values()),
+                "categories": list(knowledge_base.get(kb_type, {}).keys())
             },
             "timestamp": datetime.now().isoformat()
         }
 
-@app.get("/api/v1/demo")
-async def demo_endpoint():
+@app.get("/api/v1/knowledge/{kb_type}")
+async def get_knowledge_base(kb_type: str, request: Request):
+    """获取知识库信息（预生成，支持ETag与压缩）"""
+    if kb_type not in ["northbound", "southbound", "both"]:
+        raise HTTPException(status_code=400, detail="无效的知识库类型。支持: northbound, southbound, both")
+    if KNOWLEDGE_RESPONSES_STALE:
+        await refresh_knowledge_responses()
+    return STATIC_RESPONSES[f"knowledge/{kb_type}"].respond(request)
+
+# 知识库条目写接口
+ADMIN_TOKEN = os.getenv("LUGANG_ADMIN_TOKEN", "")
+KB_MAX_ENTRY_CHARS = int(os.getenv("LUGANG_KB_MAX_ENTRY_CHARS", "2000"))
+KB_CATEGORY_PATTERN = re.compile(r"^[a-z][a-z0-9_]{0,31}$")
+
+class KnowledgeEntryRequest(BaseModel):
+    text: str
+
+def require_admin(authorization: str = Header(default="")):
+    """写接口鉴权：Authorization: Bearer <LUGANG_ADMIN_TOKEN>，未配置令牌时写接口不可用"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="未配置 LUGANG_ADMIN_TOKEN，知识库写接口已禁用")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="管理令牌无效", headers={"WWW-Authenticate": "Bearer"})
+
+def validate_knowledge_target(kb_type: str, category: str):
+    if kb_type not in ["northbound", "southbound"]:
+        raise HTTPException(status_code=400, detail="无效的知识库类型。支持: northbound, southbound")
+    if not KB_CATEGORY_PATTERN.match(category):
+        raise HTTPException(status_code=400, detail="无效的分类名称：以小写字母开头，仅含小写字母、数字与下划线，最长32个字符")
+
+def writable_journal() -> KnowledgeJournal:
+    if KB_JOURNAL is None:
+        raise HTTPException(status_code=503, detail="未配置 LUGANG_KB_LOG，知识库写接口未启用")
+    return KB_JOURNAL
+
+def validated_entry_text(entry: KnowledgeEntryRequest) -> str:
+    text = entry.text.strip()
+    if not text or len(text) > KB_MAX_ENTRY_CHARS:
+        raise HTTPException(status_code=400, detail=f"条目内容不能为空且不超过{KB_MAX_ENTRY_CHARS}个字符")
+    return text
+
+def knowledge_entry_response(entry_key: str, kb_type: str, category: str, text: Optional[str],
+                             invalidated: int) -> Dict:
+    return {
+        "id": entry_key,
+        "knowledge_base": kb_type,
+        "category": category,
+        "text": text,
+        "cache_invalidated": invalidated,
+        "total_knowledge_items": len(KNOWLEDGE_INDEX),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/api/v1/knowledge/{kb_type}/{category}")
+async def list_knowledge_entries(kb_type: str, category: str):
+    """列出分类下的条目及其ID（修改、删除条目时使用）"""
+    validate_knowledge_target(kb_type, category)
+    entries = KNOWLEDGE_INDEX.entries(kb_type, category)
+    return {
+        "knowledge_base": kb_type,
+        "category": category,
+        "entries": [{"id": entry_key, "text": text} for entry_key, text in entries],
+        "total_items": len(entries),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.post("/api/v1/knowledge/{kb_type}/{category}", status_code=201, dependencies=[Depends(require_admin)])
+async def add_knowledge_entry(kb_type: str, category: str, entry: KnowledgeEntryRequest):
+    """新增条目"""
+    validate_knowledge_target(kb_type, category)
+    journal, text = writable_journal(), validated_entry_text(entry)
+    try:
+        entry_key, terms = await asyncio.to_thread(journal.add, kb_type, category, text)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    invalidated = await apply_knowledge_changes(terms)
+    return knowledge_entry_response(entry_key, kb_type, category, text, invalidated)
+
+@app.put("/api/v1/knowledge/{kb_type}/{category}/{entry_id}", dependencies=[Depends(require_admin)])
+async def update_knowledge_entry(kb_type: str, category: str, entry_id: str, entry: KnowledgeEntryRequest):
+    """修改条目文本，条目ID不变"""
+    validate_knowledge_target(kb_type, category)
+    journal, text = writable_journal(), validated_entry_text(entry)
+    try:
+        terms = await asyncio.to_thread(journal.update, entry_id, kb_type, category, text)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="条目不存在")
+    invalidated = await apply_knowledge_changes(terms)
+    return knowledge_entry_response(entry_id, kb_type, category, text, invalidated)
+
+@app.delete("/api/v1/knowledge/{kb_type}/{category}/{entry_id}", dependencies=[Depends(require_admin)])
+async def delete_knowledge_entry(kb_type: str, category: str, entry_id: str):
+    """删除条目"""
+    validate_knowledge_target(kb_type, category)
+    journal = writable_journal()
+    try:
+        terms = await asyncio.to_thread(journal.delete, entry_id, kb_type, category)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="条目不存在")
+    invalidated = await apply_knowledge_changes(terms)
+    return knowledge_entry_response(entry_id, kb_type, category, None, invalidated)
+
+def build_demo_payload() -> Dict:
     """演示接口 - 快速展示鲁港通核心功能"""
     return {
         "title": "鲁港通系统演示",
@@ -410,8 +1107,12 @@ async def test_version():
         "status": "如果您看到这个消息，说明代码已更新"
     }
 
-@app.get("/api/v1/demo/detailed")
-async def detailed_demo_endpoint():
+@app.get("/api/v1/demo")
+async def demo_endpoint(request: Request):
+    """演示接口 - 快速展示鲁港通核心功能"""
+    return STATIC_RESPONSES["demo"].respond(request)
+
+def build_detailed_demo_payload() -> Dict:
     """详细演示接口 - 完整功能展示"""
     demo_queries = [
         {
@@ -464,8 +1165,12 @@ async def detailed_demo_endpoint():
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
 
-@app.get("/demo", response_class=HTMLResponse)
-async def demo_web_page():
+@app.get("/api/v1/demo/detailed")
+async def detailed_demo_endpoint(request: Request):
+    """详细演示接口 - 完整功能展示"""
+    return STATIC_RESPONSES["demo/detailed"].respond(request)
+
+def build_demo_page_html() -> str:
     """现代化AI聊天演示页面 - 对标市面主流AI平台"""
     html_content = """
     <!DOCTYPE html>
@@ -1088,6 +1793,80 @@ async def demo_web_page():
                 return messageDiv;
             }
             
+            function parseSseEvent(rawEvent) {
+                let name = 'message';
+                let data = '';
+                rawEvent.split('\\n').forEach(line => {
+                    if (line.startsWith('event:')) {
+                        name = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        data += line.slice(5).trim();
+                    }
+                });
+                return { name, data: data ? JSON.parse(data) : {} };
+            }
+            
+            // 逐段读取SSE流：meta事件携带模型信息，delta事件追加回答内容
+            async function renderStreamingAnswer(response, typingMessage) {
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                let meta = {};
+                let answerText = '';
+                let messageDiv = null;
+                let answerElement = null;
+                
+                const ensureMessage = () => {
+                    if (!messageDiv) {
+                        typingMessage.remove();
+                        messageDiv = addMessage('<span class="stream-answer"></span>', false);
+                        answerElement = messageDiv.querySelector('.stream-answer');
+                    }
+                };
+                
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                        const event = parseSseEvent(buffer.slice(0, boundary));
+                        buffer = buffer.slice(boundary + 2);
+                        
+                        if (event.name === 'meta') {
+                            meta = event.data;
+                        } else if (event.name === 'delta') {
+                            ensureMessage();
+                            answerText += event.data.content;
+                            answerElement.textContent = answerText;
+                        } else if (event.name === 'done') {
+                            meta = { ...meta, ...event.data };
+                        } else if (event.name === 'error') {
+                            ensureMessage();
+                            answerText += event.data.detail;
+                            answerElement.textContent = answerText;
+                        }
+                    }
+                    
+                    const chatMessages = document.getElementById('chatMessages');
+                    chatMessages.scrollTop = chatMessages.scrollHeight;
+                }
+                
+                ensureMessage();
+                if (!answerText) {
+                    answerElement.textContent = '抱歉，服务暂时不可用，请稍后重试。';
+                }
+                const metaElement = document.createElement('div');
+                metaElement.className = 'message-meta';
+                metaElement.innerHTML = `
+                    <i class="fas fa-robot"></i> ${meta.ai_service || ''} | 
+                    <i class="fas fa-database"></i> ${meta.source || ''} | 
+                    <i class="fas fa-chart-line"></i> 置信度: ${((meta.confidence || 0) * 100).toFixed(1)}%
+                `;
+                answerElement.after(metaElement);
+            }
+            
             async function sendMessage() {
                 const input = document.getElementById('chatInput');
                 const sendButton = document.getElementById('sendButton');
@@ -1118,28 +1897,15 @@ async def demo_web_page():
                             question: message,
                             language: 'zh',
                             user_type: 'business',
-                            knowledge_base: 'both'
+                            knowledge_base: 'both',
+                            stream: true
                         })
                     });
                     
-                    // 移除思考状态
-                    typingMessage.remove();
-                    
-                    if (response.ok) {
-                        const data = await response.json();
-                        const time = new Date().toLocaleTimeString('zh-CN', { hour: '2-digit', minute: '2-digit' });
-                        
-                        const aiResponse = `
-                            ${data.answer}
-                            <div class="message-meta">
-                                <i class="fas fa-robot"></i> ${data.ai_service} | 
-                                <i class="fas fa-database"></i> ${data.source} | 
-                                <i class="fas fa-chart-line"></i> 置信度: ${(data.confidence * 100).toFixed(1)}%
-                            </div>
-                        `;
-                        
-                        addMessage(aiResponse, false);
+                    if (response.ok && response.body) {
+                        await renderStreamingAnswer(response, typingMessage);
                     } else {
+                        typingMessage.remove();
                         addMessage('抱歉，服务暂时不可用，请稍后重试。', false);
                     }
                 } catch (error) {
@@ -1155,7 +1921,58 @@ async def demo_web_page():
     """
     return html_content
 
+@app.get("/demo", response_class=HTMLResponse)
+async def demo_web_page(request: Request):
+    """现代化AI聊天演示页面 - 对标市面主流AI平台"""
+    return STATIC_RESPONSES["demo_page"].respond(request)
+
+def knowledge_response_builders() -> Dict[str, tuple]:
+    knowledge_base = current_knowledge_base()
+    return {
+        f"knowledge/{kb_type}": ("json", build_knowledge_payload(kb_type, knowledge_base))
+        for kb_type in ("northbound", "southbound", "both")
+    }
+
+def rebuild_demo_responses():
+    """预生成演示接口与演示页面的响应体及压缩版本（与知识库内容无关，启动时调用一次）"""
+    STATIC_RESPONSES.update(precompute_all({
+        "demo": ("json", build_demo_payload()),
+        "demo/detailed": ("json", build_detailed_demo_payload()),
+        "demo_page": ("html", build_demo_page_html()),
+    }, max_age=STATIC_MAX_AGE))
+
+def rebuild_knowledge_responses():
+    """预生成知识库接口的响应（启动时、知识库切换后，以及条目增量写入后首次请求时调用）"""
+    global KNOWLEDGE_RESPONSES_STALE
+    KNOWLEDGE_RESPONSES_STALE = False
+    STATIC_RESPONSES.update(precompute_all(knowledge_response_builders(), max_age=STATIC_MAX_AGE))
+
+async def refresh_knowledge_responses():
+    """在线程池中重新生成知识库接口响应（序列化与压缩整个知识库），并发请求共用同一次生成"""
+    global KNOWLEDGE_RESPONSES_TASK
+    if KNOWLEDGE_RESPONSES_TASK is None or KNOWLEDGE_RESPONSES_TASK.done():
+        KNOWLEDGE_RESPONSES_TASK = asyncio.ensure_future(asyncio.to_thread(rebuild_knowledge_responses))
+    await asyncio.shield(KNOWLEDGE_RESPONSES_TASK)
+
+# 预生成响应 - 知识库与演示接口（预热阶段生成），客户端缓存时间通过 LUGANG_STATIC_MAX_AGE 配置
+STATIC_MAX_AGE = int(os.getenv("LUGANG_STATIC_MAX_AGE", "60"))
+STATIC_RESPONSES: Dict[str, PrecomputedResponse] = {}
+KNOWLEDGE_RESPONSES_STALE = True
+KNOWLEDGE_RESPONSES_TASK: Optional[asyncio.Future] = None
+
+STARTUP.record("app_setup", _MODULES_IMPORTED, time.perf_counter(), group="import")
+
+async def profile_startup() -> bool:
+    """执行一次完整的 lifespan 预热后退出，打印启动剖析报告"""
+    STARTUP.enabled = True
+    async with lifespan(app):
+        await STARTUP.wait(timeout=float("inf"))
+    return STARTUP.ready
+
 if __name__ == "__main__":
+    if "--startup-profile" in sys.argv:
+        sys.exit(0 if asyncio.run(profile_startup()) else 1)
+
     print("🚀 启动鲁港通智能双语知识库系统...")
     print("🌐 访问地址: http://localhost:8000")
     print("📚 API文档: http://localhost:8000/docs")
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 按 token 预算构建上下文
+Lu-Gang Connect - Token-Budgeted Context Packer
+按检索得分排序候选段落，去除近似重复，在各模型的提示词预算内装入系统提示词；
+token 计数带缓存，安装 tiktoken 时使用 BPE 计数，否则按字符类别估算；
+tiktoken 编码文件首次使用需联网下载，可预先放入 LUGANG_TIKTOKEN_CACHE_DIR（默认本目录下 tiktoken_cache/）离线使用
+"""
+
+import math
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional
+
+from lugang_search import SearchHit, tokenize
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_CJK_CHAR = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+_WORD = re.compile(r"[A-Za-z0-9]+")
+_OTHER = re.compile(r"[^\sA-Za-z0-9\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """无 tokenizer 时的保守估算：中文字符与标点各 1，英文/数字每 4 个字符 1，其他符号各 1"""
+    words = sum(math.ceil(len(word) / 4) for word in _WORD.findall(text))
+    return len(_CJK_CHAR.findall(text)) + words + len(_OTHER.findall(text))
+
+
+DEFAULT_TIKTOKEN_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiktoken_cache")
+
+
+def load_tiktoken_encoding(encoding: str, cache_dir: Optional[str] = None, timeout: float = 10.0):
+    """加载 tiktoken 编码，失败或超过 timeout 秒（离线环境下载可能长时间挂起）时返回 None；
+    cache_dir 存在时作为编码文件缓存目录（tiktoken 自身的 TIKTOKEN_CACHE_DIR 优先）"""
+    if cache_dir and os.path.isdir(cache_dir):
+        os.environ.setdefault("TIKTOKEN_CACHE_DIR", cache_dir)
+    result = {}
+
+    def load():
+        try:
+            result["encoding"] = tiktoken.get_encoding(encoding)
+        except Exception as e:
+            result["error"] = e
+
+    # 守护线程加载：超时后放弃等待，不阻塞启动与进程退出
+    thread = threading.Thread(target=load, name="tiktoken-load", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if "encoding" in result:
+        return result["encoding"]
+    print(f"tiktoken 编码 {encoding} 加载失败，使用估算计数: {result.get('error', f'超过 {timeout} 秒')}")
+    return None
+
+
+class TokenCounter:
+    """带 LRU 缓存的 token 计数器，知识库段落在请求间重复出现，命中率高"""
+
+    def __init__(self, encoding: Optional[str] = "cl100k_base", cache_size: int = 8192,
+                 cache_dir: Optional[str] = DEFAULT_TIKTOKEN_CACHE_DIR, load_timeout: float = 10.0):
+        self.name = "estimate"
+        self._encode = None
+        if tiktoken is not None and encoding:
+            loaded = load_tiktoken_encoding(encoding, cache_dir, load_timeout)
+            if loaded is not None:
+                self._encode = loaded.encode
+                self.name = f"tiktoken:{encoding}"
+        self.count = lru_cache(maxsize=cache_size)(self._count)
+
+    def _count(self, text: str) -> int:
+        if self._encode is not None:
+            return len(self._encode(text, disallowed_special=()))
+        return estimate_tokens(text)
+
+    def truncate(self, text: str, budget: int) -> str:
+        """截取不超过 budget 个 token 的最长前缀（按字符二分，不写入缓存）"""
+        if self._count(text) <= budget:
+            return text
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self._count(text[:middle]) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low]
+
+    def stats(self) -> Dict:
+        info = self.count.cache_info()
+        return {"tokenizer": self.name, "cache_hits": info.hits, "cache_misses": info.misses,
+                "cache_size": info.currsize}
+
+
+@lru_cache(maxsize=8192)
+def _shingles(text: str) -> frozenset:
+    return frozenset(tokenize(text))
+
+
+def is_near_duplicate(text: str, selected: List[str], threshold: float) -> bool:
+    """与已选段落的词项 Jaccard 相似度达到阈值视为重复"""
+    shingles = _shingles(text)
+    for other in selected:
+        other_shingles = _shingles(other)
+        union = len(shingles | other_shingles)
+        if union and len(shingles & other_shingles) / union >= threshold:
+            return True
+    return False
+
+
+class PackedContext(NamedTuple):
+    text: str
+    passages: List[SearchHit]
+    tokens: int
+    budget: int
+    dropped_duplicates: int
+    dropped_budget: int
+
+
+def _parse_model_values(value: str) -> Dict[str, int]:
+    """解析 "model=数值,model=数值" 形式的按模型配置"""
+    result = {}
+    for item in value.split(","):
+        model, _, number = item.partition("=")
+        if model.strip() and number.strip():
+            result[model.strip()] = int(number)
+    return result
+
+
+class ContextPacker:
+    """按模型的提示词预算装入检索段落，并给出各模型的回答长度上限"""
+
+    def __init__(self, counter: TokenCounter, prompt_budget: int = 1500,
+                 model_budgets: Optional[Dict[str, int]] = None, max_tokens: int = 500,
+                 model_max_tokens: Optional[Dict[str, int]] = None, candidates: int = 8,
+                 max_passages: int = 5, dedup_threshold: float = 0.8, separator: str = " "):
+        self.counter = counter
+        self.prompt_budget = prompt_budget
+        self.model_budgets = model_budgets or {}
+        self.default_max_tokens = max_tokens
+        self.model_max_tokens = model_max_tokens or {}
+        self.candidates = candidates
+        self.max_passages = max_passages
+        self.dedup_threshold = dedup_threshold
+        self.separator = separator
+        self.packed = 0
+        self.truncated = 0
+        self.dropped_duplicates = 0
+        self.dropped_budget = 0
+
+    @classmethod
+    def from_env(cls) -> "ContextPacker":
+        """读取 LUGANG_PROMPT_BUDGET(S) / LUGANG_MAX_TOKENS(_PER_MODEL) / LUGANG_CONTEXT_* / LUGANG_TIKTOKEN_* 环境变量"""
+        return cls(
+            TokenCounter(os.getenv("LUGANG_TOKENIZER_ENCODING", "cl100k_base"),
+                         int(os.getenv("LUGANG_TOKEN_CACHE_SIZE", "8192")),
+                         os.getenv("LUGANG_TIKTOKEN_CACHE_DIR", DEFAULT_TIKTOKEN_CACHE_DIR),
+                         float(os.getenv("LUGANG_TIKTOKEN_TIMEOUT", "10"))),
+            prompt_budget=int(os.getenv("LUGANG_PROMPT_BUDGET", "1500")),
+            model_budgets=_parse_model_values(os.getenv("LUGANG_PROMPT_BUDGETS", "")),
+            max_tokens=int(os.getenv("LUGANG_MAX_TOKENS", "500")),
+            model_max_tokens=_parse_model_values(os.getenv("LUGANG_MAX_TOKENS_PER_MODEL", "")),
+            candidates=int(os.getenv("LUGANG_CONTEXT_CANDIDATES", "8")),
+            max_passages=int(os.getenv("LUGANG_CONTEXT_MAX_PASSAGES", "5")),
+            dedup_threshold=float(os.getenv("LUGANG_CONTEXT_DEDUP_THRESHOLD", "0.8")),
+        )
+
+    def budget(self, model: str) -> int:
+        return self.model_budgets.get(model, self.prompt_budget)
+
+    def max_tokens(self, model: str) -> int:
+        return self.model_max_tokens.get(model, self.default_max_tokens)
+
+    def pack(self, hits: List[SearchHit], model: str, reserved: int = 0) -> PackedContext:
+        """按得分从高到低装入段落：跳过近似重复，放不下的跳过并尝试更短的后续段落，
+        最多装入 max_passages 段；reserved 为系统提示词模板与用户问题已占用的 token 数"""
+        budget = max(0, self.budget(model) - reserved)
+        separator_tokens = self.counter.count(self.separator) if self.separator.strip() else 0
+        selected: List[SearchHit] = []
+        texts: List[str] = []
+        used = duplicates = over_budget = 0
+        for hit in sorted(hits, key=lambda hit: hit.score, reverse=True):
+            if len(selected) >= self.max_passages:
+                break
+            if hit.text in texts or is_near_duplicate(hit.text, texts, self.dedup_threshold):
+                duplicates += 1
+                continue
+            cost = self.counter.count(hit.text) + (separator_tokens if texts else 0)
+            if used + cost > budget:
+                over_budget += 1
+                continue
+            selected.append(hit)
+            texts.append(hit.text)
+            used += cost
+
+        if not selected and over_budget and budget > 0:
+            # 最相关的段落单独也放不下时截断装入，避免上下文为空
+            top = max(hits, key=lambda hit: hit.score)
+            text = self.counter.truncate(top.text, budget)
+            if text:
+                selected, texts, used = [top._replace(text=text)], [text], self.counter.count(text)
+                over_budget -= 1
+                self.truncated += 1
+
+        self.packed += 1
+        self.dropped_duplicates += duplicates
+        self.dropped_budget += over_budget
+        return PackedContext(self.separator.join(texts), selected, used, budget, duplicates, over_budget)
+
+    def stats(self) -> Dict:
+        return {
+            "prompt_budget": self.prompt_budget,
+            "model_budgets": self.model_budgets,
+            "max_tokens": self.default_max_tokens,
+            "model_max_tokens": self.model_max_tokens,
+            "candidates": self.candidates,
+            "max_passages": self.max_passages,
+            "packed": self.packed,
+            "truncated": self.truncated,
+            "dropped_duplicates": self.dropped_duplicates,
+            "dropped_budget": self.dropped_budget,
+            **self.counter.stats(),
+        }
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 响应序列化与压缩
+Lu-Gang Connect - Response Serialization & Compression
+JSON 以 UTF-8 直接输出中文（安装 orjson 时用 orjson 序列化），
+动态响应按 Accept-Encoding 协商 br/gzip 压缩，小于阈值的响应、已压缩的预生成响应与流式响应不处理
+"""
+
+import gzip
+import json
+import os
+from typing import Any, Dict, Iterable, Optional
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from lugang_static import brotli, choose_encoding
+
+try:
+    import orjson
+except ImportError:  # 无 orjson 时退回标准库 json
+    orjson = None
+
+# 逐块推送的响应类型，压缩会破坏增量到达
+STREAMING_MEDIA_TYPES = ("text/event-stream", "application/x-ndjson")
+
+
+def _default(value: Any):
+    if isinstance(value, BaseModel):
+        return value.model_dump() if hasattr(value, "model_dump") else value.dict()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+def dumps(value: Any) -> bytes:
+    """序列化为紧凑的 UTF-8 JSON（中文不转义），支持 pydantic 模型与 datetime"""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=_default, ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """网关默认响应类：序列化走 dumps"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class ResponseCompressor:
+    """压缩配置与统计；LUGANG_COMPRESSION=off 时关闭"""
+
+    def __init__(self, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4,
+                 excluded_media_types: Iterable[str] = STREAMING_MEDIA_TYPES, enabled: bool = True):
+        self.enabled = enabled
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.excluded_media_types = tuple(excluded_media_types)
+        self.encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+        self.compressed: Dict[str, int] = {encoding: 0 for encoding in self.encodings}
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @classmethod
+    def from_env(cls) -> "ResponseCompressor":
+        """LUGANG_COMPRESSION / _MIN_SIZE / _GZIP_LEVEL / _BROTLI_QUALITY"""
+        return cls(
+            minimum_size=int(os.getenv("LUGANG_COMPRESSION_MIN_SIZE", "1024")),
+            gzip_level=int(os.getenv("LUGANG_COMPRESSION_GZIP_LEVEL", "6")),
+            brotli_quality=int(os.getenv("LUGANG_COMPRESSION_BROTLI_QUALITY", "4")),
+            enabled=os.getenv("LUGANG_COMPRESSION", "on").lower() not in ("0", "off", "false", "no"),
+        )
+
+    def negotiate(self, accept_encoding: str) -> str:
+        if not self.enabled or not accept_encoding:
+            return "identity"
+        return choose_encoding(accept_encoding, self.encodings)
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            compressed = brotli.compress(body, quality=self.brotli_quality)
+        else:
+            compressed = gzip.compress(body, compresslevel=self.gzip_level)
+        self.compressed[encoding] += 1
+        self.bytes_in += len(body)
+        self.bytes_out += len(compressed)
+        return compressed
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "encodings": self.encodings,
+            "minimum_size": self.minimum_size,
+            "json": "orjson" if orjson is not None else "json",
+            "compressed": self.compressed,
+            "skipped": self.skipped,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+        }
+
+
+class CompressionMiddleware:
+    """纯 ASGI 压缩中间件：只压缩一次性发出的响应体（首个 body 消息即结束），
+    流式响应、已带 Content-Encoding 的响应与小于阈值的响应原样透传"""
+
+    def __init__(self, app, compressor: ResponseCompressor):
+        self.app = app
+        self.compressor = compressor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"accept-encoding"), "")
+        encoding = self.compressor.negotiate(accept)
+        if encoding == "identity":
+            await self.app(scope, receive, send)
+            return
+
+        compressor = self.compressor
+        start: Optional[Dict] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                headers = {name.lower(): value for name, value in message.get("headers", [])}
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                passthrough = b"content-encoding" in headers or content_type.startswith(compressor.excluded_media_types)
+                if passthrough:
+                    await send(message)
+                return
+            if passthrough:
+                await send(message)
+                return
+
+            passthrough = True  # 后续消息（如有）直接转发
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < compressor.minimum_size:
+                compressor.skipped += 1
+                await send(start)
+                await send(message)
+                return
+            compressed = compressor.compress(body, encoding)
+            headers = [(name, value) for name, value in start.get("headers", [])
+                       if name.lower() not in (b"content-length", b"vary")]
+            vary = b", ".join(value for name, value in start.get("headers", []) if name.lower() == b"vary")
+            if b"accept-encoding" not in vary.lower():
+                vary = vary + b", Accept-Encoding" if vary else b"Accept-Encoding"
+            headers += [(b"content-encoding", encoding.encode("latin-1")),
+                        (b"content-length", str(len(compressed)).encode("latin-1")),
+                        (b"vary", vary)]
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": compressed, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
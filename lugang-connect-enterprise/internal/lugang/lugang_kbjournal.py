@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 知识库增量写入
+Lu-Gang Connect - Incremental Knowledge Base Journal
+条目增删改先追加写入日志（每行一条 JSON 记录）再生效：新增与修改的条目进入小型增量段，
+被删除或修改的基础条目以墓碑过滤，检索时两段合并排序，无需重建整个索引；
+增量段超过阈值时后台合并为新的基础索引，日志按条目只保留最后一条记录定期压缩；
+启动时顺序重放日志，耗时与日志大小成线性；多 worker 部署时各进程轮询同一日志文件，追上其他进程的写入
+
+用法: python lugang_kbjournal.py compact <日志路径>
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from lugang_search import KnowledgeIndex, SearchHit, entry_id
+
+try:
+    import fcntl
+except ImportError:  # Windows 下不做跨进程写入互斥
+    fcntl = None
+
+# 增量段条目数达到该值时合并为新的基础索引
+DEFAULT_MERGE_THRESHOLD = 256
+
+
+class KnowledgeEntry(NamedTuple):
+    kb_type: str
+    category: str
+    text: str
+
+
+def encode_record(key: str, entry: Optional[KnowledgeEntry]) -> bytes:
+    """日志记录：{"op": "put", "id", "kb_type", "category", "text", "ts"} 或 {"op": "delete", "id", "ts"}"""
+    record = {"op": "put", "id": key, **entry._asdict()} if entry is not None else {"op": "delete", "id": key}
+    record["ts"] = round(time.time(), 3)
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def decode_records(data: bytes) -> List[Tuple[str, Optional[KnowledgeEntry]]]:
+    records = []
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            entry = None if record["op"] == "delete" else \
+                KnowledgeEntry(record["kb_type"], record["category"], record["text"])
+        except (ValueError, KeyError) as e:
+            print(f"⚠️ 跳过无法解析的知识库日志记录: {e}")
+            continue
+        records.append((record["id"], entry))
+    return records
+
+
+class KnowledgeLog:
+    """追加写日志文件：写入与压缩持有文件排他锁，压缩时写临时文件后原子替换"""
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+
+    def signature(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def read(self, offset: int = 0) -> Tuple[List[Tuple[str, Optional[KnowledgeEntry]]], int]:
+        """从 offset 起读取完整的记录行，返回记录与下次读取位置；末尾未写完的行留待下次读取"""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        end = data.rfind(b"\n") + 1
+        return decode_records(data[:end]), offset + end
+
+    @contextmanager
+    def locked(self):
+        """打开日志并加排他锁；锁住的文件已被压缩替换时重新打开"""
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                if os.fstat(fd).st_ino == self.signature():
+                    yield fd
+                    return
+            finally:
+                os.close(fd)
+
+    def append(self, fd: int, payload: bytes):
+        """在已加锁的日志末尾追加记录；上次写入中断留下的半行先截掉"""
+        size = os.fstat(fd).st_size
+        if size and os.pread(fd, 1, size - 1) != b"\n":
+            tail = os.pread(fd, min(size, 1 << 20), max(size - (1 << 20), 0))
+            os.ftruncate(fd, size - len(tail) + tail.rfind(b"\n") + 1)
+        os.write(fd, payload)
+        if self.fsync:
+            os.fsync(fd)
+
+    def replace(self, payload: bytes):
+        """写临时文件后原子替换日志（调用方持有锁）"""
+        tmp_path = f"{self.path}.tmp.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def index_with_keys(entries: Iterable[Tuple[str, KnowledgeEntry]], posting_budget: int, lexicon=None,
+                    base: Optional[KnowledgeIndex] = None) -> Tuple[KnowledgeIndex, List[str]]:
+    """由 (条目ID, 条目) 构建索引，返回索引与按文档ID排列的条目ID"""
+    knowledge_base: Dict[str, Dict[str, List[str]]] = {}
+    keys: Dict[str, Dict[str, List[str]]] = {}
+    for key, (kb_type, category, text) in entries:
+        knowledge_base.setdefault(kb_type, {}).setdefault(category, []).append(text)
+        keys.setdefault(kb_type, {}).setdefault(category, []).append(key)
+    # KnowledgeIndex 按知识库、分类的插入顺序编号文档，条目ID按同样顺序展开
+    ordered = [key for categories in keys.values() for items in categories.values() for key in items]
+    return KnowledgeIndex(knowledge_base, posting_budget, lexicon, base=base), ordered
+
+
+class _OverlayDocs:
+    """按文档ID访问基础索引与增量段的文档，增量段文档ID接在基础索引之后"""
+
+    def __init__(self, base_docs, delta_docs):
+        self._base = base_docs
+        self._delta = delta_docs
+
+    def __len__(self) -> int:
+        return len(self._base) + len(self._delta)
+
+    def __getitem__(self, doc_id: int) -> Tuple[str, str, str]:
+        offset = len(self._base)
+        return self._base[doc_id] if doc_id < offset else self._delta[doc_id - offset]
+
+    def __iter__(self):
+        yield from self._base
+        yield from self._delta
+
+
+class OverlayKnowledgeIndex:
+    """基础索引 + 增量段的只读视图，检索接口与 KnowledgeIndex 一致；
+    增量段按基础索引的语料统计打分，被删除或修改的基础文档以墓碑过滤"""
+
+    def __init__(self, base: KnowledgeIndex, base_keys: List[str], deleted: Set[int],
+                 delta: Optional[KnowledgeIndex] = None, delta_keys: Optional[List[str]] = None):
+        self.base = base
+        self.delta = delta
+        self.deleted = deleted
+        self.lexicon = base.lexicon
+        self.posting_budget = base.posting_budget
+        self.docs = _OverlayDocs(base.docs, delta.docs if delta is not None else [])
+        self._keys = _OverlayDocs(base_keys, delta_keys or [])
+
+    @property
+    def modified(self) -> bool:
+        """是否有尚未合并进基础索引的变更"""
+        return bool(self.deleted) or self.delta is not None
+
+    def __len__(self) -> int:
+        return len(self.base) - len(self.deleted) + (len(self.delta) if self.delta is not None else 0)
+
+    def _live(self):
+        deleted = self.deleted
+        for doc_id, (doc, key) in enumerate(zip(self.docs, self._keys)):
+            if doc_id not in deleted:
+                yield key, doc
+
+    def query_terms(self, question: str) -> set:
+        return self.base.query_terms(question)
+
+    def document_terms(self, text: str) -> set:
+        return self.base.document_terms(text)
+
+    def knowledge_base(self) -> Dict[str, Dict[str, List[str]]]:
+        result: Dict[str, Dict[str, List[str]]] = {}
+        for _, (kb_type, category, text) in self._live():
+            result.setdefault(kb_type, {}).setdefault(category, []).append(text)
+        return result
+
+    def entries(self, kb_type: str, category: str) -> List[Tuple[str, str]]:
+        return [(key, text) for key, (doc_kb, doc_category, text) in self._live()
+                if doc_kb == kb_type and doc_category == category]
+
+    def _merge(self, base_hits: List[SearchHit], delta_hits: List[SearchHit], top_k: int) -> List[SearchHit]:
+        offset = len(self.base.docs)
+        hits = [hit for hit in base_hits if hit.doc_id not in self.deleted]
+        hits.extend(hit._replace(doc_id=hit.doc_id + offset) for hit in delta_hits)
+        hits.sort(key=lambda hit: (-hit.score, hit.doc_id))
+        return hits[:top_k]
+
+    def search(self, question: str, kb_type: str = "both", top_k: int = 5,
+               boosts: Optional[Dict[Tuple[Optional[str], str], float]] = None) -> List[SearchHit]:
+        # 基础索引多取墓碑数量的候选，过滤后仍能凑满 top_k
+        base_hits = self.base.search(question, kb_type, top_k + len(self.deleted), boosts)
+        delta_hits = self.delta.search(question, kb_type, top_k, boosts) if self.delta is not None else []
+        return self._merge(base_hits, delta_hits, top_k)
+
+    def search_many(self, queries: List[Tuple[str, str, Optional[Dict[Tuple[Optional[str], str], float]]]],
+                    top_k: int = 5) -> List[List[SearchHit]]:
+        base_results = self.base.search_many(queries, top_k + len(self.deleted))
+        if self.delta is None:
+            delta_results = [[] for _ in queries]
+        else:
+            delta_results = self.delta.search_many(queries, top_k)
+        return [self._merge(base_hits, delta_hits, top_k)
+                for base_hits, delta_hits in zip(base_results, delta_results)]
+
+
+class KnowledgeJournal:
+    """知识库增量写入：覆盖表（条目ID -> 条目，None 表示删除）记录相对源知识库的全部变更，
+    自上次合并以来的变更构成增量段；写入接口返回受影响的词项，用于精确失效问答缓存"""
+
+    def __init__(self, path: str, lexicon=None, merge_threshold: int = DEFAULT_MERGE_THRESHOLD, fsync: bool = True):
+        self.log = KnowledgeLog(path, fsync)
+        self.lexicon = lexicon
+        self.merge_threshold = merge_threshold
+        self.overrides: Dict[str, Optional[KnowledgeEntry]] = {}
+        self.index: Optional[OverlayKnowledgeIndex] = None
+        self._source: Optional[KnowledgeIndex] = None
+        self._source_keys: Set[str] = set()
+        self._base: Optional[KnowledgeIndex] = None
+        self._base_keys: List[str] = []
+        self._base_ids: Dict[str, int] = {}
+        # 自上次合并以来的变更：条目ID -> (条目, 序号)
+        self._pending: Dict[str, Tuple[Optional[KnowledgeEntry], int]] = {}
+        self._sequence = 0
+        self._lock = threading.RLock()
+        self.writes = 0
+        self.merges = 0
+        self.compactions = 0
+
+        started = time.perf_counter()
+        records, self._offset = self.log.read(0)
+        for key, entry in records:
+            self.overrides[key] = entry
+        self._signature = self.log.signature()
+        self._log_records = len(records)
+        self.replay_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    @classmethod
+    def from_env(cls, lexicon=None) -> Optional["KnowledgeJournal"]:
+        """LUGANG_KB_LOG 指定日志路径，未设置时不启用增量写入；
+        LUGANG_KB_MERGE_THRESHOLD 增量段合并阈值，LUGANG_KB_LOG_FSYNC=off 时写入不等待落盘"""
+        path = os.getenv("LUGANG_KB_LOG")
+        if not path:
+            return None
+        return cls(
+            path,
+            lexicon,
+            merge_threshold=int(os.getenv("LUGANG_KB_MERGE_THRESHOLD", str(DEFAULT_MERGE_THRESHOLD))),
+            fsync=os.getenv("LUGANG_KB_LOG_FSYNC", "on").lower() not in ("0", "off", "false", "no"),
+        )
+
+    # ---- 索引维护 ----
+
+    def _set_base(self, base: KnowledgeIndex, keys: List[str]):
+        self._base = base
+        self._base_keys = keys
+        self._base_ids = {key: doc_id for doc_id, key in enumerate(keys)}
+
+    def _build_merged(self, source: KnowledgeIndex,
+                      overrides: Dict[str, Optional[KnowledgeEntry]]) -> Tuple[KnowledgeIndex, List[str]]:
+        """源知识库叠加覆盖表后整体构建索引"""
+        entries = []
+        for kb_type, category, text in source.docs:
+            key = entry_id(kb_type, category, text)
+            if key not in overrides:
+                entries.append((key, KnowledgeEntry(kb_type, category, text)))
+        entries.extend((key, entry) for key, entry in overrides.items() if entry is not None)
+        return index_with_keys(entries, source.posting_budget, self.lexicon)
+
+    def _rebuild_overlay(self):
+        """由增量变更重建增量段与墓碑，开销与增量段大小成正比"""
+        deleted = {self._base_ids[key] for key in self._pending if key in self._base_ids}
+        added = [(key, entry) for key, (entry, _) in self._pending.items() if entry is not None]
+        delta, delta_keys = index_with_keys(added, self._base.posting_budget, self.lexicon, self._base) \
+            if added else (None, None)
+        self.index = OverlayKnowledgeIndex(self._base, self._base_keys, deleted, delta, delta_keys)
+
+    def rebase(self, source: KnowledgeIndex) -> OverlayKnowledgeIndex:
+        """切换源索引（启动时、知识库快照切换时），覆盖表重新叠加其上；
+        变更不多时作为增量段，否则直接合并构建"""
+        with self._lock:
+            self._source = source
+            source_keys = [entry_id(*doc) for doc in source.docs]
+            self._source_keys = set(source_keys)
+            if len(self.overrides) >= self.merge_threshold:
+                self._set_base(*self._build_merged(source, self.overrides))
+                self._pending = {}
+            else:
+                self._set_base(source, source_keys)
+                self._pending = {key: (entry, self._sequence) for key, entry in self.overrides.items()}
+            self._rebuild_overlay()
+            return self.index
+
+    def get(self, key: str) -> Optional[KnowledgeEntry]:
+        """当前生效的条目"""
+        if key in self._pending:
+            return self._pending[key][0]
+        doc_id = self._base_ids.get(key)
+        return KnowledgeEntry(*self._base.docs[doc_id]) if doc_id is not None else None
+
+    def _apply(self, key: str, entry: Optional[KnowledgeEntry]) -> Set[str]:
+        """应用一条变更，返回新旧条目的词项；与当前状态相同时不做处理"""
+        previous = self.get(key)
+        if previous == entry:
+            return set()
+        self.overrides[key] = entry
+        self._sequence += 1
+        self._pending[key] = (entry, self._sequence)
+        terms = set()
+        for changed in (previous, entry):
+            if changed is not None:
+                terms |= self._base.document_terms(changed.text)
+        return terms
+
+    def _catch_up(self) -> Optional[Set[str]]:
+        """读取其他进程追加的记录；日志被压缩替换时重新读取整个日志并与当前状态比较。
+        无变化时返回 None"""
+        signature = self.log.signature()
+        if signature == self._signature:
+            records, offset = self.log.read(self._offset)
+            self._log_records += len(records)
+        else:
+            records, offset = self.log.read(0)
+            self._log_records = len(records)
+            # 压缩时丢弃的删除记录，对应条目在本进程也视为已删除
+            latest = dict(records)
+            records = list(latest.items()) + [(key, None) for key in self.overrides if key not in latest]
+        self._offset, self._signature = offset, signature
+        changed = False
+        terms: Set[str] = set()
+        for key, entry in records:
+            if self.get(key) != entry:
+                terms |= self._apply(key, entry)
+                changed = True
+        if not changed:
+            return None
+        self._rebuild_overlay()
+        return terms
+
+    # ---- 写入 ----
+
+    def _commit(self, fd: int, key: str, entry: Optional[KnowledgeEntry]) -> Set[str]:
+        payload = encode_record(key, entry)
+        self.log.append(fd, payload)
+        self._offset += len(payload)
+        self._log_records += 1
+        self.writes += 1
+        terms = self._apply(key, entry)
+        self._rebuild_overlay()
+        return terms
+
+    def add(self, kb_type: str, category: str, text: str) -> Tuple[str, Set[str]]:
+        """新增条目，返回条目ID与受影响的词项；同一分类下已有相同文本时抛出 ValueError"""
+        entry = KnowledgeEntry(kb_type, category, text)
+        key = entry_id(kb_type, category, text)
+        with self._lock, self.log.locked() as fd:
+            terms = self._catch_up() or set()
+            existing = self.get(key)
+            if existing == entry:
+                raise ValueError("该分类下已有相同条目")
+            if existing is not None:
+                # 该ID的条目已被修改为其他文本，新条目另取ID
+                key = entry_id(kb_type, category, f"{text}\x1f{time.time_ns()}")
+            terms |= self._commit(fd, key, entry)
+        return key, terms
+
+    def _require(self, key: str, kb_type: str, category: str):
+        current = self.get(key)
+        if current is None or (current.kb_type, current.category) != (kb_type, category):
+            raise KeyError(key)
+
+    def update(self, key: str, kb_type: str, category: str, text: str) -> Set[str]:
+        """修改条目文本，条目ID不变；条目不存在时抛出 KeyError"""
+        with self._lock, self.log.locked() as fd:
+            terms = self._catch_up() or set()
+            self._require(key, kb_type, category)
+            return terms | self._commit(fd, key, KnowledgeEntry(kb_type, category, text))
+
+    def delete(self, key: str, kb_type: str, category: str) -> Set[str]:
+        """删除条目；条目不存在时抛出 KeyError"""
+        with self._lock, self.log.locked() as fd:
+            terms = self._catch_up() or set()
+            self._require(key, kb_type, category)
+            return terms | self._commit(fd, key, None)
+
+    # ---- 后台维护 ----
+
+    def merge(self) -> bool:
+        """增量段达到阈值时合并为新的基础索引；构建在锁外进行，期间检索与写入照常"""
+        with self._lock:
+            if len(self._pending) < self.merge_threshold:
+                return False
+            source, overrides, sequence = self._source, dict(self.overrides), self._sequence
+        merged = self._build_merged(source, overrides)
+        with self._lock:
+            if self._source is not source:
+                return False
+            self._set_base(*merged)
+            self._pending = {key: value for key, value in self._pending.items() if value[1] > sequence}
+            self._rebuild_overlay()
+            self.merges += 1
+        return True
+
+    def compact(self) -> bool:
+        """日志记录数超过条目数两倍时压缩：每个条目只保留最后一条记录，
+        源知识库中不存在的条目的删除记录一并丢弃"""
+        with self._lock:
+            if self._log_records <= max(self.merge_threshold, 2 * len(self.overrides)):
+                return False
+            with self.log.locked():
+                self._catch_up()
+                for key in [key for key, entry in self.overrides.items()
+                            if entry is None and key not in self._source_keys]:
+                    del self.overrides[key]
+                payload = b"".join(encode_record(key, entry) for key, entry in self.overrides.items())
+                self.log.replace(payload)
+            self._signature = self.log.signature()
+            self._offset = len(payload)
+            self._log_records = len(self.overrides)
+            self.compactions += 1
+        return True
+
+    def refresh(self) -> Set[str]:
+        """后台轮询：追上其他进程的写入，按需合并增量段与压缩日志；返回受影响的词项"""
+        with self._lock:
+            terms = self._catch_up() or set()
+        self.merge()
+        self.compact()
+        return terms
+
+    def stats(self) -> Dict:
+        index = self.index
+        return {
+            "log": self.log.path,
+            "log_bytes": self._offset,
+            "log_records": self._log_records,
+            "overrides": len(self.overrides),
+            "pending": len(self._pending),
+            "tombstones": len(index.deleted) if index is not None else 0,
+            "merge_threshold": self.merge_threshold,
+            "writes": self.writes,
+            "merges": self.merges,
+            "compactions": self.compactions,
+            "replay_ms": self.replay_ms,
+        }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "compact":
+        print(__doc__)
+        sys.exit(1)
+    log = KnowledgeLog(sys.argv[2])
+    with log.locked():
+        records, _ = log.read(0)
+        latest = dict(records)
+        log.replace(b"".join(encode_record(key, entry) for key, entry in latest.items()))
+    print(f"✅ 日志已压缩: {len(records)} -> {len(latest)} 条记录")
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 知识库快照存储
+Lu-Gang Connect - Memory-Mapped Knowledge Base Snapshot
+将知识库条目、分类与倒排索引写成紧凑的二进制快照，各 worker 以只读 mmap
+共享同一份页缓存；快照文件原子替换后无需重启即可切换
+
+用法: python lugang_kbstore.py build <knowledge_base.json> <输出快照路径>
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from lugang_lexicon import Lexicon
+from lugang_search import DEFAULT_POSTING_BUDGET, KnowledgeIndex
+
+try:
+    import fcntl
+except ImportError:  # Windows 下不做跨进程构建互斥
+    fcntl = None
+
+SNAPSHOT_MAGIC = b"LGKB"
+SNAPSHOT_VERSION = 1
+
+# 头部：魔数、版本号，以及 10 个段偏移
+# meta, doc_categories, text_offsets, text_blob, term_offsets, term_blob,
+# posting_offsets, posting_doc_ids, posting_weights, end
+_HEADER = struct.Struct("<4sI10Q")
+
+
+def _align(buffer: bytearray, alignment: int = 8):
+    buffer.extend(b"\0" * (-len(buffer) % alignment))
+
+
+def write_snapshot(index: KnowledgeIndex, path: str, source: str = ""):
+    """将内存索引序列化为快照文件，先写临时文件再原子替换"""
+    text_offsets = array("Q", [0])
+    text_blob = bytearray()
+    for _, _, text in index.docs:
+        text_blob.extend(text.encode("utf-8"))
+        text_offsets.append(len(text_blob))
+
+    terms = sorted(index.postings, key=lambda term: term.encode("utf-8"))
+    term_offsets = array("Q", [0])
+    term_blob = bytearray()
+    posting_offsets = array("Q", [0])
+    posting_doc_ids = array("I")
+    posting_weights = array("f")
+    for term in terms:
+        term_blob.extend(term.encode("utf-8"))
+        term_offsets.append(len(term_blob))
+        doc_ids, weights = index.postings[term]
+        posting_doc_ids.extend(doc_ids)
+        posting_weights.extend(weights)
+        posting_offsets.append(len(posting_doc_ids))
+
+    meta = json.dumps({
+        "documents": len(index.docs),
+        "terms": len(terms),
+        "postings": len(posting_doc_ids),
+        "posting_budget": index.posting_budget,
+        "avg_length": index.avg_length,
+        "lexicon": index.lexicon.version if index.lexicon is not None else None,
+        "categories": index.categories,
+        "source": source,
+        "built_at": time.time(),
+    }, ensure_ascii=False).encode("utf-8")
+
+    body = bytearray(b"\0" * _HEADER.size)
+    offsets = []
+    for section in (meta, index.doc_categories.tobytes(), text_offsets.tobytes(), text_blob,
+                    term_offsets.tobytes(), term_blob, posting_offsets.tobytes(),
+                    posting_doc_ids.tobytes(), posting_weights.tobytes()):
+        _align(body)
+        offsets.append(len(body))
+        body.extend(section)
+    offsets.append(len(body))
+    body[:_HEADER.size] = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, *offsets)
+
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def build_snapshot(knowledge_base: Dict[str, Dict[str, List[str]]], path: str, source: str = "", lexicon=None):
+    """由知识库字典构建快照；倒排表按跨语言词典规范化后的词项构建"""
+    write_snapshot(KnowledgeIndex(knowledge_base, lexicon=lexicon), path, source)
+
+
+class _MappedDocs:
+    """快照中的文档序列，按需解码，元素为 (知识库, 分类, 文本)"""
+
+    def __init__(self, mm: mmap.mmap, categories: List[Tuple[str, str]],
+                 doc_categories: memoryview, text_offsets: memoryview, text_base: int):
+        self._mm = mm
+        self._categories = categories
+        self._doc_categories = doc_categories
+        self._text_offsets = text_offsets
+        self._text_base = text_base
+
+    def __len__(self) -> int:
+        return len(self._doc_categories)
+
+    def __getitem__(self, doc_id: int) -> Tuple[str, str, str]:
+        kb_type, category = self._categories[self._doc_categories[doc_id]]
+        start = self._text_base + self._text_offsets[doc_id]
+        end = self._text_base + self._text_offsets[doc_id + 1]
+        return kb_type, category, self._mm[start:end].decode("utf-8")
+
+    def __iter__(self):
+        for doc_id in range(len(self)):
+            yield self[doc_id]
+
+
+class _MappedPostings:
+    """快照中的倒排表：有序词项二分查找，倒排数组零拷贝"""
+
+    def __init__(self, mm: mmap.mmap, term_offsets: memoryview, term_base: int,
+                 posting_offsets: memoryview, doc_ids: memoryview, weights: memoryview):
+        self._mm = mm
+        self._term_offsets = term_offsets
+        self._term_base = term_base
+        self._posting_offsets = posting_offsets
+        self._doc_ids = doc_ids
+        self._weights = weights
+
+    def __len__(self) -> int:
+        return len(self._term_offsets) - 1
+
+    def _term(self, position: int) -> bytes:
+        return self._mm[self._term_base + self._term_offsets[position]:self._term_base + self._term_offsets[position + 1]]
+
+    def _find(self, term: str) -> int:
+        key = term.encode("utf-8")
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < len(self) and self._term(low) == key else -1
+
+    def get(self, term: str, default=None):
+        position = self._find(term)
+        if position < 0:
+            return default
+        start, end = self._posting_offsets[position], self._posting_offsets[position + 1]
+        return self._doc_ids[start:end], self._weights[start:end]
+
+    def __contains__(self, term: str) -> bool:
+        return self._find(term) >= 0
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self._term(position).decode("utf-8")
+
+    def __getitem__(self, term: str):
+        posting = self.get(term)
+        if posting is None:
+            raise KeyError(term)
+        return posting
+
+
+def read_snapshot_meta(path: str) -> Dict:
+    """只读取快照文件头与元数据段，不映射整个文件"""
+    with open(path, "rb") as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError(f"无效的知识库快照: {path}")
+        magic, version, *offsets = _HEADER.unpack(header)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"无效的知识库快照: {path}")
+        f.seek(offsets[0])
+        return json.loads(f.read(offsets[1] - offsets[0]).rstrip(b"\0").decode("utf-8"))
+
+
+class MappedKnowledgeIndex(KnowledgeIndex):
+    """基于只读 mmap 快照的知识库索引，检索接口与 KnowledgeIndex 一致；
+    lexicon 须与构建快照时的词典一致（快照元数据记录词典版本）"""
+
+    def __init__(self, path: str, lexicon=None):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, *offsets = _HEADER.unpack_from(self._mm, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"无效的知识库快照: {path}")
+        view = memoryview(self._mm)
+        section = [view[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        self.meta = json.loads(bytes(section[0]).rstrip(b"\0").decode("utf-8"))
+        documents, terms, postings = self.meta["documents"], self.meta["terms"], self.meta["postings"]
+
+        self.path = path
+        self.lexicon = lexicon
+        self.posting_budget = self.meta.get("posting_budget", DEFAULT_POSTING_BUDGET)
+        self.avg_length = self.meta.get("avg_length")
+        self.categories = [tuple(item) for item in self.meta["categories"]]
+        self.doc_categories = section[1][:documents * 4].cast("I")
+        self.docs = _MappedDocs(
+            self._mm,
+            self.categories,
+            self.doc_categories,
+            section[2][:(documents + 1) * 8].cast("Q"),
+            offsets[3],
+        )
+        self.postings = _MappedPostings(
+            self._mm,
+            section[4][:(terms + 1) * 8].cast("Q"),
+            offsets[5],
+            section[6][:(terms + 1) * 8].cast("Q"),
+            section[7][:postings * 4].cast("I"),
+            section[8][:postings * 4].cast("f"),
+        )
+
+
+class KnowledgeStore:
+    """快照存储：监视源文件与快照文件，源文件变化时重建快照，快照变化时切换映射"""
+
+    def __init__(self, snapshot_path: str, source_path: Optional[str] = None,
+                 fallback: Optional[Dict[str, Dict[str, List[str]]]] = None, lexicon=None):
+        self.snapshot_path = snapshot_path
+        self.source_path = source_path
+        self.fallback = fallback
+        self.lexicon = lexicon
+        self.reloads = 0
+        self.rebuilds = 0
+        if self._stale():
+            self.rebuild()
+        self.index = MappedKnowledgeIndex(snapshot_path, lexicon)
+        self._signature = self._snapshot_signature()
+
+    @classmethod
+    def from_env(cls, fallback: Optional[Dict[str, Dict[str, List[str]]]] = None,
+                 lexicon=None) -> Optional["KnowledgeStore"]:
+        """LUGANG_KB_SNAPSHOT 指定快照路径，LUGANG_KB_PATH 指定源 JSON；均未设置时不启用"""
+        source_path = os.getenv("LUGANG_KB_PATH") or None
+        snapshot_path = os.getenv("LUGANG_KB_SNAPSHOT") or (f"{source_path}.snapshot" if source_path else None)
+        if snapshot_path is None:
+            return None
+        return cls(snapshot_path, source_path, fallback, lexicon)
+
+    def _snapshot_signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _source_changed(self) -> bool:
+        if not self.source_path or not os.path.exists(self.source_path):
+            return False
+        try:
+            return os.path.getmtime(self.source_path) > os.path.getmtime(self.snapshot_path)
+        except FileNotFoundError:
+            return True
+
+    def _lexicon_changed(self) -> bool:
+        """快照构建时的词典版本与当前不同（含旧版快照未记录词典）"""
+        try:
+            built_with = read_snapshot_meta(self.snapshot_path).get("lexicon")
+        except (OSError, ValueError):
+            return True
+        return built_with != (self.lexicon.version if self.lexicon is not None else None)
+
+    def _stale(self) -> bool:
+        return not os.path.exists(self.snapshot_path) or self._source_changed() or self._lexicon_changed()
+
+    def _load_source(self) -> Dict[str, Dict[str, List[str]]]:
+        if self.source_path and os.path.exists(self.source_path):
+            with open(self.source_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        if self.fallback is None:
+            raise FileNotFoundError(self.source_path or self.snapshot_path)
+        return self.fallback
+
+    def rebuild(self):
+        """由源文件重建快照；多进程下通过文件锁保证只有一个进程构建"""
+        lock_file = open(f"{self.snapshot_path}.lock", "w")
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # 其他进程正在构建，等待其完成后直接使用新快照
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    return
+            if not self._stale():
+                return
+            build_snapshot(self._load_source(), self.snapshot_path, self.source_path or "", self.lexicon)
+            self.rebuilds += 1
+        finally:
+            lock_file.close()
+
+    def refresh(self) -> bool:
+        """检查源文件与快照，有变化时切换到新快照，返回是否切换"""
+        if self._source_changed():
+            self.rebuild()
+        signature = self._snapshot_signature()
+        if signature is None or signature == self._signature:
+            return False
+        # 旧映射随最后一个引用释放，进行中的查询不受影响
+        self.index = MappedKnowledgeIndex(self.snapshot_path, self.lexicon)
+        self._signature = signature
+        self.reloads += 1
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            "snapshot": self.snapshot_path,
+            "source": self.source_path,
+            "documents": len(self.index),
+            "terms": self.index.meta["terms"],
+            "size_bytes": os.path.getsize(self.snapshot_path),
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.index.meta["built_at"])),
+            "reloads": self.reloads,
+            "rebuilds": self.rebuilds,
+            "lexicon": self.index.meta.get("lexicon"),
+        }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "build":
+        print(__doc__)
+        sys.exit(1)
+    with open(sys.argv[2], "r", encoding="utf-8") as f:
+        build_snapshot(json.load(f), sys.argv[3], sys.argv[2], Lexicon.from_env())
+    print(f"✅ 快照已生成: {sys.argv[3]}")
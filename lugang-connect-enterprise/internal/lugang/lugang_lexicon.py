@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 跨语言检索词典
+Lu-Gang Connect - Cross-Language Lexicon for zh / zh-hk / en Retrieval
+繁简字符映射由离线转换器（OpenCC）预先生成并随词典文件发布，粤语/港式用词的普通话说法作为附加词项
+（不改写原文，避免误改普通话文本），
+中英术语别名在构建索引时写入倒排表、在编译关键词规则时加入匹配；
+查询时只做一次字符映射，不调用大模型翻译
+
+用法: python lugang_lexicon.py build-t2s [词典路径]   # 需安装 opencc，重新生成繁简字符映射
+"""
+
+import hashlib
+import json
+import os
+import sys
+from typing import Dict, List, Optional
+
+from lugang_matcher import AhoCorasick
+
+DEFAULT_LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lugang_lexicon.json")
+
+# 离线生成繁简映射时扫描的码位：CJK 基本区、扩展 A 区、兼容汉字
+_CJK_RANGES = ((0x3400, 0x4DBF), (0x4E00, 0x9FFF), (0xF900, 0xFAFF))
+
+
+class Lexicon:
+    """繁简映射 + 港式用词扩展 + 中英别名；构建后只读"""
+
+    def __init__(self, config: Dict):
+        traditional, simplified = config.get("t2s", ["", ""])
+        if len(traditional) != len(simplified):
+            raise ValueError("繁简映射长度不一致")
+        self._table = str.maketrans(traditional, simplified)
+        self.t2s_size = len(traditional)
+
+        # 港式用词按繁简映射后的形式匹配；单字（如"咩""佢"）在普通话文本中歧义太大，不允许收录
+        self.phrases = {key.translate(self._table): value for key, value in config.get("phrases", {}).items()}
+        short = [key for key in self.phrases if len(key) < 2]
+        if short:
+            raise ValueError(f"港式用词至少两个字: {', '.join(short)}")
+        self._phrase_automaton = AhoCorasick({key: [value] for key, value in self.phrases.items()})
+
+        self.aliases: Dict[str, List[str]] = {}
+        for term, english in config.get("aliases", {}).items():
+            self.aliases.setdefault(self.normalize(term), []).extend(alias.lower() for alias in english)
+        self._alias_automaton = AhoCorasick({term: [term] for term in self.aliases})
+
+        canonical = json.dumps(config, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        self.version = hashlib.sha1(canonical).hexdigest()[:12]
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_LEXICON_PATH) -> "Lexicon":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def from_env(cls) -> Optional["Lexicon"]:
+        """LUGANG_LEXICON_PATH 指定词典文件，设为 off 时不做跨语言处理"""
+        path = os.getenv("LUGANG_LEXICON_PATH", DEFAULT_LEXICON_PATH)
+        if path.lower() == "off":
+            return None
+        try:
+            return cls.load(path)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 跨语言词典加载失败，仅支持简体中文检索: {e}")
+            return None
+
+    def normalize(self, text: str) -> str:
+        """繁体字转简体"""
+        return text.translate(self._table)
+
+    def phrase_terms(self, normalized: str) -> List[str]:
+        """已规范化文本中出现的港式用词对应的普通话用词"""
+        found = []
+        for _, mandarin in self._phrase_automaton.find_all(normalized):
+            if mandarin not in found:
+                found.append(mandarin)
+        return found
+
+    def expand(self, text: str) -> str:
+        """规范化后在末尾附加港式用词的普通话说法（空格分隔，切分时不与原文相连），原文保持不变"""
+        normalized = self.normalize(text)
+        terms = self.phrase_terms(normalized)
+        return f"{normalized} {' '.join(terms)}" if terms else normalized
+
+    def english_aliases(self, normalized: str) -> List[str]:
+        """已规范化文本中出现的中文术语对应的英文别名（构建索引时写入倒排表）"""
+        found = []
+        for term, _ in self._alias_automaton.find_all(normalized):
+            if term not in found:
+                found.append(term)
+        return [alias for term in found for alias in self.aliases[term]]
+
+    def stats(self) -> Dict:
+        return {"version": self.version, "t2s_characters": self.t2s_size, "phrases": len(self.phrases),
+                "aliases": len(self.aliases)}
+
+
+def build_t2s_table() -> List[str]:
+    """用 OpenCC 逐字生成繁简映射（繁体、台湾、香港三种写法合并），只保留映射到 CJK 基本区单字的条目"""
+    from opencc import OpenCC
+
+    converters = [OpenCC(config) for config in ("t2s", "tw2s", "hk2s")]
+    traditional, simplified = [], []
+    for start, end in _CJK_RANGES:
+        for code in range(start, end + 1):
+            char = chr(code)
+            for converter in converters:
+                converted = converter.convert(char)
+                if converted != char and len(converted) == 1 and 0x4E00 <= ord(converted) <= 0x9FFF:
+                    traditional.append(char)
+                    simplified.append(converted)
+                    break
+    # 本身就是简体字形的字不再映射（如"么"），保证简体文本规范化前后不变
+    targets = set(simplified)
+    pairs = [(source, target) for source, target in zip(traditional, simplified) if source not in targets]
+    return ["".join(source for source, _ in pairs), "".join(target for _, target in pairs)]
+
+
+def dump_lexicon(config: Dict) -> str:
+    """词典文件格式：每个词条一行，便于人工维护与审阅差异"""
+    def block(mapping: Dict) -> str:
+        return "{\n" + ",\n".join(f"    {json.dumps(key, ensure_ascii=False)}: {json.dumps(value, ensure_ascii=False)}"
+                                   for key, value in mapping.items()) + "\n  }"
+    t2s = config.get("t2s", ["", ""])
+    return (
+        "{\n"
+        f'  "phrases": {block(config.get("phrases", {}))},\n'
+        f'  "aliases": {block(config.get("aliases", {}))},\n'
+        f'  "t2s": [\n    {json.dumps(t2s[0], ensure_ascii=False)},\n    {json.dumps(t2s[1], ensure_ascii=False)}\n  ]\n'
+        "}\n"
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3) or sys.argv[1] != "build-t2s":
+        print(__doc__)
+        sys.exit(1)
+    path = sys.argv[2] if len(sys.argv) == 3 else DEFAULT_LEXICON_PATH
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        config = {}
+    try:
+        config["t2s"] = build_t2s_table()
+    except ImportError:
+        print("需要安装 opencc（pip install opencc-python-reimplemented）")
+        sys.exit(1)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(dump_lexicon(config))
+    print(f"✅ 繁简映射已更新: {len(config['t2s'][0])} 字 -> {path}")
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 多模式关键词匹配
+Lu-Gang Connect - Multi-Pattern Keyword Matcher
+Aho-Corasick 自动机一次扫描返回全部命中关键词及其规则，
+路由规则带权重，按得分选择模型；规则从配置文件加载并支持热更新。
+传入跨语言词典时问题先做繁简规范化，英文问题按词匹配关键词的英文别名
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lugang_rules.json")
+
+_ENGLISH_WORD = re.compile(r"[a-z0-9]+")
+
+
+class KeywordRule(NamedTuple):
+    kind: str  # routing / retrieval
+    target: str  # 路由规则为服务名；检索规则为分类名
+    weight: float
+    kb_type: Optional[str] = None
+
+
+class AhoCorasick:
+    """Aho-Corasick 自动机，构建后只读"""
+
+    def __init__(self, patterns: Dict[str, List]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[str, object]]] = [[]]
+
+        for keyword, payloads in patterns.items():
+            state = 0
+            for ch in keyword:
+                next_state = self._goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][ch] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].extend((keyword, payload) for payload in payloads)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(ch, 0)
+                self._output[next_state].extend(self._output[self._fail[next_state]])
+
+    def find_all(self, text: str) -> List[Tuple[str, object]]:
+        """单次扫描返回全部命中 (关键词, 负载)，同一位置的重叠匹配均会返回"""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        matches = []
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                matches.extend(output[state])
+        return matches
+
+
+class KeywordRules:
+    """关键词规则集：路由规则选择模型，检索规则为知识库分类加权"""
+
+    def __init__(self, config: Dict, lexicon=None):
+        self.lexicon = lexicon
+        routing = config.get("routing", {})
+        self.default_service = routing.get("default", "deepseek")
+        self.models: Dict[str, str] = routing.get("models", {})
+        self.service_order: List[str] = []
+        patterns: Dict[str, List[KeywordRule]] = {}
+        for rule in routing.get("rules", []):
+            service = rule["service"]
+            if service not in self.service_order:
+                self.service_order.append(service)
+            payload = KeywordRule("routing", service, float(rule.get("weight", 1.0)))
+            for keyword in rule["keywords"]:
+                patterns.setdefault(keyword.lower(), []).append(payload)
+        for rule in config.get("retrieval", {}).get("rules", []):
+            payload = KeywordRule("retrieval", rule.get("category", ""), float(rule.get("weight", 0.5)),
+                                  rule.get("kb_type"))
+            for keyword in rule["keywords"]:
+                patterns.setdefault(keyword.lower(), []).append(payload)
+        # 英文别名按整词（最多三个词的短语）匹配，命中时记为对应的中文关键词
+        self.english: Dict[str, List[Tuple[str, KeywordRule]]] = {}
+        if lexicon is not None:
+            normalized: Dict[str, List[KeywordRule]] = {}
+            for keyword, payloads in patterns.items():
+                normalized.setdefault(lexicon.normalize(keyword), []).extend(payloads)
+            patterns = normalized
+            for keyword, payloads in patterns.items():
+                for alias in lexicon.aliases.get(keyword, []):
+                    phrase = " ".join(_ENGLISH_WORD.findall(alias))
+                    self.english.setdefault(phrase, []).extend((keyword, payload) for payload in payloads)
+        self.english_max_words = max((phrase.count(" ") + 1 for phrase in self.english), default=0)
+        self.keyword_count = len(patterns)
+        self.automaton = AhoCorasick(patterns)
+
+    @classmethod
+    def load(cls, path: str, lexicon=None) -> "KeywordRules":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), lexicon)
+
+    def _find_all(self, question: str) -> List[Tuple[str, KeywordRule]]:
+        text = question.lower()
+        if self.lexicon is None:
+            return self.automaton.find_all(text)
+        text = self.lexicon.expand(text)
+        found = self.automaton.find_all(text)
+        if self.english:
+            words = _ENGLISH_WORD.findall(text)
+            for size in range(1, self.english_max_words + 1):
+                for start in range(len(words) - size + 1):
+                    found.extend(self.english.get(" ".join(words[start:start + size]), ()))
+        return found
+
+    def match(self, question: str) -> List[Tuple[str, KeywordRule]]:
+        """返回问题中全部命中的 (关键词, 规则)，同一关键词只计一次"""
+        seen = set()
+        matches = []
+        for keyword, rule in self._find_all(question):
+            if (keyword, rule) not in seen:
+                seen.add((keyword, rule))
+                matches.append((keyword, rule))
+        return matches
+
+    def route(self, matches: List[Tuple[str, KeywordRule]]) -> Tuple[str, str]:
+        """按路由规则累计得分选择服务，得分相同时按规则文件中的服务顺序"""
+        scores: Dict[str, float] = {}
+        for _, rule in matches:
+            if rule.kind == "routing":
+                scores[rule.target] = scores.get(rule.target, 0.0) + rule.weight
+        service = self.default_service
+        if scores:
+            best = max(scores.values())
+            service = next(name for name in self.service_order if scores.get(name) == best)
+        return service, self.models.get(service, "")
+
+    def retrieval_boosts(self, matches: List[Tuple[str, KeywordRule]]) -> Dict[Tuple[Optional[str], str], float]:
+        """检索规则命中的 (知识库, 分类) 加权"""
+        boosts: Dict[Tuple[Optional[str], str], float] = {}
+        for _, rule in matches:
+            if rule.kind == "retrieval":
+                key = (rule.kb_type, rule.target)
+                boosts[key] = boosts.get(key, 0.0) + rule.weight
+        return boosts
+
+
+class ReloadingKeywordRules:
+    """规则文件变更时自动重新加载（按修改时间检查，带检查间隔）"""
+
+    def __init__(self, path: str = DEFAULT_RULES_PATH, check_interval: float = 2.0, lexicon=None):
+        self.path = path
+        self.check_interval = check_interval
+        self.lexicon = lexicon
+        self._lock = threading.Lock()
+        self._mtime = os.path.getmtime(path)
+        self._checked_at = time.monotonic()
+        self.rules = KeywordRules.load(path, lexicon)
+        self.reloads = 0
+
+    def current(self) -> KeywordRules:
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            self.reload()
+        return self.rules
+
+    def reload(self, force: bool = False) -> bool:
+        """文件有变化时重建自动机；加载失败时保留旧规则"""
+        with self._lock:
+            try:
+                mtime = os.path.getmtime(self.path)
+                if not force and mtime == self._mtime:
+                    return False
+                rules = KeywordRules.load(self.path, self.lexicon)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"关键词规则加载失败，继续使用旧规则: {e}")
+                return False
+            self.rules, self._mtime = rules, mtime
+            self.reloads += 1
+            return True
+
+    def stats(self) -> Dict:
+        return {"path": self.path, "keywords": self.rules.keyword_count, "english_aliases": len(self.rules.english),
+                "reloads": self.reloads}
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 指标与链路追踪
+Lu-Gang Connect - Prometheus Metrics & Tracing
+HTTP 中间件统计请求量与耗时，按阶段（路由、检索、上游首字节、上游总耗时、序列化）
+记录直方图，统计上游返回的 token 用量；可选将 span 导出到本地 OpenTelemetry 收集器
+"""
+
+import os
+import time
+from typing import Dict, Optional
+
+try:
+    from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                                   generate_latest)
+except ImportError:
+    CollectorRegistry = None
+
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+except ImportError:
+    trace = None
+
+PROMETHEUS_AVAILABLE = CollectorRegistry is not None
+OTEL_AVAILABLE = trace is not None
+
+# 阶段耗时从亚毫秒（检索）到数十秒（上游生成）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def create_tracer(endpoint: Optional[str], service_name: str = "lugang-connect"):
+    """配置 OTLP/HTTP 导出并返回 tracer；未配置地址或未安装 opentelemetry 时返回 None"""
+    if not endpoint:
+        return None
+    if not OTEL_AVAILABLE:
+        print("未安装 opentelemetry-sdk / opentelemetry-exporter-otlp，跳过链路追踪")
+        return None
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+    return provider.get_tracer("lugang")
+
+
+class GatewayMetrics:
+    """网关指标集合；未安装 prometheus_client 时所有记录操作为空操作"""
+
+    def __init__(self, enabled: bool = True, tracer=None):
+        self.enabled = enabled and PROMETHEUS_AVAILABLE
+        self.tracer = tracer
+        if not self.enabled:
+            return
+        self.registry = CollectorRegistry()
+        self.http_requests = Counter(
+            "lugang_http_requests_total", "HTTP 请求数", ["method", "route", "status"], registry=self.registry)
+        self.http_duration = Histogram(
+            "lugang_http_request_duration_seconds", "HTTP 请求耗时（含流式响应体）", ["method", "route"],
+            buckets=LATENCY_BUCKETS, registry=self.registry)
+        self.http_in_flight = Gauge(
+            "lugang_http_requests_in_flight", "处理中的 HTTP 请求数", registry=self.registry)
+        self.phase_duration = Histogram(
+            "lugang_query_phase_duration_seconds", "问答请求各阶段耗时", ["phase"],
+            buckets=LATENCY_BUCKETS, registry=self.registry)
+        self.upstream_ttfb = Histogram(
+            "lugang_upstream_ttfb_seconds", "上游首字节耗时", ["provider"],
+            buckets=LATENCY_BUCKETS, registry=self.registry)
+        self.upstream_duration = Histogram(
+            "lugang_upstream_duration_seconds", "上游调用总耗时", ["provider", "outcome"],
+            buckets=LATENCY_BUCKETS, registry=self.registry)
+        self.upstream_tokens = Counter(
+            "lugang_upstream_tokens_total", "上游返回的 token 用量", ["provider", "kind"], registry=self.registry)
+        self.cache_lookups = Counter(
+            "lugang_cache_lookups_total", "问答缓存查询次数", ["result"], registry=self.registry)
+        self.admission_active = Gauge(
+            "lugang_admission_active", "占用中的上游并发名额", ["provider"], registry=self.registry)
+        self.admission_queue_depth = Gauge(
+            "lugang_admission_queue_depth", "等待上游名额的请求数", ["provider"], registry=self.registry)
+        self.admission_wait = Histogram(
+            "lugang_admission_wait_seconds", "获取上游名额的排队耗时", ["provider", "priority"],
+            buckets=LATENCY_BUCKETS, registry=self.registry)
+        self.admission_rejections = Counter(
+            "lugang_admission_rejections_total", "准入拒绝次数", ["provider", "reason"], registry=self.registry)
+
+    @classmethod
+    def from_env(cls) -> "GatewayMetrics":
+        """LUGANG_METRICS_ENABLED 控制指标，LUGANG_OTEL_ENDPOINT 为 OTLP/HTTP 收集器地址"""
+        enabled = os.getenv("LUGANG_METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+        tracer = create_tracer(os.getenv("LUGANG_OTEL_ENDPOINT"), os.getenv("LUGANG_OTEL_SERVICE_NAME", "lugang-connect"))
+        return cls(enabled, tracer)
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        if self.enabled:
+            self.http_requests.labels(method, route, str(status)).inc()
+            self.http_duration.labels(method, route).observe(seconds)
+
+    def observe_phases(self, phases: Dict[str, float]):
+        """记录一次请求的各阶段耗时（秒）"""
+        if self.enabled:
+            for name, seconds in phases.items():
+                self.phase_duration.labels(name).observe(seconds)
+
+    def observe_upstream(self, provider: str, ttfb: Optional[float], total: float, outcome: str):
+        if self.enabled:
+            if ttfb is not None:
+                self.upstream_ttfb.labels(provider).observe(ttfb)
+            self.upstream_duration.labels(provider, outcome).observe(total)
+
+    def record_usage(self, provider: str, usage: Optional[Dict]):
+        """累计上游响应 usage 字段中的 prompt/completion token 数"""
+        if not self.enabled or not usage:
+            return
+        for kind in ("prompt_tokens", "completion_tokens"):
+            value = usage.get(kind)
+            if isinstance(value, (int, float)) and value > 0:
+                self.upstream_tokens.labels(provider, kind[:-len("_tokens")]).inc(value)
+
+    def record_cache_lookup(self, hit: bool):
+        if self.enabled:
+            self.cache_lookups.labels("hit" if hit else "miss").inc()
+
+    def set_admission_state(self, provider: str, active: int, queued: int):
+        if self.enabled:
+            self.admission_active.labels(provider).set(active)
+            self.admission_queue_depth.labels(provider).set(queued)
+
+    def observe_admission_wait(self, provider: str, priority: int, seconds: float):
+        if self.enabled:
+            self.admission_wait.labels(provider, str(priority)).observe(seconds)
+
+    def record_admission_rejection(self, provider: str, reason: str):
+        if self.enabled:
+            self.admission_rejections.labels(provider, reason).inc()
+
+    def render(self):
+        """Prometheus 文本格式输出，返回 (内容, Content-Type)"""
+        return generate_latest(self.registry), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件：不缓冲响应体，流式响应的耗时计到最后一个分片发出为止"""
+
+    def __init__(self, app, metrics: GatewayMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (self.metrics.enabled or self.metrics.tracer):
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        if self.metrics.enabled:
+            self.metrics.http_in_flight.inc()
+        try:
+            if self.metrics.tracer is None:
+                await self.app(scope, receive, send_wrapper)
+            else:
+                headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", [])}
+                with self.metrics.tracer.start_as_current_span(
+                        f"{scope['method']} {scope['path']}", context=propagate.extract(headers),
+                        kind=trace.SpanKind.SERVER) as span:
+                    await self.app(scope, receive, send_wrapper)
+                    route = getattr(scope.get("route"), "path", None)
+                    if route:
+                        span.update_name(f"{scope['method']} {route}")
+                        span.set_attribute("http.route", route)
+                    span.set_attribute("http.request.method", scope["method"])
+                    span.set_attribute("http.response.status_code", status)
+        finally:
+            if self.metrics.enabled:
+                self.metrics.http_in_flight.dec()
+                # 使用路由模板而非原始路径作为标签，避免高基数
+                route = getattr(scope.get("route"), "path", "unmatched")
+                self.metrics.observe_request(scope["method"], route, status, time.perf_counter() - started)
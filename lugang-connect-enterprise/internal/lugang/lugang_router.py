@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 延迟感知路由与对冲请求
+Lu-Gang Connect - Latency-Aware Routing with Hedged Requests
+跟踪各服务商 EWMA 延迟与错误率，首选服务超过 p95 截止时间时向备选服务
+发出对冲请求，先返回者胜出；持续失败的服务商触发熔断
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+# 延迟窗口：非流式调用记录总耗时，流式调用记录首个分片耗时，两者分开统计各自的 p95
+LATENCY_TOTAL = "total"
+LATENCY_FIRST_CHUNK = "first_chunk"
+
+
+class ProviderHealth:
+    """单个服务商的延迟、错误率与熔断状态"""
+
+    def __init__(self, name: str, alpha: float = 0.2, window: int = 200,
+                 failure_threshold: int = 5, error_rate_threshold: float = 0.5, cooldown: float = 30.0):
+        self.name = name
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.cooldown = cooldown
+        self.latencies = {LATENCY_TOTAL: deque(maxlen=window), LATENCY_FIRST_CHUNK: deque(maxlen=window)}
+        self.ewma_latency: Optional[float] = None
+        self.ewma_error_rate = 0.0
+        self.samples = 0
+        self.consecutive_failures = 0
+        self.state = CIRCUIT_CLOSED
+        self.opened_at = 0.0
+        self._probing = False
+        # 多进程共享状态时记录自上次同步以来的调用结果：[延迟, 延迟类型]（成功）或 None（失败）
+        self.events: Optional[List[Optional[list]]] = None
+
+    def p95(self, kind: str = LATENCY_TOTAL) -> Optional[float]:
+        latencies = self.latencies[kind]
+        if len(latencies) < 10:
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def available(self) -> bool:
+        """熔断关闭时可用；打开超过冷却时间后允许一个半开探测请求"""
+        if self.state == CIRCUIT_CLOSED:
+            return True
+        if self.state == CIRCUIT_OPEN:
+            return time.monotonic() - self.opened_at >= self.cooldown
+        return not self._probing
+
+    def begin(self):
+        """请求发出前调用：非关闭状态下转为半开并占用探测名额"""
+        if self.state != CIRCUIT_CLOSED:
+            self.state = CIRCUIT_HALF_OPEN
+            self._probing = True
+
+    def record_success(self, latency: float, kind: str = LATENCY_TOTAL):
+        if self.events is not None:
+            self.events.append([latency, kind])
+        self.samples += 1
+        self.latencies[kind].append(latency)
+        if kind == LATENCY_TOTAL:
+            self.ewma_latency = latency if self.ewma_latency is None else \
+                self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+        self.ewma_error_rate *= 1 - self.alpha
+        self.consecutive_failures = 0
+        self.state = CIRCUIT_CLOSED
+        self._probing = False
+
+    def record_failure(self):
+        if self.events is not None:
+            self.events.append(None)
+        self.samples += 1
+        self.ewma_error_rate = self.alpha + (1 - self.alpha) * self.ewma_error_rate
+        self.consecutive_failures += 1
+        self._probing = False
+        if self.state == CIRCUIT_HALF_OPEN or self.consecutive_failures >= self.failure_threshold or \
+                (self.samples >= 10 and self.ewma_error_rate >= self.error_rate_threshold):
+            self.state = CIRCUIT_OPEN
+            self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        """探测请求被取消（对冲落败）时释放半开名额"""
+        self._probing = False
+
+    def apply_events(self, events: List[Optional[list]]):
+        """按顺序重放其他进程上报的调用结果"""
+        for event in events:
+            if event is None:
+                self.record_failure()
+            else:
+                self.record_success(*event)
+
+    def export_state(self) -> Dict:
+        return {
+            "latencies": {kind: list(latencies) for kind, latencies in self.latencies.items()},
+            "ewma_latency": self.ewma_latency,
+            "ewma_error_rate": self.ewma_error_rate,
+            "samples": self.samples,
+            "consecutive_failures": self.consecutive_failures,
+            "state": self.state,
+            "opened_at": self.opened_at,
+        }
+
+    def load_state(self, state: Dict):
+        """以共享状态覆盖本地统计；本进程正在进行半开探测时保留本地熔断状态"""
+        for kind, latencies in self.latencies.items():
+            latencies.clear()
+            latencies.extend(state["latencies"][kind])
+        self.ewma_latency = state["ewma_latency"]
+        self.ewma_error_rate = state["ewma_error_rate"]
+        self.samples = state["samples"]
+        self.consecutive_failures = state["consecutive_failures"]
+        if not self._probing:
+            self.state = state["state"]
+            self.opened_at = state["opened_at"]
+
+    def stats(self) -> Dict:
+        p95 = self.p95()
+        p95_first_chunk = self.p95(LATENCY_FIRST_CHUNK)
+        return {
+            "state": self.state,
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+            "p95_latency_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "p95_first_chunk_ms": round(p95_first_chunk * 1000, 1) if p95_first_chunk is not None else None,
+            "ewma_error_rate": round(self.ewma_error_rate, 4),
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+def health_options_from_env() -> Dict:
+    """熔断参数：LUGANG_BREAKER_FAILURES / _ERROR_RATE / _COOLDOWN"""
+    return {
+        "failure_threshold": int(os.getenv("LUGANG_BREAKER_FAILURES", "5")),
+        "error_rate_threshold": float(os.getenv("LUGANG_BREAKER_ERROR_RATE", "0.5")),
+        "cooldown": float(os.getenv("LUGANG_BREAKER_COOLDOWN", "30")),
+    }
+
+
+class HedgedRouter:
+    """对冲路由器：按健康状况排序服务商，慢请求时对冲，失败时故障转移"""
+
+    def __init__(self, providers: List[str], hedge_enabled: bool = True,
+                 min_hedge_delay: float = 0.5, max_hedge_delay: float = 10.0,
+                 ignored_errors: Tuple[type, ...] = (), configured: Optional[Callable[[str], bool]] = None,
+                 **health_options):
+        self.health = {name: ProviderHealth(name, **health_options) for name in providers}
+        # 判断服务商是否已配置（如有 API 密钥）；未配置的服务商必然失败，不参与路由，也不计入错误率与熔断
+        self.configured = configured
+        # 这些异常（如网关自身的准入拒绝）照常触发故障转移，但不计入服务商错误率与熔断
+        self.ignored_errors = ignored_errors
+        self.hedge_enabled = hedge_enabled
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    @classmethod
+    def from_env(cls, providers: List[str], ignored_errors: Tuple[type, ...] = (),
+                 configured: Optional[Callable[[str], bool]] = None) -> "HedgedRouter":
+        """读取 LUGANG_HEDGE_* / LUGANG_BREAKER_* 环境变量"""
+        return cls(
+            providers,
+            ignored_errors=ignored_errors,
+            configured=configured,
+            hedge_enabled=os.getenv("LUGANG_HEDGE_ENABLED", "1").lower() not in ("0", "false", "no"),
+            min_hedge_delay=float(os.getenv("LUGANG_HEDGE_MIN_DELAY", "0.5")),
+            max_hedge_delay=float(os.getenv("LUGANG_HEDGE_MAX_DELAY", "10")),
+            **health_options_from_env(),
+        )
+
+    def hedge_delay(self, provider: str, kind: str = LATENCY_TOTAL) -> float:
+        """对冲截止时间：首选服务商同类调用近期延迟的 p95（非流式为总耗时，流式为首个分片耗时），限定在上下界之间"""
+        p95 = self.health[provider].p95(kind)
+        if p95 is None:
+            return self.max_hedge_delay
+        return min(self.max_hedge_delay, max(self.min_hedge_delay, p95))
+
+    def candidates(self, primary: str, fallbacks: List[str]) -> List[str]:
+        """可用服务商列表：首选在前，跳过未配置的服务商；全部熔断时仍尝试首个已配置的服务商"""
+        ordered = [primary] + [name for name in fallbacks if name != primary]
+        if self.configured is not None:
+            # 全部未配置时保留首选，由调用本身报告错误
+            ordered = [name for name in ordered if self.configured(name)] or [primary]
+        available = [name for name in ordered if self.health[name].available()]
+        return available or ordered[:1]
+
+    def _is_configured(self, provider: str) -> bool:
+        return self.configured is None or self.configured(provider)
+
+    def _record_failure(self, provider: str, error: BaseException):
+        """忽略的异常与未配置服务商的失败不计入错误率与熔断，只释放半开探测名额"""
+        if isinstance(error, self.ignored_errors) or not self._is_configured(provider):
+            self.health[provider].release_probe()
+        else:
+            self.health[provider].record_failure()
+
+    async def _timed(self, provider: str, invoke: Callable[[str], Awaitable]):
+        self.health[provider].begin()
+        started = time.monotonic()
+        try:
+            result = await invoke(provider)
+        except asyncio.CancelledError:
+            self.health[provider].release_probe()
+            raise
+        except Exception as e:
+            self._record_failure(provider, e)
+            raise
+        self.health[provider].record_success(time.monotonic() - started)
+        return result
+
+    async def call(self, primary: str, fallbacks: List[str],
+                   invoke: Callable[[str], Awaitable]) -> Tuple[str, object]:
+        """调用首选服务商，必要时对冲或故障转移，返回 (实际服务商, 结果)"""
+        queue = self.candidates(primary, fallbacks)
+        running: Dict[asyncio.Task, str] = {}
+        last_error: Optional[BaseException] = None
+
+        def launch():
+            provider = queue.pop(0)
+            running[asyncio.ensure_future(self._timed(provider, invoke))] = provider
+
+        launch()
+        first_provider = next(iter(running.values()))
+        hedged = False
+        try:
+            while running:
+                timeout = None
+                if self.hedge_enabled and queue and len(running) == 1:
+                    timeout = self.hedge_delay(first_provider, LATENCY_TOTAL)
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 首选超过截止时间仍未返回，发出对冲请求
+                    self.hedged_requests += 1
+                    hedged = True
+                    launch()
+                    continue
+                for task in done:
+                    provider = running.pop(task)
+                    if task.exception() is None:
+                        if hedged and provider != first_provider:
+                            self.hedge_wins += 1
+                        return provider, task.result()
+                    last_error = task.exception()
+                if not running and queue:
+                    # 所有进行中的请求失败，立即转移到下一个服务商
+                    self.failovers += 1
+                    launch()
+            raise last_error
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def stream(self, primary: str, fallbacks: List[str],
+                     invoke: Callable[[str], AsyncIterator]) -> AsyncIterator[Tuple[str, object]]:
+        """流式调用：首个分片返回前失败则转移到下一个服务商，产出 (服务商, 分片)；
+        延迟按首个分片耗时记入单独的窗口，不影响非流式调用的对冲截止时间"""
+        queue = self.candidates(primary, fallbacks)
+        last_error: Optional[BaseException] = None
+        while queue:
+            provider = queue.pop(0)
+            self.health[provider].begin()
+            started = time.monotonic()
+            first_chunk: Optional[float] = None
+            try:
+                async for chunk in invoke(provider):
+                    if first_chunk is None:
+                        first_chunk = time.monotonic() - started
+                    yield provider, chunk
+            except Exception as e:
+                self._record_failure(provider, e)
+                if first_chunk is not None:
+                    raise
+                last_error = e
+                if queue:
+                    self.failovers += 1
+                continue
+            except BaseException:
+                # 取消或调用方提前关闭流（GeneratorExit）：不计成败，释放半开探测名额
+                self.health[provider].release_probe()
+                raise
+            self.health[provider].record_success(first_chunk if first_chunk is not None
+                                                 else time.monotonic() - started, LATENCY_FIRST_CHUNK)
+            return
+        raise last_error
+
+    def stats(self) -> Dict:
+        return {
+            "hedge_enabled": self.hedge_enabled,
+            "hedged_requests": self.hedged_requests,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "providers": {name: health.stats() for name, health in self.health.items()},
+        }
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 知识库倒排索引检索引擎
+Lu-Gang Connect - Inverted Index Retrieval Engine
+中文字符 n-gram + 英文词项倒排表，BM25 打分，堆选 top-k；
+传入跨语言词典时文档与查询先做繁简规范化并附加港式用词的普通话说法，文档额外索引中文术语的英文别名
+"""
+
+import hashlib
+import heapq
+import math
+import re
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # 无 numpy 时批量检索退回逐条累加
+    np = None
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 每个词项在查询时最多遍历的倒排项数（倒排表按贡献分降序存储，
+# 高频词项只看头部即可，保证大规模知识库下的查询延迟）
+DEFAULT_POSTING_BUDGET = 512
+
+_CJK_RUN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+_ASCII_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """切分文本：中文连续片段取字符二元组，英文/数字取小写词项"""
+    text = text.lower()
+    tokens = []
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(_ASCII_TOKEN.findall(text))
+    return tokens
+
+
+def entry_id(kb_type: str, category: str, text: str) -> str:
+    """条目ID：按 (知识库, 分类, 文本) 生成，同一条目在各进程、各次启动间一致"""
+    return hashlib.sha1(f"{kb_type}\x1e{category}\x1e{text}".encode("utf-8")).hexdigest()[:12]
+
+
+class SearchHit(NamedTuple):
+    doc_id: int
+    score: float
+    kb_type: str
+    category: str
+    text: str
+
+
+class KnowledgeIndex:
+    """知识库倒排索引，构建后只读，知识库变更时整体重建；
+    传入 base 时作为增量段构建，按基础索引的语料统计（文档数、平均长度、文档频率）计算权重，
+    分数可与基础索引直接比较"""
+
+    def __init__(self, knowledge_base: Dict[str, Dict[str, List[str]]],
+                 posting_budget: int = DEFAULT_POSTING_BUDGET, lexicon=None,
+                 base: Optional["KnowledgeIndex"] = None):
+        self.posting_budget = posting_budget
+        self.lexicon = lexicon
+        self.docs: List[Tuple[str, str, str]] = []
+        # 分类表与文档分类ID，用于按知识库过滤与分类加权时避免访问文档文本
+        self.categories: List[Tuple[str, str]] = []
+        self.doc_categories = array("I")
+        for kb_type, categories in knowledge_base.items():
+            for category, items in categories.items():
+                category_id = len(self.categories)
+                self.categories.append((kb_type, category))
+                for text in items:
+                    self.docs.append((kb_type, category, text))
+                    self.doc_categories.append(category_id)
+
+        term_freqs = []
+        doc_lengths = []
+        for _, _, text in self.docs:
+            tokens = self._document_tokens(text)
+            freqs: Dict[str, int] = {}
+            for token in tokens:
+                freqs[token] = freqs.get(token, 0) + 1
+            term_freqs.append(freqs)
+            doc_lengths.append(len(tokens))
+
+        total_docs = len(self.docs)
+        avg_length = (sum(doc_lengths) / total_docs) if total_docs else 0.0
+        self.avg_length = avg_length
+        if base is not None:
+            total_docs += len(base.docs)
+            avg_length = base.avg_length or avg_length
+
+        raw: Dict[str, List[Tuple[float, int]]] = {}
+        for doc_id, freqs in enumerate(term_freqs):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[doc_id] / avg_length) if avg_length else BM25_K1
+            for term, tf in freqs.items():
+                raw.setdefault(term, []).append((tf * (BM25_K1 + 1) / (tf + norm), doc_id))
+
+        # 倒排表：词项 -> (文档ID数组, 贡献分数组)，按贡献分降序
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        for term, entries in raw.items():
+            df = len(entries)
+            if base is not None:
+                base_posting = base.postings.get(term)
+                df += len(base_posting[0]) if base_posting is not None else 0
+            idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            entries.sort(key=lambda entry: (-entry[0], entry[1]))
+            self.postings[term] = (
+                array("I", (doc_id for _, doc_id in entries)),
+                array("f", (weight * idf for weight, _ in entries)),
+            )
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def _document_tokens(self, text: str) -> List[str]:
+        if self.lexicon is None:
+            return tokenize(text)
+        expanded = self.lexicon.expand(text)
+        return tokenize(expanded) + tokenize(" ".join(self.lexicon.english_aliases(expanded)))
+
+    def document_terms(self, text: str) -> set:
+        """文档词项（含英文别名）；与查询词项无交集的条目不会出现在该查询的结果中"""
+        return set(self._document_tokens(text))
+
+    def query_terms(self, question: str) -> set:
+        """查询词项：繁体转简体并附加港式用词的普通话说法后切分，英文问题直接命中文档的英文别名"""
+        return set(tokenize(self.lexicon.expand(question) if self.lexicon is not None else question))
+
+    def knowledge_base(self) -> Dict[str, Dict[str, List[str]]]:
+        """还原为知识库字典（供接口展示）"""
+        result: Dict[str, Dict[str, List[str]]] = {}
+        for kb_type, category, text in self.docs:
+            result.setdefault(kb_type, {}).setdefault(category, []).append(text)
+        return result
+
+    def entries(self, kb_type: str, category: str) -> List[Tuple[str, str]]:
+        """某分类下的 (条目ID, 文本) 列表"""
+        return [(entry_id(doc_kb, doc_category, text), text) for doc_kb, doc_category, text in self.docs
+                if doc_kb == kb_type and doc_category == category]
+
+    def doc_category(self, doc_id: int) -> Tuple[str, str]:
+        """文档所属 (知识库, 分类)"""
+        return self.categories[self.doc_categories[doc_id]]
+
+    def category_factors(self, kb_type: str = "both",
+                         boosts: Optional[Dict[Tuple[Optional[str], str], float]] = None) -> List[float]:
+        """每个分类的得分系数：不在所选知识库内为0，命中检索规则时加权"""
+        factors = []
+        for category_kb, category in self.categories:
+            factor = 0.0 if kb_type != "both" and category_kb != kb_type else 1.0
+            if factor and boosts:
+                for (boost_kb, boost_category), weight in boosts.items():
+                    if (boost_kb is None or boost_kb == category_kb) and (not boost_category or boost_category == category):
+                        factor += weight
+            factors.append(factor)
+        return factors
+
+    @staticmethod
+    def allowed_categories(kb_type: str, factors: Optional[List[float]]) -> Optional[List[bool]]:
+        """按知识库过滤时各分类是否可选；不过滤时为 None"""
+        return [factor != 0 for factor in factors] if kb_type != "both" and factors is not None else None
+
+    def _budgeted(self, posting: Tuple, allowed: Optional[List[bool]] = None) -> Tuple[List[int], List[float]]:
+        """倒排表取前 posting_budget 条；按知识库过滤时先过滤再截取，避免另一知识库的条目占满预算"""
+        doc_ids, weights = posting
+        budget = self.posting_budget
+        if allowed is None:
+            return doc_ids[:budget].tolist(), weights[:budget].tolist()
+        doc_categories = self.doc_categories
+        kept_ids, kept_weights = [], []
+        for doc_id, weight in zip(doc_ids, weights):
+            if allowed[doc_categories[doc_id]]:
+                kept_ids.append(doc_id)
+                kept_weights.append(weight)
+                if len(kept_ids) >= budget:
+                    break
+        return kept_ids, kept_weights
+
+    def _budgeted_array(self, doc_ids, weights, allowed, doc_categories) -> Tuple:
+        """numpy 版 _budgeted：按预算大小分块过滤，取满预算即停止，高频词项不必扫描整条倒排表"""
+        budget = self.posting_budget
+        if allowed is None or budget <= 0:
+            return doc_ids[:budget], weights[:budget]
+        kept_ids, kept_weights, kept = [], [], 0
+        for start in range(0, len(doc_ids), budget):
+            chunk_ids = doc_ids[start:start + budget]
+            keep = allowed[doc_categories[chunk_ids]]
+            kept_ids.append(chunk_ids[keep])
+            kept_weights.append(weights[start:start + budget][keep])
+            kept += len(kept_ids[-1])
+            if kept >= budget:
+                break
+        if not kept_ids:
+            return doc_ids[:0], weights[:0]
+        return np.concatenate(kept_ids)[:budget], np.concatenate(kept_weights)[:budget]
+
+    def score(self, question: str, allowed: Optional[List[bool]] = None) -> Dict[int, float]:
+        """计算命中文档的 BM25 分数；allowed 为各分类是否可选"""
+        scores: Dict[int, float] = {}
+        get = scores.get
+        for term in self.query_terms(question):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            for doc_id, weight in zip(*self._budgeted(posting, allowed)):
+                scores[doc_id] = get(doc_id, 0.0) + weight
+        return scores
+
+    def score_many(self, questions: List[str],
+                   allowed: Optional[List[Optional[List[bool]]]] = None) -> List[Dict[int, float]]:
+        """批量计算 BM25 分数：批内相同词项（及相同过滤条件）的倒排表只读取、解码一次，结果与逐条 score 相同"""
+        if allowed is None:
+            allowed = [None] * len(questions)
+        term_queries: Dict[Tuple[str, int], List[int]] = {}
+        filters: Dict[int, Optional[List[bool]]] = {}
+        for position, question in enumerate(questions):
+            filters[id(allowed[position])] = allowed[position]
+            for term in self.query_terms(question):
+                term_queries.setdefault((term, id(allowed[position])), []).append(position)
+        all_scores: List[Dict[int, float]] = [{} for _ in questions]
+        for (term, filter_id), positions in term_queries.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            doc_ids, weights = self._budgeted(posting, filters[filter_id])
+            for position in positions:
+                scores = all_scores[position]
+                get = scores.get
+                for doc_id, weight in zip(doc_ids, weights):
+                    scores[doc_id] = get(doc_id, 0.0) + weight
+        return all_scores
+
+    def _rank(self, scores: Dict[int, float], top_k: int, factors: Optional[List[float]] = None) -> List[SearchHit]:
+        if factors is not None:
+            doc_categories = self.doc_categories
+            scores = {doc_id: s * factors[doc_categories[doc_id]] for doc_id, s in scores.items()
+                      if factors[doc_categories[doc_id]]}
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [SearchHit(doc_id, s, *self.docs[doc_id]) for doc_id, s in best]
+
+    def search(self, question: str, kb_type: str = "both", top_k: int = 5,
+               boosts: Optional[Dict[Tuple[Optional[str], str], float]] = None) -> List[SearchHit]:
+        """检索知识库，返回分数最高的 top_k 条；boosts 按 (知识库, 分类) 对命中文档加权"""
+        factors = self.category_factors(kb_type, boosts) if kb_type != "both" or boosts else None
+        return self._rank(self.score(question, self.allowed_categories(kb_type, factors)), top_k, factors)
+
+    def search_many(self, queries: List[Tuple[str, str, Optional[Dict[Tuple[Optional[str], str], float]]]],
+                    top_k: int = 5) -> List[List[SearchHit]]:
+        """批量检索，queries 为 (问题, 知识库, boosts) 列表；相同过滤条件的分类系数只计算一次，
+        安装 numpy 时按查询向量化累加分数"""
+        factor_cache: Dict[Tuple, Optional[List[float]]] = {}
+        allowed_cache: Dict[str, Optional[List[bool]]] = {}
+        query_factors, query_allowed = [], []
+        for _, kb_type, boosts in queries:
+            key = (kb_type, tuple(sorted(boosts.items(), key=repr)) if boosts else ())
+            if key not in factor_cache:
+                factor_cache[key] = self.category_factors(kb_type, boosts) if kb_type != "both" or boosts else None
+            query_factors.append(factor_cache[key])
+            # 过滤只取决于所选知识库，同一知识库的查询共用
+            if kb_type not in allowed_cache:
+                allowed_cache[kb_type] = self.allowed_categories(kb_type, self.category_factors(kb_type))
+            query_allowed.append(allowed_cache[kb_type])
+        if np is not None:
+            return self._search_many_vectorized([question for question, _, _ in queries], query_factors,
+                                                query_allowed, top_k)
+        all_scores = self.score_many([question for question, _, _ in queries], query_allowed)
+        return [self._rank(scores, top_k, factors) for scores, factors in zip(all_scores, query_factors)]
+
+    def _search_many_vectorized(self, questions: List[str], query_factors: List[Optional[List[float]]],
+                                query_allowed: List[Optional[List[bool]]], top_k: int) -> List[List[SearchHit]]:
+        """倒排表以零拷贝 numpy 视图读取并在批内共享；每个查询拼接命中倒排后 unique + bincount 求和；
+        按知识库过滤时分块过滤，取满预算即停止"""
+        doc_categories = np.frombuffer(self.doc_categories, dtype=np.uint32)
+        postings: Dict[Tuple[str, int], Optional[Tuple]] = {}
+        factor_arrays: Dict[int, object] = {}
+        allowed_arrays: Dict[int, object] = {}
+        results = []
+        for question, factors, allowed in zip(questions, query_factors, query_allowed):
+            if allowed is not None and id(allowed) not in allowed_arrays:
+                allowed_arrays[id(allowed)] = np.asarray(allowed, dtype=bool)
+            parts = []
+            for term in self.query_terms(question):
+                key = (term, id(allowed))
+                if key not in postings:
+                    posting = self.postings.get(term)
+                    if posting is None:
+                        postings[key] = None
+                    else:
+                        postings[key] = self._budgeted_array(
+                            np.frombuffer(posting[0], dtype=np.uint32), np.frombuffer(posting[1], dtype=np.float32),
+                            allowed_arrays.get(id(allowed)), doc_categories)
+                if postings[key] is not None:
+                    parts.append(postings[key])
+            if not parts:
+                results.append([])
+                continue
+            doc_ids, inverse = np.unique(np.concatenate([part[0] for part in parts]), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate([part[1] for part in parts]))
+            if factors is not None:
+                if id(factors) not in factor_arrays:
+                    factor_arrays[id(factors)] = np.asarray(factors, dtype=np.float64)
+                scores = scores * factor_arrays[id(factors)][doc_categories[doc_ids]]
+                keep = scores != 0
+                doc_ids, scores = doc_ids[keep], scores[keep]
+            if len(scores) > top_k:
+                candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+            else:
+                candidates = np.arange(len(scores))
+            order = candidates[np.lexsort((doc_ids[candidates], -scores[candidates]))]
+            results.append([SearchHit(int(doc_ids[i]), float(scores[i]), *self.docs[int(doc_ids[i])]) for i in order])
+        return results
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 上游请求合并（single-flight）
+Lu-Gang Connect - Upstream Request Coalescing
+并发的相同上游请求只发出一次，结果（或流式分片）分发给所有等待者
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+
+def request_key(*parts: Any) -> str:
+    """根据请求载荷生成合并键"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    """非流式调用：共享的上游任务与等待者计数"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class _Broadcast:
+    """流式结果广播：记录已产出的分片，订阅者从头回放并等待后续分片"""
+
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.condition = asyncio.Condition()
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+
+    async def publish(self, source: AsyncIterator):
+        try:
+            async for chunk in source:
+                async with self.condition:
+                    self.chunks.append(chunk)
+                    self.condition.notify_all()
+        except asyncio.CancelledError as e:
+            self.error = e
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            # 被取消时上游生成器可能停在 yield 处，显式关闭以执行其清理（释放连接与并发名额）
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            async with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    async def subscribe(self) -> AsyncIterator:
+        position = 0
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: position < len(self.chunks) or self.done)
+                pending = self.chunks[position:]
+                finished = self.done
+            for chunk in pending:
+                yield chunk
+            position += len(pending)
+            if finished and position >= len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    """请求合并器：同一键上同时只有一个上游调用在执行"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+
+    @staticmethod
+    def _forget(registry: Dict, key: str, value):
+        if registry.get(key) is value:
+            del registry[key]
+
+    async def do(self, key: str, factory: Callable[[], Awaitable]):
+        """执行或加入一个进行中的调用；调用者取消不影响其他等待者，
+        所有等待者都离开（取消或客户端断开）时取消上游调用，释放并发名额与连接"""
+        call = self._calls.get(key)
+        if call is None:
+            self.upstream_calls += 1
+            call = self._calls[key] = _Call(asyncio.ensure_future(factory()))
+            call.task.add_done_callback(lambda _: self._forget(self._calls, key, call))
+        else:
+            self.coalesced_calls += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # 先移出注册表，之后到达的相同请求发起新的上游调用而不是加入将被取消的任务
+                self._forget(self._calls, key, call)
+                call.task.cancel()
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """执行或加入一个进行中的流式调用，每个订阅者都收到完整的分片序列；
+        所有订阅者都离开（客户端断开）时取消上游流"""
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            self.upstream_calls += 1
+            broadcast = self._streams[key] = _Broadcast()
+            broadcast.task = asyncio.ensure_future(broadcast.publish(factory()))
+            broadcast.task.add_done_callback(lambda _: self._forget(self._streams, key, broadcast))
+        else:
+            self.coalesced_calls += 1
+        broadcast.subscribers += 1
+        try:
+            async for chunk in broadcast.subscribe():
+                yield chunk
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.done:
+                # 先移出注册表，之后到达的相同请求发起新的上游调用而不是加入将被取消的流
+                self._forget(self._streams, key, broadcast)
+                broadcast.task.cancel()
+
+    def stats(self) -> Dict:
+        """合并统计：实际上游调用数与节省的调用数"""
+        total = self.upstream_calls + self.coalesced_calls
+        return {
+            "upstream_calls": self.upstream_calls,
+            "coalesced_calls": self.coalesced_calls,
+            "saved_ratio": round(self.coalesced_calls / total, 4) if total else 0.0,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 启动剖析与就绪检查
+Lu-Gang Connect - Startup Profile & Readiness Gate
+记录导入阶段与 lifespan 预热阶段的耗时（并发阶段按时间线给出起止时刻），
+预热完成前 /ready 返回 503，业务请求在就绪闸门处短暂等待，超时返回 503 与 Retry-After；
+LUGANG_STARTUP_PROFILE=1 时就绪后打印启动剖析报告
+"""
+
+import asyncio
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+# 预热期间无需等待的路径：存活/就绪检查、指标与接口文档
+DEFAULT_EXEMPT_PATHS = ("/health", "/ready", "/metrics", "/docs", "/docs/oauth2-redirect", "/redoc", "/openapi.json")
+
+
+def process_age() -> Optional[float]:
+    """当前进程已运行的秒数（读取 /proc，非 Linux 返回 None），用于统计包含解释器启动在内的冷启动时间"""
+    try:
+        with open("/proc/self/stat", "rb") as f:
+            # 进程名可能含空格，从最后一个右括号之后开始按空格切分，第 22 个字段为启动时刻（时钟滴答）
+            fields = f.read().rsplit(b")", 1)[1].split()
+        with open("/proc/uptime", "rb") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupProfile:
+    """启动阶段时间线与就绪状态；时刻以网关模块开始导入为零点，单位毫秒"""
+
+    def __init__(self, started: Optional[float] = None, enabled: bool = False):
+        self.started = started if started is not None else time.perf_counter()
+        age = process_age()
+        # 导入网关模块之前进程已运行的时间（解释器启动、uvicorn 导入等）
+        self.process_offset = round(age * 1000 - (time.perf_counter() - self.started) * 1000, 1) \
+            if age is not None else None
+        self.enabled = enabled
+        self.phases: List[Dict] = []
+        self.ready = False
+        self.ready_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self._event = asyncio.Event()
+
+    @classmethod
+    def from_env(cls, started: Optional[float] = None) -> "StartupProfile":
+        enabled = os.getenv("LUGANG_STARTUP_PROFILE", "").lower() in ("1", "true", "on", "yes")
+        return cls(started, enabled)
+
+    def _ms(self, moment: float) -> float:
+        return round((moment - self.started) * 1000, 2)
+
+    def record(self, name: str, start: float, end: float, group: str = "warmup"):
+        self.phases.append({"group": group, "name": name, "start_ms": self._ms(start),
+                            "duration_ms": round((end - start) * 1000, 2)})
+
+    @contextmanager
+    def phase(self, name: str, group: str = "warmup"):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter(), group)
+
+    async def run(self, name: str, awaitable, group: str = "warmup"):
+        """等待一个预热步骤并记录起止时刻，多个步骤可用 asyncio.gather 并发"""
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.record(name, start, time.perf_counter(), group)
+
+    def mark_ready(self):
+        self.ready = True
+        self.ready_at = time.perf_counter()
+        self._event.set()
+        if self.enabled:
+            print(self.report())
+
+    def mark_failed(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"
+        self._event.set()
+        if self.enabled:
+            print(self.report())
+
+    async def wait(self, timeout: float) -> bool:
+        """等待预热结束，返回是否就绪"""
+        if not self._event.is_set():
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return self.ready
+
+    def _group_ms(self, group: str) -> Optional[float]:
+        phases = [phase for phase in self.phases if phase["group"] == group]
+        if not phases:
+            return None
+        return round(max(p["start_ms"] + p["duration_ms"] for p in phases) - min(p["start_ms"] for p in phases), 2)
+
+    def stats(self) -> Dict:
+        ready_ms = self._ms(self.ready_at) if self.ready_at is not None else None
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "import_ms": self._group_ms("import"),
+            "warmup_ms": self._group_ms("warmup"),
+            "ready_ms": ready_ms,
+            "ready_since_process_start_ms": round(ready_ms + self.process_offset, 1)
+            if ready_ms is not None and self.process_offset is not None else None,
+            "phases": self.phases,
+        }
+
+    def report(self) -> str:
+        stats = self.stats()
+        lines = ["🕒 启动剖析（毫秒，以网关模块开始导入为零点）",
+                 f"{'阶段':<28}{'开始':>10}{'耗时':>10}"]
+        for phase in self.phases:
+            lines.append(f"{phase['group'] + '/' + phase['name']:<30}{phase['start_ms']:>10.1f}{phase['duration_ms']:>10.1f}")
+        lines.append(f"导入 {stats['import_ms']} ms，预热 {stats['warmup_ms']} ms，"
+                     f"就绪于 {stats['ready_ms']} ms（含进程启动 {stats['ready_since_process_start_ms']} ms）")
+        if self.error:
+            lines.append(f"❌ 预热失败: {self.error}")
+        return "\n".join(lines)
+
+
+class ReadinessMiddleware:
+    """纯 ASGI 就绪闸门：预热完成前业务请求最多等待 wait 秒，仍未就绪返回 503 与 Retry-After"""
+
+    def __init__(self, app, startup: StartupProfile, wait: float = 5.0,
+                 exempt_paths: Iterable[str] = DEFAULT_EXEMPT_PATHS):
+        self.app = app
+        self.startup = startup
+        self.wait = wait
+        self.exempt_paths = frozenset(exempt_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.startup.ready or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+        if await self.startup.wait(self.wait):
+            await self.app(scope, receive, send)
+            return
+        detail = f"服务预热失败: {self.startup.error}" if self.startup.error else "服务预热中，请稍后重试"
+        body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+        await send({"type": "http.response.start", "status": 503, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"retry-after", b"1"),
+        ]})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 多 worker 共享状态
+Lu-Gang Connect - Shared State Store for Multi-Worker Deployments
+独立进程通过本地 Unix socket 维护问答缓存（含近似命中索引）、集群计数器与服务商健康状态，
+各 worker 读写同一份缓存并定期同步熔断状态，增加 worker 不会导致缓存碎片化
+
+用法: python lugang_state.py serve /tmp/lugang_state.sock
+"""
+
+import asyncio
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from lugang_cache import AnswerCache
+from lugang_router import ProviderHealth, health_options_from_env
+
+# 消息格式：4 字节大端长度 + UTF-8 JSON
+_LENGTH = struct.Struct(">I")
+
+
+def _encode(message: Dict) -> bytes:
+    body = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return _LENGTH.pack(len(body)) + body
+
+
+class StateServer:
+    """共享状态进程：单线程事件循环处理全部请求，各操作天然原子"""
+
+    def __init__(self, path: str, cache: Optional[AnswerCache] = None, health_options: Optional[Dict] = None):
+        self.path = path
+        self.cache = cache
+        self.health_options = health_options or {}
+        self.health: Dict[str, ProviderHealth] = {}
+        self.counters: Dict[str, float] = {}
+        self.requests = 0
+
+    def op_ping(self):
+        return "pong"
+
+    def op_cache_get(self, question, language, knowledge_base, user_type, model):
+        if self.cache is None:
+            return None
+        return self.cache.get(question, language, knowledge_base, user_type, model)
+
+    def op_cache_put(self, question, language, knowledge_base, user_type, model, value, terms=None):
+        if self.cache is not None:
+            self.cache.put(question, language, knowledge_base, user_type, model, value, terms)
+
+    def op_cache_invalidate(self, terms):
+        return self.cache.invalidate(terms) if self.cache is not None else 0
+
+    def op_cache_clear(self):
+        if self.cache is not None:
+            self.cache.clear()
+
+    def op_cache_stats(self):
+        return self.cache.stats() if self.cache is not None else {"enabled": False}
+
+    def op_sync(self, events: Dict[str, List[Optional[list]]], counters: Dict[str, float]):
+        """合并 worker 上报的调用结果与计数增量，返回合并后的健康状态与计数总量"""
+        for provider, provider_events in events.items():
+            if provider not in self.health:
+                self.health[provider] = ProviderHealth(provider, **self.health_options)
+            self.health[provider].apply_events(provider_events)
+        for key, delta in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + delta
+        return {
+            "health": {provider: health.export_state() for provider, health in self.health.items()},
+            "counters": self.counters,
+        }
+
+    def op_stats(self):
+        return {"requests": self.requests, "providers": sorted(self.health), "counters": len(self.counters)}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                header = await reader.readexactly(_LENGTH.size)
+                request = json.loads(await reader.readexactly(_LENGTH.unpack(header)[0]))
+                self.requests += 1
+                handler = getattr(self, f"op_{request.get('op')}", None)
+                if handler is None:
+                    response = {"ok": False, "error": f"unknown op: {request.get('op')}"}
+                else:
+                    try:
+                        response = {"ok": True, "result": handler(*request.get("args", []))}
+                    except Exception as e:
+                        response = {"ok": False, "error": str(e)}
+                writer.write(_encode(response))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve_forever(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._handle, path=self.path)
+        os.chmod(self.path, 0o600)
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+
+def run_state_server(path: str):
+    """按环境变量（LUGANG_CACHE_* / LUGANG_BREAKER_*）创建并运行共享状态进程"""
+    StateServer(path, AnswerCache.from_env(), health_options_from_env()).run()
+
+
+class StateError(Exception):
+    """共享状态进程返回错误或连接失败"""
+
+
+class StateClient:
+    """同步客户端：每个 worker 一条长连接，加锁串行收发；连接断开时下次调用自动重连"""
+
+    def __init__(self, path: str, timeout: float = 0.25):
+        self.path = path
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._lock = threading.Lock()
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["StateClient"]:
+        """LUGANG_STATE_SOCKET 指定共享状态 socket 路径，未设置时为单进程模式"""
+        path = os.getenv("LUGANG_STATE_SOCKET")
+        if not path:
+            return None
+        return cls(path, float(os.getenv("LUGANG_STATE_TIMEOUT", "0.25")))
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        return sock
+
+    def _recv_exactly(self, size: int) -> bytes:
+        chunks = []
+        while size:
+            chunk = self._sock.recv(size)
+            if not chunk:
+                raise ConnectionError("共享状态连接已关闭")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def call(self, op: str, *args):
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._sock = self._connect()
+                self._sock.sendall(_encode({"op": op, "args": list(args)}))
+                length = _LENGTH.unpack(self._recv_exactly(_LENGTH.size))[0]
+                response = json.loads(self._recv_exactly(length))
+            except (OSError, ValueError) as e:
+                self.errors += 1
+                if self._sock is not None:
+                    self._sock.close()
+                    self._sock = None
+                raise StateError(f"共享状态不可用: {e}") from e
+        if not response.get("ok"):
+            raise StateError(response.get("error", "unknown error"))
+        return response.get("result")
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+
+
+class AsyncStateClient:
+    """事件循环内使用的异步客户端：小型长连接池，每条连接一次只有一个请求在途；
+    请求超时或连接出错时关闭该连接，下次使用时重连"""
+
+    def __init__(self, path: str, timeout: float = 0.25, pool_size: int = 4):
+        self.path = path
+        self.timeout = timeout
+        self.pool_size = pool_size
+        # 空闲连接槽：None 表示尚未建立连接
+        self._idle: asyncio.LifoQueue = asyncio.LifoQueue()
+        for _ in range(pool_size):
+            self._idle.put_nowait(None)
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["AsyncStateClient"]:
+        """与 StateClient 相同的 LUGANG_STATE_SOCKET / LUGANG_STATE_TIMEOUT，连接数由 LUGANG_STATE_POOL_SIZE 配置"""
+        path = os.getenv("LUGANG_STATE_SOCKET")
+        if not path:
+            return None
+        return cls(path, float(os.getenv("LUGANG_STATE_TIMEOUT", "0.25")),
+                   int(os.getenv("LUGANG_STATE_POOL_SIZE", "4")))
+
+    async def _roundtrip(self, connection, message: Dict) -> Dict:
+        reader, writer = connection
+        writer.write(_encode(message))
+        await writer.drain()
+        length = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))[0]
+        return json.loads(await reader.readexactly(length))
+
+    async def call(self, op: str, *args):
+        connection = await self._idle.get()
+        try:
+            if connection is None:
+                connection = await asyncio.wait_for(asyncio.open_unix_connection(self.path), self.timeout)
+            response = await asyncio.wait_for(self._roundtrip(connection, {"op": op, "args": list(args)}),
+                                              self.timeout)
+        except BaseException as e:
+            # 收发中断（含超时与取消）后连接上可能残留半个响应，不再复用
+            if connection is not None:
+                connection[1].close()
+            connection = None
+            if isinstance(e, (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError)):
+                self.errors += 1
+                raise StateError(f"共享状态不可用: {e}") from e
+            raise
+        finally:
+            self._idle.put_nowait(connection)
+        if not response.get("ok"):
+            raise StateError(response.get("error", "unknown error"))
+        return response.get("result")
+
+    async def close(self):
+        """关闭空闲连接（应用关闭时调用）"""
+        connections = [self._idle.get_nowait() for _ in range(self._idle.qsize())]
+        for connection in connections:
+            if connection is not None:
+                connection[1].close()
+            self._idle.put_nowait(None)
+
+
+class SharedAnswerCache:
+    """与 AnswerCache 接口一致的共享缓存代理；共享状态不可用时按未命中处理，不影响问答。
+    同步方法供线程中调用，异步方法（aget/aput/ainvalidate/aclear/astats）供事件循环中调用"""
+
+    def __init__(self, client: StateClient, async_client: AsyncStateClient):
+        self.client = client
+        self.async_client = async_client
+
+    @classmethod
+    def from_env(cls, client: StateClient, async_client: AsyncStateClient) -> Optional["SharedAnswerCache"]:
+        """LUGANG_CACHE_BACKEND=off 时禁用（与 AnswerCache.from_env 一致）"""
+        if os.getenv("LUGANG_CACHE_BACKEND", "memory").lower() in ("off", "none", "0"):
+            return None
+        return cls(client, async_client)
+
+    def get(self, question: str, language: str, knowledge_base: str, user_type: str, model: str) -> Optional[Dict]:
+        try:
+            return self.client.call("cache_get", question, language, knowledge_base, user_type, model)
+        except StateError:
+            return None
+
+    def put(self, question: str, language: str, knowledge_base: str, user_type: str, model: str, value: Dict,
+            terms: Optional[Iterable[str]] = None):
+        try:
+            self.client.call("cache_put", question, language, knowledge_base, user_type, model, value,
+                             list(terms) if terms is not None else None)
+        except StateError:
+            pass
+
+    def invalidate(self, terms: Iterable[str]) -> int:
+        try:
+            return self.client.call("cache_invalidate", list(terms))
+        except StateError:
+            # 共享状态不可用时无法精确失效，尽力整体清空
+            self.clear()
+            return 0
+
+    def clear(self):
+        try:
+            self.client.call("cache_clear")
+        except StateError:
+            pass
+
+    def stats(self) -> Dict:
+        try:
+            stats = self.client.call("cache_stats")
+        except StateError as e:
+            stats = {"error": str(e)}
+        return self._with_client_stats(stats)
+
+    def _with_client_stats(self, stats: Dict) -> Dict:
+        return {**stats, "shared": True, "socket": self.client.path,
+                "client_errors": self.client.errors + self.async_client.errors}
+
+    async def aget(self, question: str, language: str, knowledge_base: str, user_type: str,
+                   model: str) -> Optional[Dict]:
+        try:
+            return await self.async_client.call("cache_get", question, language, knowledge_base, user_type, model)
+        except StateError:
+            return None
+
+    async def aput(self, question: str, language: str, knowledge_base: str, user_type: str, model: str, value: Dict,
+                   terms: Optional[Iterable[str]] = None):
+        try:
+            await self.async_client.call("cache_put", question, language, knowledge_base, user_type, model, value,
+                                         list(terms) if terms is not None else None)
+        except StateError:
+            pass
+
+    async def ainvalidate(self, terms: Iterable[str]) -> int:
+        try:
+            return await self.async_client.call("cache_invalidate", list(terms))
+        except StateError:
+            await self.aclear()
+            return 0
+
+    async def aclear(self):
+        try:
+            await self.async_client.call("cache_clear")
+        except StateError:
+            pass
+
+    async def astats(self) -> Dict:
+        try:
+            stats = await self.async_client.call("cache_stats")
+        except StateError as e:
+            stats = {"error": str(e)}
+        return self._with_client_stats(stats)
+
+
+class StateSync:
+    """定期把本 worker 的服务商调用结果与计数增量上报共享状态，并载入合并后的熔断状态"""
+
+    def __init__(self, client: StateClient, router, admission=None, interval: float = 1.0):
+        self.client = client
+        self.router = router
+        self.admission = admission
+        self.interval = interval
+        self.cluster_counters: Dict[str, float] = {}
+        self.syncs = 0
+        self.failures = 0
+        self._reported: Dict[str, float] = {}
+        for health in router.health.values():
+            health.events = []
+
+    def _counter_deltas(self) -> Dict[str, float]:
+        current: Dict[str, float] = {
+            "router.hedged_requests": self.router.hedged_requests,
+            "router.hedge_wins": self.router.hedge_wins,
+            "router.failovers": self.router.failovers,
+        }
+        if self.admission is not None:
+            for name, limiter in self.admission.limiters.items():
+                current[f"admission.{name}.admitted"] = limiter.admitted
+                current[f"admission.{name}.rejected_queue_full"] = limiter.rejected_full
+                current[f"admission.{name}.rejected_queue_timeout"] = limiter.rejected_timeout
+        deltas = {key: value - self._reported.get(key, 0) for key, value in current.items()
+                  if value != self._reported.get(key, 0)}
+        self._reported.update(current)
+        return deltas
+
+    def _collect(self):
+        events = {}
+        for name, health in self.router.health.items():
+            events[name], health.events = health.events, []
+        return events, self._counter_deltas()
+
+    def _restore(self, events: Dict[str, List[Optional[list]]], deltas: Dict[str, float]):
+        """上报失败时放回事件与计数，下次一并上报"""
+        for name, provider_events in events.items():
+            self.router.health[name].events[:0] = provider_events
+        for key, delta in deltas.items():
+            self._reported[key] -= delta
+        self.failures += 1
+
+    def _apply(self, result: Dict):
+        for name, state in result["health"].items():
+            if name in self.router.health:
+                self.router.health[name].load_state(state)
+        self.cluster_counters = result["counters"]
+        self.syncs += 1
+
+    def sync_once(self):
+        events, deltas = self._collect()
+        try:
+            result = self.client.call("sync", events, deltas)
+        except StateError:
+            self._restore(events, deltas)
+            return
+        self._apply(result)
+
+    async def run(self):
+        """收集与载入在事件循环线程执行，只有 socket 收发放到线程池"""
+        while True:
+            await asyncio.sleep(self.interval)
+            events, deltas = self._collect()
+            try:
+                result = await asyncio.to_thread(self.client.call, "sync", events, deltas)
+            except StateError:
+                self._restore(events, deltas)
+                continue
+            self._apply(result)
+
+    def stats(self) -> Dict:
+        return {
+            "socket": self.client.path,
+            "workers": int(os.getenv("LUGANG_WORKERS", "1")),
+            "syncs": self.syncs,
+            "sync_failures": self.failures,
+            "cluster_counters": self.cluster_counters,
+        }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "serve":
+        print(__doc__)
+        sys.exit(1)
+    print(f"✅ 共享状态服务监听: {sys.argv[2]}")
+    run_state_server(sys.argv[2])
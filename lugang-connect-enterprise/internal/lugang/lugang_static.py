@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 预生成响应
+Lu-Gang Connect - Precomputed Responses
+启动及知识库切换时预先序列化响应体并生成 gzip/brotli 压缩版本，
+支持 ETag 条件请求（304）与 Cache-Control
+"""
+
+import gzip
+import hashlib
+import json
+from typing import Dict, List, Tuple
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """解析 Accept-Encoding，返回 编码 -> q 值"""
+    encodings = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[name.strip().lower()] = quality
+    return encodings
+
+
+def choose_encoding(header: str, available: List[str]) -> str:
+    """按客户端偏好（q 值）与服务端优先级 br > gzip 选择编码，无可用编码时返回 identity"""
+    accepted = parse_accept_encoding(header or "")
+    best, best_quality = "identity", 0.0
+    for encoding in available:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class PrecomputedResponse:
+    """预生成的响应：原始体、压缩体、ETag 一次计算，请求时只做协商；
+    各编码版本字节不同，使用带编码后缀的强 ETag（"<sha1>-gzip"、"<sha1>-br"）"""
+
+    def __init__(self, body: bytes, media_type: str, max_age: int = 60):
+        self.media_type = media_type
+        self.cache_control = f"public, max-age={max_age}"
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.variants: Dict[str, bytes] = {"identity": body}
+        compressed = gzip.compress(body, compresslevel=9)
+        if len(compressed) < len(body):
+            self.variants["gzip"] = compressed
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                self.variants["br"] = compressed
+        self._encodings = [name for name in ("br", "gzip") if name in self.variants]
+        self.etags = {encoding: self.etag if encoding == "identity" else f'{self.etag[:-1]}-{encoding}"'
+                      for encoding in self.variants}
+
+    @classmethod
+    def from_json(cls, payload, max_age: int = 60) -> "PrecomputedResponse":
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return cls(body, "application/json", max_age)
+
+    @classmethod
+    def from_html(cls, html: str, max_age: int = 60) -> "PrecomputedResponse":
+        return cls(html.encode("utf-8"), "text/html; charset=utf-8", max_age)
+
+    def _etag_matches(self, header: str) -> bool:
+        if not header:
+            return False
+        if header.strip() == "*":
+            return True
+        # If-None-Match 按弱比较：任一编码版本的 ETag 都表示内容未变（代理可能把强 ETag 降为弱 ETag）
+        tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+        return not tags.isdisjoint(self.etags.values())
+
+    def respond(self, request: Request) -> Response:
+        """根据 If-None-Match 与 Accept-Encoding 返回 304 或对应编码的响应"""
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""), self._encodings)
+        headers = {"ETag": self.etags[encoding], "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if self._etag_matches(request.headers.get("if-none-match", "")):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=self.variants[encoding], media_type=self.media_type, headers=headers)
+
+    def sizes(self) -> Dict[str, int]:
+        return {encoding: len(body) for encoding, body in self.variants.items()}
+
+
+def precompute_all(builders: Dict[str, Tuple[str, object]], max_age: int = 60) -> Dict[str, PrecomputedResponse]:
+    """批量预生成：builders 为 名称 -> ("json"/"html", 内容)"""
+    responses = {}
+    for name, (kind, content) in builders.items():
+        if kind == "html":
+            responses[name] = PrecomputedResponse.from_html(content, max_age)
+        else:
+            responses[name] = PrecomputedResponse.from_json(content, max_age)
+    return responses
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 本地模拟上游服务
+Lu-Gang Connect - Local OpenAI-Compatible Upstream Stub
+压测时代替 DeepSeek 与 Qwen，提供 /v1/chat/completions 接口，
+可配置响应延迟、抖动、流式分片与错误率；/v1/embeddings 返回按字符二元组哈希的确定性向量
+
+用法: python lugang_stub_upstream.py --port 9100 --latency 0.3 --jitter 0.1 --error-rate 0.01
+      网关侧设置 DEEPSEEK_API_URL=http://127.0.0.1:9100/deepseek/v1/chat/completions
+                 QWEN_API_URL=http://127.0.0.1:9100/qwen/v1/chat/completions
+                 LUGANG_EMBEDDING_URL=http://127.0.0.1:9100/v1/embeddings
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import math
+import time
+import zlib
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+
+class StubConfig:
+    """模拟上游的行为参数，可按服务商单独覆盖延迟与错误率"""
+
+    def __init__(self, latency: float = 0.3, jitter: float = 0.0, error_rate: float = 0.0,
+                 chunks: int = 20, chunk_delay: float = 0.02, answer_chars: int = 200,
+                 provider_latency: Optional[Dict[str, float]] = None,
+                 provider_error_rate: Optional[Dict[str, float]] = None, seed: Optional[int] = None,
+                 embedding_dims: int = 256):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chunks = max(1, chunks)
+        self.chunk_delay = chunk_delay
+        self.answer_chars = answer_chars
+        self.provider_latency = provider_latency or {}
+        self.provider_error_rate = provider_error_rate or {}
+        self.random = random.Random(seed)
+        self.embedding_dims = embedding_dims
+
+    def delay(self, provider: str) -> float:
+        base = self.provider_latency.get(provider, self.latency)
+        return max(0.0, base + self.random.uniform(-self.jitter, self.jitter))
+
+    def should_fail(self, provider: str) -> bool:
+        return self.random.random() < self.provider_error_rate.get(provider, self.error_rate)
+
+
+def stub_embedding(text: str, dims: int) -> List[float]:
+    """字符二元组哈希到固定维度后归一化，字面相近的文本向量相近"""
+    vector = [0.0] * dims
+    text = "".join(text.lower().split())
+    for i in range(max(1, len(text) - 1)):
+        vector[zlib.crc32(text[i:i + 2].encode("utf-8")) % dims] += 1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def create_app(config: StubConfig) -> FastAPI:
+    app = FastAPI(title="鲁港通模拟上游")
+    counters: Dict[str, Dict[str, int]] = {}
+
+    def count(provider: str, key: str):
+        bucket = counters.setdefault(provider, {"requests": 0, "errors": 0, "streams": 0})
+        bucket[key] += 1
+
+    async def completions(provider: str, request: Request):
+        body = await request.json()
+        count(provider, "requests")
+        await asyncio.sleep(config.delay(provider))
+        if config.should_fail(provider):
+            count(provider, "errors")
+            return JSONResponse(status_code=503, content={"error": {"message": "stub injected failure"}})
+
+        model = body.get("model", provider)
+        answer = (f"[{provider}:{model}] " + "鲁港通模拟回答" * config.answer_chars)[:config.answer_chars]
+        prompt_tokens = sum(len(message.get("content", "")) for message in body.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(answer),
+                 "total_tokens": prompt_tokens + len(answer)}
+
+        if body.get("stream"):
+            count(provider, "streams")
+            size = -(-len(answer) // config.chunks)
+
+            async def generate():
+                for start in range(0, len(answer), size):
+                    await asyncio.sleep(config.chunk_delay)
+                    chunk = {"model": model, "choices": [{"index": 0, "delta": {"content": answer[start:start + size]}}]}
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                final = {"model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+                yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(generate(), media_type="text/event-stream")
+
+        return {
+            "id": f"stub-{time.time_ns()}",
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    @app.post("/v1/chat/completions")
+    async def default_completions(request: Request):
+        return await completions("default", request)
+
+    @app.post("/{provider}/v1/chat/completions")
+    async def provider_completions(provider: str, request: Request):
+        return await completions(provider, request)
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get("input", [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        count("embedding", "requests")
+        await asyncio.sleep(config.provider_latency.get("embedding", 0.005))
+        if config.should_fail("embedding"):
+            count("embedding", "errors")
+            return JSONResponse(status_code=503, content={"error": {"message": "stub injected failure"}})
+        return {
+            "object": "list",
+            "model": body.get("model", "stub-embedding"),
+            "data": [{"object": "embedding", "index": i, "embedding": stub_embedding(text, config.embedding_dims)}
+                     for i, text in enumerate(inputs)],
+            "usage": {"prompt_tokens": sum(len(text) for text in inputs), "total_tokens": sum(len(text) for text in inputs)},
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return counters
+
+    @app.post("/stats/reset")
+    async def reset_stats():
+        counters.clear()
+        return {"status": "ok"}
+
+    return app
+
+
+def _parse_overrides(values) -> Dict[str, float]:
+    """解析 name=value 形式的服务商覆盖参数"""
+    overrides = {}
+    for item in values or []:
+        name, _, value = item.partition("=")
+        overrides[name] = float(value)
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description="鲁港通本地模拟上游（OpenAI 兼容）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.3, help="首字节前延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.05, help="延迟均匀抖动幅度（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 503 的概率")
+    parser.add_argument("--chunks", type=int, default=20, help="流式响应分片数")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="流式分片间隔（秒）")
+    parser.add_argument("--answer-chars", type=int, default=200, help="回答长度（字符）")
+    parser.add_argument("--provider-latency", action="append", metavar="NAME=SECONDS",
+                        help="按服务商覆盖延迟，如 qwen=0.8（embedding 默认 0.005）")
+    parser.add_argument("--provider-error-rate", action="append", metavar="NAME=RATE",
+                        help="按服务商覆盖错误率，如 deepseek=0.2")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--embedding-dims", type=int, default=256, help="/v1/embeddings 向量维度")
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency, args.jitter, args.error_rate, args.chunks, args.chunk_delay,
+                        args.answer_chars, _parse_overrides(args.provider_latency),
+                        _parse_overrides(args.provider_error_rate), args.seed, args.embedding_dims)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
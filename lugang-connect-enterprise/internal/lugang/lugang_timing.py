@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 请求阶段计时
+Lu-Gang Connect - Per-Request Phase Timer
+记录检索、路由、上游调用等阶段耗时，通过 Server-Timing 响应头返回给压测工具
+"""
+
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict
+
+
+class PhaseTimer:
+    """单个请求内各阶段的累计耗时（秒）；传入 OpenTelemetry tracer 时每个阶段同时生成子 span"""
+
+    def __init__(self, tracer=None):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.tracer = tracer
+
+    @contextmanager
+    def phase(self, name: str):
+        span = self.tracer.start_as_current_span(f"lugang.{name}") if self.tracer else nullcontext()
+        start = time.perf_counter()
+        try:
+            with span:
+                yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """格式化为 Server-Timing 响应头，单位毫秒"""
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.phases.items())
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """解析 Server-Timing 响应头，返回 阶段 -> 毫秒"""
+    phases = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                try:
+                    phases[name] = float(value)
+                except ValueError:
+                    pass
+    return phases
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 上游AI服务连接池
+Lu-Gang Connect - Pooled Upstream HTTP Clients
+按服务商维护长连接 httpx.AsyncClient，随应用生命周期创建与关闭
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def _env_number(name: str, default, cast=float):
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        return default
+
+
+@dataclass
+class PoolConfig:
+    """单个服务商的连接池与超时配置"""
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 60.0
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    write_timeout: float = 10.0
+    pool_timeout: float = 5.0
+    http2: bool = True
+
+    @classmethod
+    def from_env(cls, provider: str) -> "PoolConfig":
+        """读取环境变量 LUGANG_<PROVIDER>_<字段名>，例如 LUGANG_DEEPSEEK_MAX_CONNECTIONS"""
+        prefix = f"LUGANG_{provider.upper()}_"
+        defaults = cls()
+        return cls(
+            max_connections=_env_number(prefix + "MAX_CONNECTIONS", defaults.max_connections, int),
+            max_keepalive_connections=_env_number(prefix + "MAX_KEEPALIVE", defaults.max_keepalive_connections, int),
+            keepalive_expiry=_env_number(prefix + "KEEPALIVE_EXPIRY", defaults.keepalive_expiry),
+            connect_timeout=_env_number(prefix + "CONNECT_TIMEOUT", defaults.connect_timeout),
+            read_timeout=_env_number(prefix + "READ_TIMEOUT", defaults.read_timeout),
+            write_timeout=_env_number(prefix + "WRITE_TIMEOUT", defaults.write_timeout),
+            pool_timeout=_env_number(prefix + "POOL_TIMEOUT", defaults.pool_timeout),
+            http2=os.getenv(prefix + "HTTP2", "1").lower() not in ("0", "false", "no"),
+        )
+
+
+class UpstreamClientRegistry:
+    """上游客户端注册表：每个服务商一个共享的长连接客户端"""
+
+    def __init__(self, configs: Dict[str, PoolConfig]):
+        self.configs = configs
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._requests: Dict[str, int] = {name: 0 for name in configs}
+        self._errors: Dict[str, int] = {name: 0 for name in configs}
+        self._in_flight: Dict[str, int] = {name: 0 for name in configs}
+
+    def _create_client(self, name: str) -> httpx.AsyncClient:
+        config = self.configs[name]
+        return httpx.AsyncClient(
+            http2=config.http2 and HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                connect=config.connect_timeout,
+                read=config.read_timeout,
+                write=config.write_timeout,
+                pool=config.pool_timeout,
+            ),
+        )
+
+    async def start(self):
+        """应用启动时创建所有客户端"""
+        for name in self.configs:
+            if name not in self._clients:
+                self._clients[name] = self._create_client(name)
+
+    async def prewarm(self, urls: Dict[str, str]) -> Dict[str, bool]:
+        """向各服务商源站发一次 HEAD，提前完成 DNS、TCP 与 TLS 握手并把连接留在池中；失败不影响启动"""
+        async def connect(name: str, url: str) -> bool:
+            origin = httpx.URL(url).copy_with(path="/", query=None)
+            try:
+                await self.client(name).head(origin)
+                return True
+            except httpx.HTTPError:
+                return False
+
+        names = [name for name in urls if name in self.configs]
+        results = await asyncio.gather(*(connect(name, urls[name]) for name in names))
+        return dict(zip(names, results))
+
+    async def close(self):
+        """应用关闭时释放连接"""
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def client(self, name: str) -> httpx.AsyncClient:
+        """获取服务商客户端（未启动时按需创建）"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._clients[name] = self._create_client(name)
+        return client
+
+    async def post(self, name: str, url: str, **kwargs) -> httpx.Response:
+        """通过服务商连接池发送POST请求，并记录请求计数"""
+        self._requests[name] += 1
+        self._in_flight[name] += 1
+        try:
+            return await self.client(name).post(url, **kwargs)
+        except Exception:
+            self._errors[name] += 1
+            raise
+        finally:
+            self._in_flight[name] -= 1
+
+    @asynccontextmanager
+    async def stream(self, name: str, url: str, **kwargs):
+        """通过服务商连接池发送流式POST请求，响应体按需读取"""
+        self._requests[name] += 1
+        self._in_flight[name] += 1
+        try:
+            async with self.client(name).stream("POST", url, **kwargs) as response:
+                yield response
+        except Exception:
+            self._errors[name] += 1
+            raise
+        finally:
+            self._in_flight[name] -= 1
+
+    def _pool_connections(self, name: str) -> Optional[Dict[str, int]]:
+        client = self._clients.get(name)
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return None
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {"total": len(connections), "idle": idle, "active": len(connections) - idle}
+
+    def stats(self) -> Dict[str, Dict]:
+        """连接池统计信息"""
+        result = {}
+        for name, config in self.configs.items():
+            client = self._clients.get(name)
+            result[name] = {
+                "started": client is not None and not client.is_closed,
+                "http2": config.http2 and HTTP2_AVAILABLE,
+                "requests_total": self._requests[name],
+                "errors_total": self._errors[name],
+                "in_flight": self._in_flight[name],
+                "connections": self._pool_connections(name),
+                "config": asdict(config),
+            }
+        return result
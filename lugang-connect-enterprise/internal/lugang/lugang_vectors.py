@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 稠密向量混合检索
+Lu-Gang Connect - Dense Vector Hybrid Retrieval
+知识库条目向量离线计算，以 float16 矩阵存盘、加载时展开为 float32；条目较多时离线划分
+倒排簇（IVF），查询只扫描最接近的若干簇，安装 hnswlib 时可改用 HNSW 图索引。
+查询向量通过 OpenAI 兼容的 /v1/embeddings 接口微批计算并缓存，向量候选与 BM25 候选
+按倒数排名融合（RRF）
+
+用法: python lugang_vectors.py build <输出路径.npz> [knowledge_base.json] [--lists N]
+      向量化服务由 LUGANG_EMBEDDING_URL / LUGANG_EMBEDDING_MODEL / LUGANG_EMBEDDING_API_KEY 指定
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from lugang_cache import normalize_question
+from lugang_search import KnowledgeIndex, SearchHit
+
+try:
+    import numpy as np
+except ImportError:  # 无 numpy 时不启用向量检索
+    np = None
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+VECTOR_FORMAT_VERSION = 1
+
+# RRF 常数：排名靠后的候选贡献衰减得更平缓
+RRF_K = 60
+
+# 条目数达到该值时离线构建默认划分倒排簇，较小的知识库直接全量点积
+IVF_MIN_DOCUMENTS = 20000
+
+
+class EmbeddingError(Exception):
+    """向量化服务不可用或返回格式错误"""
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def parse_embeddings(payload: Dict, expected: int):
+    """解析 OpenAI 兼容的 embeddings 响应，按 index 排序后返回 L2 归一化的 float32 矩阵"""
+    try:
+        data = sorted(payload["data"], key=lambda item: item.get("index", 0))
+        matrix = np.asarray([item["embedding"] for item in data], dtype=np.float32)
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise EmbeddingError(f"向量化响应格式错误: {e}") from e
+    if matrix.ndim != 2 or len(matrix) != expected:
+        raise EmbeddingError(f"向量化响应条数不符: {len(matrix)} != {expected}")
+    return _normalize_rows(matrix)
+
+
+def knowledge_fingerprint(index: KnowledgeIndex) -> str:
+    """知识库条目指纹：条目顺序或内容变化后离线向量即失效"""
+    digest = hashlib.sha1()
+    for kb_type, category, text in index.docs:
+        digest.update(f"{kb_type}\x1e{category}\x1e{text}\x1f".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = RRF_K) -> List[Tuple[int, float]]:
+    """倒数排名融合：各路排名第 r 的文档得 1/(k+r)，按总分降序"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+# ---------- 离线构建 ----------
+
+def embed_texts(texts: List[str], url: str, model: str, api_key: str = "", batch_size: int = 64,
+                timeout: float = 60.0):
+    """离线批量计算条目向量"""
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    parts = []
+    with httpx.Client(timeout=timeout) as client:
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            response = client.post(url, json={"input": batch, "model": model}, headers=headers)
+            response.raise_for_status()
+            parts.append(parse_embeddings(response.json(), len(batch)))
+            print(f"  已向量化 {start + len(batch)}/{len(texts)}")
+    return np.concatenate(parts)
+
+
+def train_ivf(vectors, lists: int, iterations: int = 10, sample: int = 50000, seed: int = 0):
+    """球面 k-means 划分倒排簇，返回 (簇中心, 按簇排列的条目ID, 各簇起始偏移)"""
+    rng = np.random.default_rng(seed)
+    training = vectors[rng.choice(len(vectors), min(sample, len(vectors)), replace=False)]
+    centroids = training[rng.choice(len(training), lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(training @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, training)
+        empty = ~sums.any(axis=1)
+        sums[empty] = centroids[empty]  # 空簇保留原中心
+        centroids = _normalize_rows(sums)
+    assign = np.concatenate([np.argmax(vectors[start:start + 8192] @ centroids.T, axis=1)
+                             for start in range(0, len(vectors), 8192)])
+    order = np.argsort(assign, kind="stable").astype(np.int32)
+    offsets = np.searchsorted(assign[order], np.arange(lists + 1)).astype(np.int64)
+    return centroids, order, offsets
+
+
+def write_vectors(path: str, vectors, fingerprint: str, model: str, lists: int = 0):
+    """写入向量文件（npz：float16 矩阵、可选倒排簇与元数据），先写临时文件再原子替换"""
+    arrays = {"vectors": vectors.astype(np.float16)}
+    if lists:
+        arrays["centroids"], arrays["order"], arrays["offsets"] = train_ivf(vectors, lists)
+    meta = {
+        "version": VECTOR_FORMAT_VERSION,
+        "documents": len(vectors),
+        "dims": int(vectors.shape[1]),
+        "model": model,
+        "fingerprint": fingerprint,
+        "lists": lists,
+    }
+    arrays["meta"] = np.frombuffer(json.dumps(meta, ensure_ascii=False).encode("utf-8"), dtype=np.uint8)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def build_vectors(index: KnowledgeIndex, path: str, url: str, model: str, api_key: str = "",
+                  lists: Optional[int] = None, batch_size: int = 64):
+    """计算知识库全部条目的向量并写入文件；lists 未指定时按条目数决定是否划分倒排簇"""
+    vectors = embed_texts([text for _, _, text in index.docs], url, model, api_key, batch_size)
+    if lists is None:
+        lists = int(4 * math.sqrt(len(vectors))) if len(vectors) >= IVF_MIN_DOCUMENTS else 0
+    write_vectors(path, vectors, knowledge_fingerprint(index), model, lists)
+
+
+# ---------- 在线检索 ----------
+
+class VectorIndex:
+    """知识库条目向量索引，条目ID与 KnowledgeIndex 一致；
+    backend 为 exact（全量点积）/ ivf（倒排簇）/ hnsw / auto（有倒排簇用 ivf，否则 exact）"""
+
+    def __init__(self, index: KnowledgeIndex, vectors, model: str = "", centroids=None, order=None,
+                 offsets=None, nprobe: int = 8, backend: str = "auto", min_similarity: float = 0.0,
+                 rrf_k: int = RRF_K, path: str = ""):
+        self.index = index
+        self.model = model
+        self.path = path
+        self.dims = vectors.shape[1]
+        self.nprobe = nprobe
+        self.min_similarity = min_similarity
+        self.rrf_k = rrf_k
+        self.searches = 0
+        self.fused = 0
+        self.centroids = None
+        self.hnsw = None
+        doc_categories = np.frombuffer(index.doc_categories, dtype=np.uint32)
+
+        if backend == "hnsw" and hnswlib is None:
+            print("⚠️ 未安装 hnswlib，向量检索改用倒排簇/全量点积")
+            backend = "auto"
+        if backend == "hnsw":
+            self.hnsw = self._load_hnsw(vectors)
+            self.backend = "hnsw"
+            self.doc_categories = doc_categories
+            return
+        if backend in ("auto", "ivf") and centroids is not None:
+            # 按簇重排，每个簇在矩阵中连续，查询时逐簇点积无需拷贝
+            self.backend = "ivf"
+            self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+            self.offsets = offsets
+            self.doc_ids = np.asarray(order, dtype=np.int64)
+        else:
+            self.backend = "exact"
+            self.doc_ids = np.arange(len(vectors), dtype=np.int64)
+        # 磁盘为 float16；numpy 的 float16 矩阵乘法没有 BLAS 加速，常驻内存展开为 float32
+        self.vectors = np.ascontiguousarray(vectors[self.doc_ids], dtype=np.float32)
+        self.doc_categories = doc_categories[self.doc_ids]
+
+    def _load_hnsw(self, vectors):
+        """HNSW 图索引与向量文件同目录缓存，向量文件更新后重建"""
+        graph = hnswlib.Index(space="ip", dim=self.dims)
+        graph_path = f"{self.path}.hnsw" if self.path else ""
+        if graph_path and os.path.exists(graph_path) and os.path.getmtime(graph_path) >= os.path.getmtime(self.path):
+            graph.load_index(graph_path, max_elements=len(vectors))
+        else:
+            graph.init_index(max_elements=len(vectors), ef_construction=200, M=16)
+            graph.add_items(np.asarray(vectors, dtype=np.float32), np.arange(len(vectors)))
+            if graph_path:
+                graph.save_index(graph_path)
+        graph.set_ef(max(64, self.nprobe * 16))
+        return graph
+
+    @classmethod
+    def load(cls, path: str, index: KnowledgeIndex, **options) -> "VectorIndex":
+        """加载离线向量文件，条目数或指纹与当前知识库不一致时抛出 ValueError"""
+        with np.load(path) as data:
+            meta = json.loads(bytes(data["meta"]).decode("utf-8"))
+            if meta.get("version") != VECTOR_FORMAT_VERSION:
+                raise ValueError(f"不支持的向量文件版本: {meta.get('version')}")
+            if meta["documents"] != len(index) or meta["fingerprint"] != knowledge_fingerprint(index):
+                raise ValueError("条目向量与当前知识库不一致，请重新运行 lugang_vectors.py build")
+            ivf = {key: data[key] for key in ("centroids", "order", "offsets") if key in data.files}
+            return cls(index, data["vectors"], meta.get("model", ""), path=path, **ivf, **options)
+
+    @classmethod
+    def from_env(cls, index: KnowledgeIndex) -> Optional["VectorIndex"]:
+        """LUGANG_VECTOR_PATH 指定离线向量文件，LUGANG_VECTOR_BACKEND / _NPROBE / _MIN_SIMILARITY /
+        LUGANG_RRF_K 调整检索；未设置、缺少 numpy 或与知识库不一致时不启用"""
+        path = os.getenv("LUGANG_VECTOR_PATH")
+        if not path:
+            return None
+        if np is None:
+            print("⚠️ 向量检索需要 numpy，已退回关键词检索")
+            return None
+        try:
+            return cls.load(
+                path, index,
+                nprobe=int(os.getenv("LUGANG_VECTOR_NPROBE", "8")),
+                backend=os.getenv("LUGANG_VECTOR_BACKEND", "auto").lower(),
+                min_similarity=float(os.getenv("LUGANG_VECTOR_MIN_SIMILARITY", "0")),
+                rrf_k=int(os.getenv("LUGANG_RRF_K", str(RRF_K))),
+            )
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ 向量检索未启用: {e}")
+            return None
+
+    def __len__(self) -> int:
+        return len(self.doc_categories)
+
+    def search(self, query, top_k: int = 5, factors: Optional[List[float]] = None) -> List[Tuple[int, float]]:
+        """按余弦相似度返回 [(条目ID, 相似度)]；factors 为分类系数，0 表示过滤"""
+        if query.shape[-1] != self.dims:
+            raise EmbeddingError(f"查询向量维度 {query.shape[-1]} 与索引 {self.dims} 不一致")
+        self.searches += 1
+        if self.hnsw is not None:
+            # 过滤在取回后进行，多取一些候选
+            fetch = min(len(self), top_k if factors is None else top_k * 4)
+            labels, distances = self.hnsw.knn_query(query, k=fetch)
+            doc_ids = labels[0].astype(np.int64)
+            scores = 1.0 - distances[0]
+            categories = self.doc_categories[doc_ids]
+        elif self.centroids is not None:
+            nearest = self.centroids @ query
+            lists = np.argpartition(-nearest, self.nprobe - 1)[:self.nprobe] \
+                if self.nprobe < len(nearest) else range(len(nearest))
+            ranges = [(self.offsets[i], self.offsets[i + 1]) for i in lists if self.offsets[i + 1] > self.offsets[i]]
+            if not ranges:
+                return []
+            scores = np.concatenate([self.vectors[start:end] @ query for start, end in ranges])
+            doc_ids = np.concatenate([self.doc_ids[start:end] for start, end in ranges])
+            categories = np.concatenate([self.doc_categories[start:end] for start, end in ranges])
+        else:
+            scores = self.vectors @ query
+            doc_ids, categories = self.doc_ids, self.doc_categories
+
+        keep = scores >= self.min_similarity
+        if factors is not None:
+            weights = np.asarray(factors, dtype=np.float32)[categories]
+            keep &= weights != 0
+            scores = scores * weights
+        if not keep.all():
+            doc_ids, scores = doc_ids[keep], scores[keep]
+        if len(scores) > top_k:
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            candidates = np.arange(len(scores))
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(doc_ids[i]), float(scores[i])) for i in order]
+
+    def fuse(self, keyword_hits: List[SearchHit], query, kb_type: str = "both",
+             boosts: Optional[Dict[Tuple[Optional[str], str], float]] = None, top_k: int = 5) -> List[SearchHit]:
+        """向量候选与关键词候选做 RRF 融合，返回得分为融合分的 SearchHit"""
+        factors = self.index.category_factors(kb_type, boosts) if kb_type != "both" or boosts else None
+        vector_ranked = self.search(query, top_k, factors)
+        fused = reciprocal_rank_fusion([[hit.doc_id for hit in keyword_hits],
+                                        [doc_id for doc_id, _ in vector_ranked]], self.rrf_k)
+        self.fused += 1
+        return [SearchHit(doc_id, score, *self.index.docs[doc_id]) for doc_id, score in fused[:top_k]]
+
+    def stats(self) -> Dict:
+        return {
+            "path": self.path,
+            "model": self.model,
+            "backend": self.backend,
+            "documents": len(self),
+            "dims": self.dims,
+            "lists": len(self.centroids) if self.centroids is not None else 0,
+            "nprobe": self.nprobe if self.backend == "ivf" else None,
+            "searches": self.searches,
+            "fused": self.fused,
+        }
+
+
+class QueryEmbedder:
+    """查询向量：按规范化问题 LRU 缓存；未命中的查询在 max_wait 内合并为一次向量化请求，
+    相同问题并发到达时只计算一次。post 为发送 POST 请求的协程函数（复用上游连接池）"""
+
+    def __init__(self, post, url: str, model: str, api_key: str = "", cache_size: int = 4096,
+                 max_batch: int = 32, max_wait: float = 0.002, timeout: float = 2.0):
+        self._post = post
+        self.url = url
+        self.model = model
+        self.api_key = api_key
+        self.cache_size = cache_size
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._cache: "OrderedDict[str, object]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._queue: List[Tuple[str, str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.embedded = 0
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls, post) -> Optional["QueryEmbedder"]:
+        """LUGANG_EMBEDDING_URL / _MODEL / _API_KEY / _TIMEOUT，LUGANG_EMBEDDING_CACHE_SIZE，
+        LUGANG_EMBEDDING_BATCH / _BATCH_WAIT_MS；未设置 URL 或缺少 numpy 时不启用"""
+        url = os.getenv("LUGANG_EMBEDDING_URL")
+        if not url or np is None:
+            return None
+        return cls(
+            post, url,
+            model=os.getenv("LUGANG_EMBEDDING_MODEL", "bge-m3"),
+            api_key=os.getenv("LUGANG_EMBEDDING_API_KEY", ""),
+            cache_size=int(os.getenv("LUGANG_EMBEDDING_CACHE_SIZE", "4096")),
+            max_batch=int(os.getenv("LUGANG_EMBEDDING_BATCH", "32")),
+            max_wait=float(os.getenv("LUGANG_EMBEDDING_BATCH_WAIT_MS", "2")) / 1000,
+            timeout=float(os.getenv("LUGANG_EMBEDDING_TIMEOUT", "2")),
+        )
+
+    async def embed_many(self, texts: List[str]):
+        """返回每个问题的归一化向量（float32 矩阵），向量化失败时抛出 EmbeddingError"""
+        results: List[object] = [None] * len(texts)
+        waits = []
+        for position, text in enumerate(texts):
+            key = normalize_question(text) or text
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                results[position] = vector
+                continue
+            self.misses += 1
+            future = self._pending.get(key)
+            if future is None:
+                future = self._enqueue(key, text)
+            waits.append((position, future))
+        for position, future in waits:
+            # 单个请求被取消不影响同批其他请求
+            results[position] = await asyncio.shield(future)
+        return np.stack(results)
+
+    async def embed(self, text: str):
+        return (await self.embed_many([text]))[0]
+
+    def _enqueue(self, key: str, text: str) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[key] = future
+        self._queue.append((key, text, future))
+        if len(self._queue) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+        return future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._queue = self._queue, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, str, asyncio.Future]]):
+        self.batches += 1
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        try:
+            response = await self._post(self.url, json={"input": [text for _, text, _ in batch], "model": self.model},
+                                        headers=headers, timeout=self.timeout)
+            response.raise_for_status()
+            vectors = parse_embeddings(response.json(), len(batch))
+        except (httpx.HTTPError, ValueError, EmbeddingError) as e:
+            self.errors += 1
+            error = e if isinstance(e, EmbeddingError) else EmbeddingError(f"向量化服务调用失败: {e}")
+            for key, _, future in batch:
+                self._pending.pop(key, None)
+                if not future.done():
+                    future.set_exception(error)
+                    future.exception()  # 等待方均已取消时不再报告未读取的异常
+            return
+        self.embedded += len(batch)
+        for (key, _, future), vector in zip(batch, vectors):
+            self._pending.pop(key, None)
+            self._cache[key] = vector
+            if not future.done():
+                future.set_result(vector)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "url": self.url,
+            "model": self.model,
+            "cache_entries": len(self._cache),
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "batches": self.batches,
+            "embedded": self.embedded,
+            "avg_batch_size": round(self.embedded / self.batches, 2) if self.batches else 0.0,
+            "errors": self.errors,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线计算知识库条目向量")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    build = subcommands.add_parser("build", help="计算全部条目向量并写入 npz 文件")
+    build.add_argument("output")
+    build.add_argument("knowledge_base", nargs="?", help="知识库 JSON（默认使用网关当前知识库）")
+    build.add_argument("--lists", type=int, default=None, help="倒排簇数量，0 表示不划分")
+    build.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    if np is None:
+        parser.error("需要安装 numpy")
+    url = os.getenv("LUGANG_EMBEDDING_URL")
+    if not url:
+        parser.error("请设置 LUGANG_EMBEDDING_URL")
+    if args.knowledge_base:
+        with open(args.knowledge_base, "r", encoding="utf-8") as f:
+            index = KnowledgeIndex(json.load(f))
+    else:
+        from lugang_connect import KNOWLEDGE_INDEX as index
+    build_vectors(index, args.output, url, os.getenv("LUGANG_EMBEDDING_MODEL", "bge-m3"),
+                  os.getenv("LUGANG_EMBEDDING_API_KEY", ""), args.lists, args.batch_size)
+    print(f"✅ 向量文件已生成: {args.output}（{len(index)} 条）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鲁港通 - 多 worker 启动器
+Lu-Gang Connect - Multi-Worker Launcher
+先启动共享状态进程，再以多个 uvicorn worker 运行网关；各 worker 通过 Unix socket
+共享问答缓存与熔断状态，准入并发上限按 worker 数均分，知识库快照通过 mmap 共享页缓存
+
+用法: python lugang_workers.py --workers 4 --port 8000
+      gunicorn 部署时先运行 python lugang_state.py serve /run/lugang/state.sock，
+      再以 LUGANG_STATE_SOCKET=/run/lugang/state.sock LUGANG_WORKERS=4 启动
+      gunicorn -k uvicorn.workers.UvicornWorker -w 4 lugang_connect:app
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+
+import uvicorn
+
+from lugang_state import run_state_server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _wait_for_socket(path: str, process: multiprocessing.Process, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not process.is_alive():
+            raise RuntimeError("共享状态进程启动失败")
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(path)
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"等待共享状态 socket 超时: {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="鲁港通网关多 worker 模式")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--state-socket", help="共享状态 socket 路径（默认临时目录）")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    socket_path = args.state_socket or os.path.join(tempfile.gettempdir(), f"lugang_state_{args.port}.sock")
+    state_process = multiprocessing.Process(target=run_state_server, args=(socket_path,), name="lugang-state",
+                                            daemon=True)
+    state_process.start()
+    try:
+        _wait_for_socket(socket_path, state_process)
+        # worker 进程继承环境变量
+        os.environ["LUGANG_STATE_SOCKET"] = socket_path
+        os.environ["LUGANG_WORKERS"] = str(args.workers)
+        print(f"🚀 启动鲁港通网关: {args.workers} 个 worker，共享状态 {socket_path}")
+        uvicorn.run("lugang_connect:app", host=args.host, port=args.port, workers=args.workers,
+                    app_dir=HERE, log_level=args.log_level)
+    finally:
+        state_process.terminate()
+        state_process.join(timeout=5)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    main()